@@ -1,8 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from config.config import BOT_MODE
 from bot.handlers.payment import webhook_router
+from bot.donate_api import close_client
+from bot.metrics import registry, CONTENT_TYPE, attach_databases
+
+# Время запросов к БД для /metrics
+attach_databases()
 
 app = FastAPI(title="VPN Bot API")
 app.include_router(webhook_router, prefix="/webhook")
+app.add_event_handler("shutdown", close_client)
+
+# Обновления Telegram (BOT_MODE=webhook); воркеров uvicorn может быть несколько
+if BOT_MODE == 'webhook':
+    from bot.telegram_webhook import telegram_router, startup, shutdown
+    app.include_router(telegram_router)
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus этого процесса"""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Замер пропускной способности распределения обновлений по процессам (bot/update_sharding.py).
+Обработчик имитирует типичное обновление: разбор Update, немного CPU и ожидание БД.
+Печатает обновлений в секунду для разного числа воркеров.
+
+Запуск: python bot/bench_sharding.py [--updates 20000] [--users 500] [--workers 1,2,4]
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.update_sharding import ShardedDispatcher
+
+SIMULATED_IO = 0.002
+SIMULATED_CPU_ROUNDS = 2000
+
+
+def make_update(update_id: int, user_id: int, seq: int) -> bytes:
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': seq,
+            'date': 1700000000,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+            'text': '/home',
+        }
+    }).encode()
+
+
+async def simulated_handler(update: dict):
+    """Разбор Update, работа CPU и ожидание запроса к БД; возвращает (пользователь, номер сообщения)"""
+    from aiogram import types
+    parsed = types.Update.model_validate(update)
+    digest = parsed.message.text.encode()
+    for _ in range(SIMULATED_CPU_ROUNDS):
+        digest = hashlib.sha256(digest).digest()
+    await asyncio.sleep(SIMULATED_IO)
+    return parsed.message.from_user.id, parsed.message.message_id
+
+
+def run(workers: int, updates: int, users: int, collect_results: bool = False) -> tuple:
+    """Прогоняет updates обновлений через workers процессов; возвращает (обновлений в секунду, результаты)"""
+    sharded = ShardedDispatcher(workers, handler='bot.bench_sharding:simulated_handler',
+                                queue_size=updates + 1, collect_results=collect_results)
+    sharded.start()
+    # Прогрев: процессы импортируют aiogram
+    sharded.submit(make_update(0, 0, 0))
+    while sharded.total_processed < 1:
+        time.sleep(0.01)
+
+    payloads = [make_update(i, i % users + 1, i // users) for i in range(1, updates + 1)]
+    started = time.perf_counter()
+    for raw in payloads:
+        sharded.submit(raw)
+    while sharded.total_processed < updates + 1:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    results = []
+    if collect_results:
+        while len(results) < updates + 1:
+            results.append(sharded.results.get())
+    sharded.stop()
+    return updates / elapsed, results
+
+
+def main():
+    args = sys.argv[1:]
+    options = {'--updates': '20000', '--users': '500', '--workers': '1,2,4'}
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            print(f"❌ Неизвестный аргумент: {arg}")
+            return 1
+        options[arg] = args.pop(0)
+
+    updates, users = int(options['--updates']), int(options['--users'])
+    print(f"⏱ {updates} обновлений от {users} пользователей, ядер: {os.cpu_count()}")
+    for workers in (int(value) for value in options['--workers'].split(',')):
+        rate, _ = run(workers, updates, users)
+        print(f"   воркеров {workers}: {rate:.0f} обновлений/с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,412 @@
+"""
+Рассылки администратора.
+Рассылка и ее получатели хранятся в таблицах broadcasts и broadcast_recipients,
+поэтому после перезапуска она продолжается с еще не отправленных. Отправляет
+рассылку один процесс - тот, кто взял аренду (owner, heartbeat_at); если он
+пропал дольше LEASE_TTL, рассылку подхватывает задача планировщика resume_broadcasts.
+
+Сообщения уходят параллельно (BROADCAST_CONCURRENCY), но не чаще BROADCAST_RATE
+в секунду на процесс. RetryAfter останавливает все отправки на указанное время,
+после чего сообщение отправляется повторно; такой повтор не расходует попыток
+MAX_ATTEMPTS, они только для ошибок отправки. Заблокировавшие бота отмечаются
+одним запросом на пакет и в следующие рассылки не попадают. Пауза и отмена
+применяются в этом процессе сразу, из другого процесса - перед следующим пакетом.
+
+Итоги сохраняются после каждого пакета и при остановке процесса; если процесс
+упал, сообщения его последнего пакета могут быть отправлены повторно.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from sqlalchemy import select, update, insert, literal, or_
+
+from config.config import BROADCAST_RATE, BROADCAST_CONCURRENCY
+from db.database import async_session
+from db.models import User, Broadcast, BroadcastRecipient
+from db.service.user_service import set_bot_blocked
+from db.service.segment_service import Segment, segment_conditions
+from bot.metrics import broadcast_messages
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# Дольше самой длинной паузы RetryAfter, чтобы живую рассылку не подхватил другой процесс
+LEASE_TTL = timedelta(minutes=5)
+PROGRESS_INTERVAL = 5.0
+MAX_ATTEMPTS = 3
+
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+PENDING = 'pending'
+SENT = 'sent'
+BLOCKED = 'blocked'
+FAILED = 'failed'
+
+# Из каких статусов можно перейти в новый
+TRANSITIONS = {
+    PAUSED: (RUNNING,),
+    RUNNING: (PAUSED,),
+    CANCELLED: (RUNNING, PAUSED),
+}
+
+
+class SendPacer:
+    """Общий темп отправки: не чаще rate сообщений в секунду, после RetryAfter ждут все"""
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=asyncio.sleep):
+        self.interval = 1.0 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0.0
+        self.paused_until = 0.0
+
+    async def wait(self):
+        while True:
+            now = self.clock()
+            if now < self.paused_until:
+                await self.sleep(self.paused_until - now)
+                continue
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+            if at > now:
+                await self.sleep(at - now)
+            # Пока ждали очереди, Telegram мог попросить паузу
+            if self.clock() >= self.paused_until:
+                return
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+def progress_text(broadcast: Broadcast) -> str:
+    titles = {
+        RUNNING: "📨 Рассылка идет",
+        PAUSED: "⏸ Рассылка на паузе",
+        CANCELLED: "⛔ Рассылка отменена",
+        DONE: "✅ Рассылка завершена",
+    }
+    processed = broadcast.sent + broadcast.blocked + broadcast.failed
+    return (
+        f"{titles.get(broadcast.status, broadcast.status)} (#{broadcast.id})\n"
+        f"Аудитория: {Segment.from_dict(broadcast.segment).describe()}\n\n"
+        f"Обработано: {processed} из {broadcast.total}\n"
+        f"Отправлено: {broadcast.sent}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+def progress_keyboard(broadcast: Broadcast) -> types.InlineKeyboardMarkup:
+    if broadcast.status == RUNNING:
+        row = [types.InlineKeyboardButton(text="⏸ Пауза", callback_data=f"broadcast_pause_{broadcast.id}")]
+    elif broadcast.status == PAUSED:
+        row = [types.InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"broadcast_resume_{broadcast.id}")]
+    else:
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]]
+        )
+    row.append(types.InlineKeyboardButton(text="⛔ Отменить", callback_data=f"broadcast_cancel_{broadcast.id}"))
+    return types.InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+async def update_progress(bot, broadcast: Broadcast):
+    """Обновляет сообщение администратора с прогрессом рассылки"""
+    if not broadcast.admin_chat_id or not broadcast.admin_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            progress_text(broadcast),
+            chat_id=broadcast.admin_chat_id,
+            message_id=broadcast.admin_message_id,
+            reply_markup=progress_keyboard(broadcast)
+        )
+    except TelegramBadRequest as e:
+        # "message is not modified" - прогресс не изменился
+        if 'not modified' not in e.message:
+            logger.warning("Рассылка %s: не удалось обновить прогресс: %s", broadcast.id, e.message)
+    except Exception as e:
+        logger.warning("Рассылка %s: не удалось обновить прогресс: %r", broadcast.id, e)
+
+
+class BroadcastEngine:
+    def __init__(self, session_factory=async_session, rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY, batch_size: int = BATCH_SIZE,
+                 progress_interval: float = PROGRESS_INTERVAL):
+        self.session_factory = session_factory
+        self.pacer = SendPacer(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.tasks: Dict[int, asyncio.Task] = {}
+        # Рассылки, которые в этом процессе поставили на паузу или отменили
+        self.stopping = set()
+
+    async def create(self, text: Optional[str], photo_file_id: Optional[str] = None,
+                     admin_chat_id: Optional[int] = None, admin_message_id: Optional[int] = None,
+                     segment: Optional[Segment] = None) -> Broadcast:
+        """Создает рассылку; получатели сегмента копируются из users одним запросом"""
+        segment = segment or Segment()
+        async with self.session_factory() as session:
+            broadcast = Broadcast(
+                text=text, photo_file_id=photo_file_id, segment=segment.to_dict(), status=RUNNING,
+                admin_chat_id=admin_chat_id, admin_message_id=admin_message_id
+            )
+            session.add(broadcast)
+            await session.flush()
+            result = await session.execute(
+                insert(BroadcastRecipient).from_select(
+                    ['broadcast_id', 'telegram_id', 'status'],
+                    select(literal(broadcast.id), User.telegram_id, literal(PENDING))
+                    .where(*segment_conditions(segment))
+                )
+            )
+            broadcast.total = result.rowcount
+            await session.commit()
+        logger.info("Рассылка %s создана, получателей: %d", broadcast.id, broadcast.total)
+        return broadcast
+
+    async def get(self, broadcast_id: int) -> Optional[Broadcast]:
+        async with self.session_factory() as session:
+            return await session.get(Broadcast, broadcast_id)
+
+    async def set_status(self, broadcast_id: int, status: str) -> bool:
+        """Пауза, продолжение или отмена; False, если из текущего статуса так нельзя"""
+        async with self.session_factory() as session:
+            values = {'status': status}
+            if status == CANCELLED:
+                values['finished_at'] = datetime.utcnow()
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status.in_(TRANSITIONS[status]))
+                .values(**values)
+            )
+            await session.commit()
+        if result.rowcount != 1:
+            return False
+        if status == RUNNING:
+            self.stopping.discard(broadcast_id)
+        else:
+            self.stopping.add(broadcast_id)
+        return True
+
+    def start(self, broadcast_id: int, bot) -> bool:
+        """Запускает отправку в фоне; False, если в этом процессе она уже идет"""
+        task = self.tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            return False
+        task = asyncio.create_task(self.run(broadcast_id, bot))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda finished: self._forget(broadcast_id, finished))
+        return True
+
+    def _forget(self, broadcast_id: int, task: asyncio.Task):
+        if self.tasks.get(broadcast_id) is task:
+            del self.tasks[broadcast_id]
+
+    async def resume(self, bot) -> list:
+        """Запускает рассылки в статусе running, которые никто не отправляет (например, после перезапуска)"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(Broadcast.id).where(
+                    Broadcast.status == RUNNING,
+                    or_(Broadcast.owner.is_(None), Broadcast.heartbeat_at < datetime.utcnow() - LEASE_TTL)
+                )
+            )
+            broadcast_ids = result.scalars().all()
+        return [broadcast_id for broadcast_id in broadcast_ids if self.start(broadcast_id, bot)]
+
+    async def close(self):
+        """Останавливает отправку в этом процессе; рассылки продолжит следующий запуск"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------------------- отправка ----------------------
+
+    async def _claim(self, broadcast_id: int) -> bool:
+        now = datetime.utcnow()
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == RUNNING,
+                    or_(
+                        Broadcast.owner.is_(None),
+                        Broadcast.owner == self.owner,
+                        Broadcast.heartbeat_at < now - LEASE_TTL
+                    )
+                )
+                .values(owner=self.owner, heartbeat_at=now)
+            )
+            await session.commit()
+        return result.rowcount == 1
+
+    async def run(self, broadcast_id: int, bot):
+        if not await self._claim(broadcast_id):
+            return
+        self.stopping.discard(broadcast_id)
+        broadcast = await self.get(broadcast_id)
+        logger.info("Рассылка %s: отправка начата (%s)", broadcast_id, self.owner)
+        progress_at = 0.0
+        # Итоги текущего пакета: при остановке процесса сохраняются в finally
+        results = {}
+        try:
+            while broadcast_id not in self.stopping:
+                async with self.session_factory() as session:
+                    result = await session.execute(
+                        select(BroadcastRecipient.telegram_id)
+                        .where(BroadcastRecipient.broadcast_id == broadcast_id,
+                               BroadcastRecipient.status == PENDING)
+                        .order_by(BroadcastRecipient.telegram_id)
+                        .limit(self.batch_size)
+                    )
+                    recipients = result.scalars().all()
+                if not recipients:
+                    await self._finish(broadcast_id)
+                    break
+
+                await self._send_batch(bot, broadcast, recipients, results)
+                status = await self._save(broadcast_id, results)
+                results = {}
+                if status != RUNNING:
+                    break
+                if time.monotonic() - progress_at >= self.progress_interval:
+                    progress_at = time.monotonic()
+                    await update_progress(bot, await self.get(broadcast_id))
+        finally:
+            if results:
+                await self._save(broadcast_id, results)
+            await self._release(broadcast_id)
+            self.stopping.discard(broadcast_id)
+        broadcast = await self.get(broadcast_id)
+        logger.info("Рассылка %s: %s, отправлено %d, заблокировали %d, ошибок %d",
+                    broadcast_id, broadcast.status, broadcast.sent, broadcast.blocked, broadcast.failed)
+        await update_progress(bot, broadcast)
+
+    async def _send_batch(self, bot, broadcast: Broadcast, recipients, results: Dict[int, Tuple[str, Optional[str]]]):
+        pending = list(reversed(recipients))
+
+        async def worker():
+            while pending and broadcast.id not in self.stopping:
+                telegram_id = pending.pop()
+                results[telegram_id] = await self._send_one(bot, broadcast, telegram_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)))))
+
+    async def _send_one(self, bot, broadcast: Broadcast, telegram_id: int) -> Tuple[str, Optional[str]]:
+        error = None
+        attempt = 0
+        while attempt < MAX_ATTEMPTS:
+            await self.pacer.wait()
+            try:
+                if broadcast.photo_file_id:
+                    await bot.send_photo(telegram_id, photo=broadcast.photo_file_id, caption=broadcast.text)
+                else:
+                    await bot.send_message(telegram_id, text=broadcast.text)
+                broadcast_messages.inc(SENT)
+                return SENT, None
+            except TelegramRetryAfter as e:
+                # Лимит общий для бота: ждут все отправки, а не только эта.
+                # Получатель тут ни при чем, поэтому попытка не засчитывается
+                broadcast_messages.inc('retry_after')
+                logger.warning("Рассылка %s: RetryAfter %s сек", broadcast.id, e.retry_after)
+                self.pacer.pause(e.retry_after)
+                if broadcast.id in self.stopping:
+                    # Рассылку остановили - получатель останется в очереди
+                    return PENDING, None
+            except TelegramForbiddenError as e:
+                broadcast_messages.inc(BLOCKED)
+                return BLOCKED, e.message
+            except TelegramBadRequest as e:
+                # chat not found и подобное: повтор не поможет
+                broadcast_messages.inc(FAILED)
+                return FAILED, e.message
+            except Exception as e:
+                error = repr(e)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                attempt += 1
+        broadcast_messages.inc(FAILED)
+        return FAILED, error
+
+    async def _save(self, broadcast_id: int, results) -> Optional[str]:
+        """Сохраняет итоги пакета и продлевает аренду; текущий статус или None, если аренду забрали"""
+        by_status = defaultdict(list)
+        errors = defaultdict(list)
+        for telegram_id, (status, error) in results.items():
+            by_status[status].append(telegram_id)
+            if status == FAILED:
+                errors[(error or '')[:200]].append(telegram_id)
+
+        async with self.session_factory() as session:
+            for status in (SENT, BLOCKED):
+                if by_status[status]:
+                    await session.execute(
+                        update(BroadcastRecipient)
+                        .where(BroadcastRecipient.broadcast_id == broadcast_id,
+                               BroadcastRecipient.telegram_id.in_(by_status[status]))
+                        .values(status=status)
+                    )
+            for error, telegram_ids in errors.items():
+                await session.execute(
+                    update(BroadcastRecipient)
+                    .where(BroadcastRecipient.broadcast_id == broadcast_id,
+                           BroadcastRecipient.telegram_id.in_(telegram_ids))
+                    .values(status=FAILED, error=error)
+                )
+            await set_bot_blocked(session, by_status[BLOCKED])
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.owner == self.owner)
+                .values(
+                    sent=Broadcast.sent + len(by_status[SENT]),
+                    blocked=Broadcast.blocked + len(by_status[BLOCKED]),
+                    failed=Broadcast.failed + len(by_status[FAILED]),
+                    heartbeat_at=datetime.utcnow()
+                )
+            )
+            owned = result.rowcount == 1
+            status = await session.scalar(select(Broadcast.status).where(Broadcast.id == broadcast_id))
+            await session.commit()
+
+        if not owned:
+            logger.warning("Рассылка %s: аренду забрал другой процесс, останавливаюсь", broadcast_id)
+            return None
+        return status
+
+    async def _finish(self, broadcast_id: int):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == RUNNING)
+                .values(status=DONE, finished_at=datetime.utcnow())
+            )
+            await session.commit()
+
+    async def _release(self, broadcast_id: int):
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.owner == self.owner)
+                .values(owner=None)
+            )
+            await session.commit()
+
+
+broadcast_engine = BroadcastEngine()
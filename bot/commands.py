@@ -3,11 +3,12 @@ from aiogram.enums import ParseMode
 import asyncio
 
 
-async def set_bot_commands(bot: Bot):
-    commands = [
-        types.BotCommand(command="start", description="Запуск бота"),
-        types.BotCommand(command="home", description="Меню домой")
-        # types.BotCommand(command="update_sub", description="Обновить подписку")
-    ]
+BOT_COMMANDS = [
+    types.BotCommand(command="start", description="Запуск бота"),
+    types.BotCommand(command="home", description="Меню домой")
+    # types.BotCommand(command="update_sub", description="Обновить подписку")
+]
+
 
-    await bot.set_my_commands(commands)
+async def set_bot_commands(bot: Bot):
+    await bot.set_my_commands(BOT_COMMANDS)
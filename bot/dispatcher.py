@@ -0,0 +1,41 @@
+"""
+Бот и диспетчер с middleware и обработчиками.
+Общие для режима long polling (main.py) и webhook (api.py).
+"""
+
+from aiogram import Bot, Dispatcher
+from aiogram.enums import ParseMode
+from config.config import BOT_TOKEN, DB_PROFILE, THROTTLE_ENABLED
+from bot.handlers import register_handlers
+from bot.middleware import SubscriptionMiddleware, QueryProfilerMiddleware, ThrottlingMiddleware, \
+    HandlerMetricsMiddleware
+from bot.metrics import instrument_bot, register_handler_labels
+from bot.commands import BOT_COMMANDS
+from bot.fsm_storage import create_storage
+
+bot = instrument_bot(Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML))
+dp = Dispatcher(storage=create_storage())
+
+# Метрики обработчиков: снаружи, чтобы замер включал все остальные middleware
+dp.message.outer_middleware(HandlerMetricsMiddleware())
+dp.callback_query.outer_middleware(HandlerMetricsMiddleware())
+
+# Добавляем middleware
+dp.message.middleware(SubscriptionMiddleware())
+
+# Антифлуд: один экземпляр, чтобы сообщения и нажатия тратили общие корзины
+if THROTTLE_ENABLED:
+    throttling_middleware = ThrottlingMiddleware()
+    dp.message.middleware(throttling_middleware)
+    dp.callback_query.middleware(throttling_middleware)
+
+# Профилирование SQL-запросов по обработчикам
+if DB_PROFILE:
+    dp.message.middleware(QueryProfilerMiddleware())
+    dp.callback_query.middleware(QueryProfilerMiddleware())
+
+# Регистрируем обработчики
+register_handlers(dp)
+
+# Метки метрик - только команды и callback_data, которые есть в обработчиках
+register_handler_labels(dp, BOT_COMMANDS)
@@ -1,13 +1,107 @@
-from config.config import WATA_JWT_TOKEN, WATA_DONATE_URL, VPN_PRICE, BOT_LINK
+from config.config import WATA_JWT_TOKEN, WATA_DONATE_URL, VPN_PRICE, BOT_LINK, WATA_TIMEOUT, WATA_MAX_RETRIES
 from typing import Optional, Dict, Any, List, Union
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import asyncio
+import time
 import httpx
 import uuid
+import base64
 import logging
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from bot.metrics import TimedTransport
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Срок жизни платежной ссылки WATA
+LINK_LIFETIME = timedelta(days=2)
+
+# Пауза после 429, если WATA не прислал Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+# Дольше этого не ждем окончания паузы внутри запроса пользователя
+MAX_RETRY_AFTER_WAIT = 5.0
+
+
+class WataRateLimited(Exception):
+    """WATA ограничил частоту запросов, retry_after - сколько секунд ждать"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"WATA rate limited for {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Общая для всех запросов пауза после ответа 429 от WATA"""
+
+    def __init__(self):
+        self.blocked_until = 0.0
+
+    def remaining(self) -> float:
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+wata_limiter = RateLimiter()
+
+# Общий пул соединений с WATA: keep-alive и TLS переиспользуются между запросами
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WATA_TIMEOUT, connect=5.0),
+            # Лимиты пула задаются транспорту: с явным transport клиент их не применяет
+            transport=TimedTransport(
+                'wata', base_url=WATA_DONATE_URL,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Retry-After бывает числом секунд или HTTP-датой"""
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def verify_webhook_signature(raw_body: bytes, signature: str, public_key_pem: str) -> bool:
+    """
+    Проверяет подпись webhook WATA: заголовок X-Signature содержит
+    base64 подписи RSA SHA512 от тела запроса
+    """
+    if not signature or not public_key_pem:
+        return False
+    try:
+        public_key = serialization.load_pem_public_key(public_key_pem.encode())
+        public_key.verify(base64.b64decode(signature), raw_body, padding.PKCS1v15(), hashes.SHA512())
+        return True
+    except (InvalidSignature, ValueError, TypeError):
+        return False
+
+
 class DonateApi:
     def __init__(self):
         self.jwt_token = WATA_JWT_TOKEN
@@ -17,16 +111,50 @@ class DonateApi:
             "Authorization": f"Bearer {self.jwt_token}"
         }
 
+    async def _request(self, method: str, path: str, wait_on_limit: bool = True, **kwargs) -> httpx.Response:
+        """
+        Запрос к WATA через общий клиент.
+        5xx и сетевые ошибки повторяются с экспоненциальной паузой, 429 ставит общую паузу
+        по Retry-After. Если пауза длиннее MAX_RETRY_AFTER_WAIT (или wait_on_limit=False),
+        бросает WataRateLimited, не отправляя запрос.
+        """
+        for attempt in range(WATA_MAX_RETRIES + 1):
+            delay = wata_limiter.remaining()
+            if delay:
+                if not wait_on_limit or delay > MAX_RETRY_AFTER_WAIT:
+                    raise WataRateLimited(delay)
+                await asyncio.sleep(delay)
+
+            try:
+                response = await get_client().request(method, f'{self.base_url}{path}', headers=self.headers, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == WATA_MAX_RETRIES:
+                    raise
+                logger.warning("WATA %s %s: %r, повтор %d", method, path, e, attempt + 1)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                wata_limiter.block(retry_after)
+                logger.warning("WATA %s %s: 429, пауза %.1f сек", method, path, retry_after)
+                continue
+            if response.status_code >= 500 and attempt < WATA_MAX_RETRIES:
+                logger.warning("WATA %s %s: %d, повтор %d", method, path, response.status_code, attempt + 1)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+
+            response.raise_for_status()
+            return response
+
+        raise WataRateLimited(wata_limiter.remaining())
+
     async def create_donate_url(self, payment_id: int, amount=VPN_PRICE) -> Optional[Dict[str, Any]]:
         """
         Создает ссылку для оплаты через WATA
         payment_id используется как orderId для связи с webhook
         """
-        print(f'{self.jwt_token}')
-        print(f'{self.headers}')
-        expire = datetime.utcnow() + timedelta(days=2)
-        print(f'{expire.isoformat()}')
-
+        expire = datetime.utcnow() + LINK_LIFETIME
         content = {
             'amount': amount,
             'currency': 'RUB',
@@ -34,38 +162,56 @@ class DonateApi:
             'successRedirectUrl': BOT_LINK,
             'expirationDateTime': expire.isoformat() + 'Z'  # ISO формат с UTC
         }
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url=f'{self.base_url}/links',
-                    headers=self.headers,
-                    json=content
-                )
-                logger.info(f"Response text: {response.text}")
-                response.raise_for_status()
-                return response.json()
+            response = await self._request('POST', '/links', json=content)
+        except WataRateLimited as e:
+            logger.warning("Ссылка для заказа %s не создана: WATA просит подождать %.1f сек", payment_id, e.retry_after)
+            return None
+        except httpx.HTTPStatusError as e:
+            logger.error("Ошибка создания ссылки для заказа %s: %d %s",
+                         payment_id, e.response.status_code, e.response.text)
+            return None
         except httpx.HTTPError as e:
-            logger.error(f"Error creating donate url: {e}")
-            if 'response' in locals():
-                logger.error(f"Response text: {response.text}")
-                try:
-                    logger.error(f"Response JSON: {response.json()}")
-                except ValueError:
-                    logger.error("Response is not JSON")
+            logger.error("Ошибка создания ссылки для заказа %s: %r", payment_id, e)
             return None
 
+        logger.info("Ссылка WATA для заказа %s создана за %.0f мс",
+                    payment_id, (time.perf_counter() - started) * 1000)
+        logger.debug("Ответ WATA: %s", response.text)
+        return response.json()
+
+    async def get_link(self, wata_id: uuid) -> Optional[Dict[str, Any]]:
+        """
+        Ссылка для оплаты по ID без обработки ошибок; None - WATA такой ссылки не знает (404).
+        При ограничении частоты бросает WataRateLimited, при остальных ошибках - httpx.HTTPError
+        """
+        try:
+            response = await self._request('GET', f'/links/{wata_id}', wait_on_limit=False)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+        return response.json()
+
     async def find_donate_url(self, wata_id: uuid) -> Optional[Dict[str, Any]]:
-        """Получает информацию о ссылке для оплаты по ID"""
+        """Получает информацию о ссылке для оплаты по ID; {'status': 'Time'} при ограничении частоты"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    url=f'{self.base_url}/links/{wata_id}',
-                    headers=self.headers
-                )
-                if response.status_code == 429:
-                    return {'status': 'Time'}
-                response.raise_for_status()
-                return response.json()
+            link = await self.get_link(wata_id)
+        except WataRateLimited:
+            return {'status': 'Time'}
         except httpx.HTTPError as e:
-            print(f"Error getting donate url with id {wata_id}: {e}")
+            logger.error("Ошибка получения ссылки %s: %r", wata_id, e)
+            return None
+        if link is None:
+            logger.error("Ссылка %s не найдена в WATA", wata_id)
+        return link
+
+    async def get_public_key(self) -> Optional[str]:
+        """Получает публичный ключ WATA для проверки подписи webhook"""
+        try:
+            response = await self._request('GET', '/public-key')
+            return response.json().get('value')
+        except (WataRateLimited, httpx.HTTPError) as e:
+            logger.error("Ошибка получения публичного ключа WATA: %r", e)
             return None
@@ -0,0 +1,141 @@
+"""
+Хранилище FSM aiogram в базе данных (таблица fsm_states).
+Состояния админских сценариев переживают перезапуск и общие для нескольких
+экземпляров бота. Запись идет сразу в БД и строится по строке, прочитанной
+под блокировкой (SELECT ... FOR UPDATE), а не по кэшу, поэтому одновременные
+записи экземпляров не затирают друг друга. Чтение идет через небольшой кэш в
+памяти на FSM_CACHE_TTL секунд, и get_state/get_data в обработчиках обычно не
+делают запросов. Кэш сбрасывается только в своем процессе, поэтому при нескольких
+экземплярах бота или воркерах обновлений create_storage его выключает.
+Состояния, не менявшиеся дольше FSM_STATE_TTL, считаются сброшенными и удаляются
+задачей планировщика. Таблицу создает миграция db/migrations/add_fsm_states.py.
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+
+from config.config import FSM_STORAGE, FSM_STATE_TTL, FSM_CACHE_TTL, BOT_MODE, BOT_REPLICAS, UPDATE_WORKERS
+from db.database import async_session
+from db.models import FsmState
+
+
+def storage_key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class DatabaseStorage(BaseStorage):
+    def __init__(self, session_factory=async_session, state_ttl: float = FSM_STATE_TTL,
+                 cache_ttl: float = FSM_CACHE_TTL):
+        self.session_factory = session_factory
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.cache = {}  # ключ -> (состояние, данные, время чтения time.monotonic)
+
+    def _fresh_since(self) -> Optional[datetime]:
+        return datetime.utcnow() - timedelta(seconds=self.state_ttl) if self.state_ttl else None
+
+    async def _load(self, key: str) -> tuple:
+        """(состояние, данные) из кэша или из БД"""
+        cached = self.cache.get(key)
+        if cached and time.monotonic() - cached[2] < self.cache_ttl:
+            return cached[0], cached[1]
+
+        async with self.session_factory() as session:
+            query = select(FsmState.state, FsmState.data).where(FsmState.key == key)
+            since = self._fresh_since()
+            if since:
+                query = query.where(FsmState.updated_at >= since)
+            row = (await session.execute(query)).one_or_none()
+        state, data = (row[0], dict(row[1] or {})) if row else (None, {})
+        self.cache[key] = (state, data, time.monotonic())
+        return state, data
+
+    async def _save(self, key: str, values: dict, merge: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Пишет поля values (state, data) поверх строки из БД, прочитанной под блокировкой;
+        merge дописывается к ее данным. Пустые состояние и данные удаляют строку.
+        Возвращает итоговые данные
+        """
+        for attempt in range(2):
+            async with self.session_factory() as session:
+                row = (await session.execute(
+                    select(FsmState).where(FsmState.key == key).with_for_update()
+                )).scalar_one_or_none()
+                since = self._fresh_since()
+                # Устаревшее состояние считается сброшенным
+                fresh = row is not None and not (since and row.updated_at < since)
+                state = values.get('state', row.state if fresh else None)
+                data = dict(values.get('data', row.data if fresh else None) or {})
+                data.update(merge or {})
+
+                if state is None and not data:
+                    if row is not None:
+                        await session.delete(row)
+                elif row is not None:
+                    row.state, row.data, row.updated_at = state, data, datetime.utcnow()
+                else:
+                    session.add(FsmState(key=key, state=state, data=data, updated_at=datetime.utcnow()))
+                try:
+                    await session.commit()
+                except IntegrityError:
+                    # Строку одновременно создал другой экземпляр бота - повторяем поверх нее
+                    await session.rollback()
+                    if attempt:
+                        raise
+                    continue
+            self.cache[key] = (state, data, time.monotonic())
+            return dict(data)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._save(storage_key(key), {'state': state.state if isinstance(state, State) else state})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(storage_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._save(storage_key(key), {'data': dict(data)})
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(storage_key(key))
+        return dict(data)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Дописываем к данным из БД, а не к копии из кэша (как в BaseStorage)
+        return await self._save(storage_key(key), {}, merge=data)
+
+    async def cleanup(self) -> int:
+        """Удаляет состояния старше state_ttl; возвращает число удаленных"""
+        since = self._fresh_since()
+        if since is None:
+            return 0
+        async with self.session_factory() as session:
+            result = await session.execute(delete(FsmState).where(FsmState.updated_at < since))
+            await session.commit()
+        now = time.monotonic()
+        for key, (_, _, cached_at) in list(self.cache.items()):
+            if now - cached_at >= self.cache_ttl:
+                del self.cache[key]
+        return result.rowcount
+
+    async def close(self) -> None:
+        self.cache.clear()
+
+
+def create_storage() -> BaseStorage:
+    """
+    Хранилище FSM по настройке FSM_STORAGE: db (по умолчанию) или memory.
+    Если обновления обрабатывают несколько процессов (BOT_REPLICAS, воркеры
+    UPDATE_WORKERS, воркеры uvicorn в режиме webhook), кэш чтения выключается
+    """
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    shared = BOT_REPLICAS > 1 or UPDATE_WORKERS > 1 or BOT_MODE == 'webhook'
+    return DatabaseStorage(cache_ttl=0 if shared else FSM_CACHE_TTL)
@@ -2,9 +2,9 @@ from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import Bot
-from sqlalchemy import select, delete, update
+from sqlalchemy import select, delete, update, func
 from datetime import datetime, timezone
-from db.database import async_session
+from db.database import async_session, read_session
 from db.models import User, Payment, Server
 from bot.handlers.home import process_home_action
 from bot.vpn_manager import VPNManager
@@ -15,6 +15,9 @@ from db.service.server_service import (
     get_servers_statistics, get_server_users_count, get_server_active_users_count,
     get_active_servers, reassign_users_to_server
 )
+from db.service.stats_service import get_latest_stats, get_period_stats
+from db.service.segment_service import Segment, count_segment
+from bot.broadcast import broadcast_engine, update_progress, RUNNING, PAUSED, CANCELLED
 import asyncio
 
 router = Router()
@@ -59,11 +62,14 @@ async def admin_handler(message: types.Message):
             [
                 types.InlineKeyboardButton(text="🖥️ Управление серверами", callback_data="admin_servers")
             ],
+            [
+                types.InlineKeyboardButton(text="📈 Статистика", callback_data="admin_stats")
+            ],
             [
                 types.InlineKeyboardButton(text="📊 Синхронизация Google Sheets", callback_data="admin_sync_sheets")
             ],
             [
-                types.InlineKeyboardButton(text="✉️ Отправить сообщение всем пользователям", callback_data="init_mailing")
+                types.InlineKeyboardButton(text="✉️ Рассылка пользователям", callback_data="init_mailing")
             ],
             [
                 types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")
@@ -90,11 +96,14 @@ async def admin_panel(callback: types.CallbackQuery):
             [
                 types.InlineKeyboardButton(text="🖥️ Управление серверами", callback_data="admin_servers")
             ],
+            [
+                types.InlineKeyboardButton(text="📈 Статистика", callback_data="admin_stats")
+            ],
             [
                 types.InlineKeyboardButton(text="📊 Синхронизация Google Sheets", callback_data="admin_sync_sheets")
             ],
             [
-                types.InlineKeyboardButton(text="✉️ Отправить сообщение всем пользователям", callback_data="init_mailing")
+                types.InlineKeyboardButton(text="✉️ Рассылка пользователям", callback_data="init_mailing")
             ],
             [
                 types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")
@@ -127,7 +136,7 @@ async def list_users_page(callback: types.CallbackQuery, page: int = None):
     users_per_page = 10
     offset = (page - 1) * users_per_page
     
-    async with async_session() as session:
+    async with read_session() as session:
         # Get total count of users
         count_result = await session.execute(select(User))
         total_users = len(count_result.scalars().all())
@@ -610,13 +619,89 @@ async def delete_user_process(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer()
 
 
+# Готовые сегменты аудитории: callback_data mail_segment_<ключ>
+SEGMENT_PRESETS = {
+    'all': ("👥 Все пользователи", Segment()),
+    'active': ("✅ С активной подпиской", Segment(active=True)),
+    'expiring_3': ("⏳ Подписка истекает за 3 дня", Segment(expiring_within_days=3)),
+    'expiring_7': ("⏳ Подписка истекает за 7 дней", Segment(expiring_within_days=7)),
+    'inactive': ("💤 Без активной подписки", Segment(active=False)),
+    'trial_unused': ("🎁 Не брали пробный период", Segment(trial_used=False)),
+    'never_paid': ("💸 Ни разу не платили", Segment(paid=False)),
+}
+
+
 @router.callback_query(F.data == "init_mailing")
 async def init_mail_everyone(callback: types.CallbackQuery, state: FSMContext):
     if callback.from_user.username not in ADMINS:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
 
+    await state.clear()
+
+    keyboard = [
+        [types.InlineKeyboardButton(text=title, callback_data=f"mail_segment_{key}")]
+        for key, (title, _) in SEGMENT_PRESETS.items()
+    ]
+    keyboard.append([types.InlineKeyboardButton(text="🖥️ По серверу", callback_data="mail_segment_servers")])
+    keyboard.append([types.InlineKeyboardButton(text="◀️ Отмена", callback_data="admin_panel")])
+
+    await callback.message.edit_text(
+        "Кому отправить рассылку?",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "mail_segment_servers")
+async def mail_segment_servers(callback: types.CallbackQuery):
+    if callback.from_user.username not in ADMINS:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+
+    async with read_session() as session:
+        servers = await get_all_servers(session)
+
+    keyboard = [
+        [types.InlineKeyboardButton(text=f"🖥️ {server.name}", callback_data=f"mail_segment_server_{server.id}")]
+        for server in servers
+    ]
+    keyboard.append([types.InlineKeyboardButton(text="◀️ Назад", callback_data="init_mailing")])
+
+    await callback.message.edit_text(
+        "Выберите сервер:",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("mail_segment_"))
+async def mail_segment_chosen(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.username not in ADMINS:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+
+    key = callback.data[len("mail_segment_"):]
+    if key.startswith("server_"):
+        segment = Segment(server_id=int(key[len("server_"):]))
+    else:
+        segment = SEGMENT_PRESETS[key][1]
+
+    async with read_session() as session:
+        recipients = await count_segment(session, segment)
+
+    if not recipients:
+        await callback.message.edit_text(
+            f"Аудитория: {segment.describe()}\n\nВ сегменте нет пользователей.",
+            reply_markup=types.InlineKeyboardMarkup(
+                inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="init_mailing")]]
+            )
+        )
+        await callback.answer()
+        return
+
     await state.set_state(AdminStates.mail_type_choice)
+    await state.update_data(segment=segment.to_dict())
 
     keyboard = types.InlineKeyboardMarkup(
         inline_keyboard=[
@@ -627,12 +712,14 @@ async def init_mail_everyone(callback: types.CallbackQuery, state: FSMContext):
                 types.InlineKeyboardButton(text="🖼️ Текст с картинкой", callback_data="mail_with_photo")
             ],
             [
-                types.InlineKeyboardButton(text="◀️ Отмена", callback_data="admin_panel")
+                types.InlineKeyboardButton(text="◀️ Назад", callback_data="init_mailing")
             ]
         ]
     )
 
     await callback.message.edit_text(
+        f"Аудитория: {segment.describe()}\n"
+        f"Получателей: {recipients}\n\n"
         "Выберите тип сообщения для рассылки:",
         reply_markup=keyboard
     )
@@ -645,36 +732,42 @@ async def mail_everyone(message: types.Message, state: FSMContext):
         await message.answer("Доступ запрещен", show_alert=True)
         return
 
-    mail = message.text
-
+    data = await state.get_data()
     await state.clear()
+    await start_broadcast(message, text=message.text, segment=Segment.from_dict(data.get("segment")))
+
+
+async def start_broadcast(message: types.Message, text: str, segment: Segment, photo_file_id: str = None):
+    """Создает рассылку по сегменту и запускает ее в фоне; прогресс обновляется в отдельном сообщении"""
+    progress = await message.answer("📨 Готовлю рассылку...")
+    broadcast = await broadcast_engine.create(
+        text=text,
+        photo_file_id=photo_file_id,
+        admin_chat_id=progress.chat.id,
+        admin_message_id=progress.message_id,
+        segment=segment
+    )
+    await update_progress(bot, broadcast)
+    broadcast_engine.start(broadcast.id, bot)
 
-    async with async_session() as session:
-        result = await session.execute(select(User))
-        users = result.scalars().all()
 
-        success_count = 0
-        error_count = 0
+@router.callback_query(F.data.startswith("broadcast_"))
+async def broadcast_control(callback: types.CallbackQuery):
+    if callback.from_user.username not in ADMINS:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
 
-        for user in users:
-            try:
-                await bot.send_message(
-                    user.telegram_id,
-                    text=mail
-                )
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                print(f"Error sending message to user {user.username}: {e}")
+    _, action, broadcast_id = callback.data.split("_")
+    broadcast_id = int(broadcast_id)
+    status = {'pause': PAUSED, 'resume': RUNNING, 'cancel': CANCELLED}[action]
 
-        await message.answer(
-            f"Текстовое сообщение отправлено!\n"
-            f"Успешно: {success_count}\n"
-            f"Ошибок: {error_count}",
-            reply_markup=types.InlineKeyboardMarkup(
-                inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]]
-            )
-        )
+    if not await broadcast_engine.set_status(broadcast_id, status):
+        await callback.answer("Рассылка уже завершена или ее статус изменился", show_alert=True)
+    else:
+        if status == RUNNING:
+            broadcast_engine.start(broadcast_id, bot)
+        await callback.answer()
+    await update_progress(bot, await broadcast_engine.get(broadcast_id))
 
 
 @router.callback_query(F.data.startswith("mail_user_"))
@@ -796,39 +889,10 @@ async def mail_photo_with_text(message: types.Message, state: FSMContext):
         await message.answer("Доступ запрещен", show_alert=True)
         return
 
-    text = message.text
     data = await state.get_data()
-    photo_file_id = data.get("photo_file_id")
-
     await state.clear()
-
-    async with async_session() as session:
-        result = await session.execute(select(User))
-        users = result.scalars().all()
-
-        success_count = 0
-        error_count = 0
-
-        for user in users:
-            try:
-                await bot.send_photo(
-                    user.telegram_id,
-                    photo=photo_file_id,
-                    caption=text
-                )
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                print(f"Error sending message to user {user.username}: {e}")
-
-        await message.answer(
-            f"Сообщение с картинкой отправлено!\n"
-            f"Успешно: {success_count}\n"
-            f"Ошибок: {error_count}",
-            reply_markup=types.InlineKeyboardMarkup(
-                inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]]
-            )
-        )
+    await start_broadcast(message, text=message.text, segment=Segment.from_dict(data.get("segment")),
+                          photo_file_id=data.get("photo_file_id"))
 
 
 # ======================== УПРАВЛЕНИЕ СЕРВЕРАМИ ========================
@@ -839,7 +903,7 @@ async def admin_servers_menu(callback: types.CallbackQuery):
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     
-    async with async_session() as session:
+    async with read_session() as session:
         stats = await get_servers_statistics(session)
         default_server = await get_default_server(session)
 
@@ -1323,7 +1387,7 @@ async def edit_server_handler(callback: types.CallbackQuery, state: FSMContext):
             await callback.answer("❌ Сервер не найден", show_alert=True)
             return
         
-        await state.update_data(server_id=server_id, page=page, original_server=server)
+        await state.update_data(server_id=server_id, page=page)
         
         # Меню выбора что редактировать
         keyboard = types.InlineKeyboardMarkup(
@@ -1526,7 +1590,7 @@ async def delete_server_handler(callback: types.CallbackQuery, state: FSMContext
         users_count = await get_server_users_count(session, server_id)
         active_users_count = await get_server_active_users_count(session, server_id)
         
-        await state.update_data(server_id=server_id, page=page, server=server)
+        await state.update_data(server_id=server_id, page=page)
         await state.set_state(AdminStates.confirm_delete_server)
         
         if users_count > 0:
@@ -1758,29 +1822,56 @@ async def confirm_force_delete(message: types.Message, state: FSMContext):
     
     await state.clear()
 
+@router.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: types.CallbackQuery):
+    if callback.from_user.username not in ADMINS:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+
+    async with read_session() as session:
+        latest = await get_latest_stats(session)
+        week = await get_period_stats(session, days=7)
+
+    if latest is None:
+        text = "📈 Статистика еще не рассчитана, она появится после ближайшего запуска сводки"
+    else:
+        text = "📈 Статистика\n\n"
+        text += f"👥 Всего пользователей: {latest.total_users}\n"
+        text += f"✅ С активной подпиской: {latest.active_users}\n"
+        text += f"💳 Всего платежей: {latest.total_payments}\n\n"
+        text += f"📅 За 7 дней (с {week['since'].strftime('%d.%m.%Y')}):\n"
+        text += f"🆕 Новых пользователей: {week['new_users']} (пробный период: {week['trials']})\n"
+        text += (
+            f"🔄 Продлений: 1 мес. - {week['renewals'][1]}, "
+            f"3 мес. - {week['renewals'][3]}, 6 мес. - {week['renewals'][6]}\n"
+        )
+        text += f"📉 Отток: {week['churned']}\n"
+        for system, (count, revenue) in week['revenue'].items():
+            text += f"💰 {system}: {int(revenue)} ₽ ({count} платежей)\n"
+        text += f"\n🕒 Обновлено: {latest.updated_at.strftime('%d.%m.%Y %H:%M')} UTC"
+
+    keyboard = types.InlineKeyboardMarkup(
+        inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel")]]
+    )
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
 @router.callback_query(F.data == "admin_sync_sheets")
 async def admin_sync_sheets_menu(callback: types.CallbackQuery):
     if callback.from_user.username not in ADMINS:
         await callback.answer("Доступ запрещен", show_alert=True)
         return
     
-    # Получаем статистику БД для отображения
-    async with async_session() as session:
-        # Пользователи
-        users_result = await session.execute(select(User))
-        users_count = len(users_result.scalars().all())
-        
-        # Активные пользователи
-        active_users_result = await session.execute(select(User).where(User.is_active == True))
-        active_users_count = len(active_users_result.scalars().all())
-        
-        # Платежи
-        payments_result = await session.execute(select(Payment))
-        payments_count = len(payments_result.scalars().all())
-        
-        # Серверы
-        servers_result = await session.execute(select(Server))
-        servers_count = len(servers_result.scalars().all())
+    # Статистику берем из дневной сводки, без полного просмотра таблиц
+    async with read_session() as session:
+        stats = await get_latest_stats(session)
+        if stats:
+            users_count, active_users_count, payments_count = stats.total_users, stats.active_users, stats.total_payments
+        else:
+            users_count = await session.scalar(select(func.count(User.id)))
+            active_users_count = await session.scalar(select(func.count(User.id)).where(User.is_active == True))
+            payments_count = await session.scalar(select(func.count(Payment.id)))
+        servers_count = await session.scalar(select(func.count(Server.id)))
     
     text = "📊 Синхронизация с Google Sheets\n\n"
     text += "📈 Текущая статистика базы данных:\n"
@@ -1788,10 +1879,14 @@ async def admin_sync_sheets_menu(callback: types.CallbackQuery):
     text += f"✅ Активных пользователей: {active_users_count}\n"
     text += f"💳 Всего платежей: {payments_count}\n"
     text += f"🖥️ Всего серверов: {servers_count}\n\n"
-    text += "⚠️ Внимание: Синхронизация полностью очистит Google Sheets и запишет все данные заново"
+    text += "ℹ️ «Синхронизировать изменения» выгружает только строки, измененные с прошлой синхронизации.\n"
+    text += "⚠️ Полная синхронизация перезапишет Google Sheets всеми данными заново"
     
     keyboard = types.InlineKeyboardMarkup(
         inline_keyboard=[
+            [
+                types.InlineKeyboardButton(text="🔁 Синхронизировать изменения", callback_data="start_delta_sync")
+            ],
             [
                 types.InlineKeyboardButton(text="🚀 Запустить полную синхронизацию", callback_data="start_full_sync")
             ],
@@ -1813,6 +1908,24 @@ async def admin_sync_sheets_menu(callback: types.CallbackQuery):
     await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
+@router.callback_query(F.data == "start_delta_sync")
+async def start_delta_sync_handler(callback: types.CallbackQuery):
+    if callback.from_user.username not in ADMINS:
+        await callback.answer("Доступ запрещен", show_alert=True)
+        return
+    
+    await callback.answer("🔁 Выгружаю изменения...")
+    
+    await callback.message.edit_text(
+        "🔁 Выгрузка изменений в Google Sheets...\n\n"
+        "⏳ Пожалуйста, подождите",
+        reply_markup=types.InlineKeyboardMarkup(
+            inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_sync_sheets")]]
+        )
+    )
+    
+    asyncio.create_task(perform_delta_sync_task(callback.message.chat.id, callback.message.message_id))
+
 @router.callback_query(F.data == "start_full_sync")
 async def start_full_sync_handler(callback: types.CallbackQuery):
     if callback.from_user.username not in ADMINS:
@@ -1950,6 +2063,40 @@ async def perform_users_sync_task(chat_id: int, message_id: int):
             )
         )
 
+async def perform_delta_sync_task(chat_id: int, message_id: int):
+    """Выгружает в фоне только измененные строки"""
+    try:
+        from sheets.sync_to_sheets import SheetsSync
+        
+        results = await SheetsSync().delta_sync()
+        
+        text = "✅ Изменения выгружены в Google Sheets\n\n"
+        for name, result in results.items():
+            if result == 'rebuilt':
+                text += f"• {name}: лист перезаписан целиком\n"
+            else:
+                updated, added = result
+                text += f"• {name}: обновлено {updated}, добавлено {added}\n"
+        
+        await bot.edit_message_text(
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=types.InlineKeyboardMarkup(
+                inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_sync_sheets")]]
+            )
+        )
+        
+    except Exception as e:
+        await bot.edit_message_text(
+            text=f"❌ Ошибка при выгрузке изменений:\n\n{str(e)}",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=types.InlineKeyboardMarkup(
+                inline_keyboard=[[types.InlineKeyboardButton(text="◀️ Назад", callback_data="admin_sync_sheets")]]
+            )
+        )
+
 async def perform_payments_sync_task(chat_id: int, message_id: int):
     """Выполняет синхронизацию платежей в фоновом режиме"""
     try:
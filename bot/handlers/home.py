@@ -1,11 +1,11 @@
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from db.database import async_session
+from db.database import async_session, read_session
 from db.service.user_service import get_or_create_user
 from config.config import TECH_SUPPORT_USERNAME, VPN_PRICE, VPN_PRICE_3, VPN_PRICE_6, VPN_PRICE_REF
 from datetime import datetime
-from db.service.user_service import renew_subscription, is_user_exist
+from db.service.user_service import renew_subscription, get_user_by_telegram_id
 from bot.vpn_manager import VPNManager
 from bot.utils import generate_ref_url
 import asyncio
@@ -13,10 +13,11 @@ router = Router()
 
 @router.callback_query(F.data == "home_first")
 async def home_first_time(callback: types.CallbackQuery):
-    async with async_session() as session:
-        if not await is_user_exist(session, callback.from_user.id):
-            return
-        await session.close()
+    # Экран только читает пользователя, поэтому идет на реплику
+    async with read_session(callback.from_user.id) as session:
+        user = await get_user_by_telegram_id(session, callback.from_user.id)
+    if not user:
+        return
 
     await callback.message.answer(text="🚀 Мы запустили реферальную систему в нашем боте!\n\n"
                                        "🎉 Приглашай друзей, делись ссылкой и получай бонусы "
@@ -36,13 +37,11 @@ async def home_first_time(callback: types.CallbackQuery):
         ]
     )
 
-    async with async_session() as session:
-        user = await get_or_create_user(session, callback.from_user)
-        await callback.message.answer(
-            f"👋 Привет {user.username}!\n\n"
-            f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y') if user.subscription_end else 'Нет активной подписки'}\n",
-            reply_markup=keyboard
-        )
+    await callback.message.answer(
+        f"👋 Привет {user.username}!\n\n"
+        f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y') if user.subscription_end else 'Нет активной подписки'}\n",
+        reply_markup=keyboard
+    )
 
 
 async def process_home_action(event):
@@ -50,10 +49,11 @@ async def process_home_action(event):
     Общая функция обработки home-действия
     Работает как с Message, так и с CallbackQuery
     """
-    async with async_session() as session:
-        if not await is_user_exist(session, event.from_user.id):
-            return
-        await session.close()
+    # Экран только читает пользователя, поэтому идет на реплику
+    async with read_session(event.from_user.id) as session:
+        user = await get_user_by_telegram_id(session, event.from_user.id)
+    if not user:
+        return
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text='🔑 Мои ключи', callback_data='configs')],
@@ -64,26 +64,15 @@ async def process_home_action(event):
         ]
     )
 
-    async with async_session() as session:
-        # Определяем пользователя в зависимости от типа события
-        if isinstance(event, types.Message):
-            user = await get_or_create_user(session, event.from_user)
-            message_to_edit = await event.answer(
-                f"👋 Привет {user.username}!\n\n"
-                f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y') if user.subscription_end else 'Нет активной подписки'}\n",
-                reply_markup=keyboard
-            )
-        else:  # CallbackQuery
-            user = await get_or_create_user(session, event.from_user)
-            await event.message.edit_text(
-                f"👋 Привет {user.username}!\n\n"
-                f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y') if user.subscription_end else 'Нет активной подписки'}\n",
-                reply_markup=keyboard
-            )
-
-        # Если это callback, вызываем answer
-        if isinstance(event, types.CallbackQuery):
-            await event.answer()
+    text = (
+        f"👋 Привет {user.username}!\n\n"
+        f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y') if user.subscription_end else 'Нет активной подписки'}\n"
+    )
+    if isinstance(event, types.Message):
+        await event.answer(text, reply_markup=keyboard)
+    else:  # CallbackQuery
+        await event.message.edit_text(text, reply_markup=keyboard)
+        await event.answer()
 
 
 @router.message(Command("home"))
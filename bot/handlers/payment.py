@@ -1,11 +1,12 @@
 from aiogram import Router, types, F
 from aiogram.types import LabeledPrice
-from config.config import PAYMENT_TOKEN, DONATE_STREAM_URL, ADMIN_CHAT, VPN_PRICE, VPN_PRICE_3, VPN_PRICE_6, TECH_SUPPORT_USERNAME
+from config.config import PAYMENT_TOKEN, DONATE_STREAM_URL, ADMIN_CHAT, VPN_PRICE, VPN_PRICE_3, VPN_PRICE_6, TECH_SUPPORT_USERNAME, \
+    BOT_TOKEN, WATA_PUBLIC_KEY, WATA_WEBHOOK_ENABLED
 from fastapi import FastAPI, Request, Response
 from db.database import async_session
 from db.models import User
 from db.service.payment_service import create_payment, get_user_payments, get_payment_by_payment_id, \
-    update_payment_status
+    update_payment_status, get_payment_by_id
 from db.service.user_service import get_or_create_user, get_user_by_username, update_user_balance, \
     renew_subscription
 from bot.vpn_manager import VPNManager
@@ -15,7 +16,14 @@ from datetime import datetime, timedelta
 import traceback
 import logging
 import asyncio
-from bot.donate_api import DonateApi
+import time
+from typing import Optional
+from bot.donate_api import DonateApi, verify_webhook_signature
+from bot.payment_processing import complete_payment, notify_payment_result, success_keyboard, PAID_STATUS, \
+    EXPIRED_STATUS
+from bot.payment_links import payment_links
+from bot.metrics import instrument_bot
+from aiogram import Bot
 from sqlalchemy import select
 
 # Настройка логирования
@@ -24,6 +32,7 @@ logger = logging.getLogger(__name__)
 
 router = Router()
 webhook_router = APIRouter()
+bot = instrument_bot(Bot(token=BOT_TOKEN))
 
 
 
@@ -65,7 +74,10 @@ async def show_payment_menu(callback: types.CallbackQuery):
     ])
     
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
-    
+
+    # Пока пользователь выбирает, создаем ссылку для самого вероятного тарифа
+    payment_links.prefetch(callback.from_user, [amount for amount, _ in amounts])
+
     await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
@@ -92,107 +104,78 @@ async def create_payment_with_amount(callback: types.CallbackQuery, amount: floa
     """
     # Сразу отвечаем пользователю, чтобы показать что запрос обрабатывается
     await callback.answer("Создаем платеж...")
-    
-    # Показываем промежуточное сообщение
-    loading_message = await callback.message.edit_text(
-        f"⏳ Создаем платеж на {int(amount)} ₽...\n"
-        "Это может занять несколько секунд",
-        reply_markup=types.InlineKeyboardMarkup(
-            inline_keyboard=[[
-                types.InlineKeyboardButton(text="🏠 Отмена", callback_data="home")
-            ]]
-        )
-    )
-    
+
+    # Заранее созданную или уже показанную ссылку показываем сразу, без промежуточного сообщения
+    loading_message = callback.message
     try:
-        async with async_session() as session:
-            # Быстро создаем пользователя и платеж
-            user = await get_or_create_user(session, callback.from_user)
-            payment = await create_payment(
-                session=session,
-                user_id=user.id,
-                nickname=user.username
-            )
-            
-            # Обновляем сообщение
-            await loading_message.edit_text(
-                f"⏳ Создаем ссылку для оплаты {int(amount)} ₽...\n"
-                "Подключаемся к платежной системе...",
+        link = await payment_links.ready(callback.from_user, amount)
+        if link is None:
+            loading_message = await callback.message.edit_text(
+                f"⏳ Создаем платеж на {int(amount)} ₽...\n"
+                "Это может занять несколько секунд",
                 reply_markup=types.InlineKeyboardMarkup(
                     inline_keyboard=[[
                         types.InlineKeyboardButton(text="🏠 Отмена", callback_data="home")
                     ]]
                 )
             )
-            
-            donate_api = DonateApi()
-            # Передаем сумму в create_donate_url
-            response = await donate_api.create_donate_url(payment_id=payment.id, amount=amount)
-            
-            if response is None:
-                await loading_message.edit_text(
-                    "❌ Не удалось создать ссылку для платежа\n\n"
-                    "Проблема с платежной системой. Попробуйте снова через некоторое время",
-                    reply_markup=types.InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="payment")],
-                            [types.InlineKeyboardButton(text="❓ Поддержка", url=f"https://t.me/{TECH_SUPPORT_USERNAME}")],
-                            [types.InlineKeyboardButton(text="🏠 Домой", callback_data="home")]
-                        ]
-                    )
+            link = await payment_links.create(callback.from_user, amount)
+
+        if link is None:
+            await loading_message.edit_text(
+                "❌ Не удалось создать ссылку для платежа\n\n"
+                "Проблема с платежной системой. Попробуйте снова через некоторое время",
+                reply_markup=types.InlineKeyboardMarkup(
+                    inline_keyboard=[
+                        [types.InlineKeyboardButton(text="🔄 Попробовать снова", callback_data="payment")],
+                        [types.InlineKeyboardButton(text="❓ Поддержка", url=f"https://t.me/{TECH_SUPPORT_USERNAME}")],
+                        [types.InlineKeyboardButton(text="🏠 Домой", callback_data="home")]
+                    ]
                 )
-                return
-
-            # Обновляем статус платежа в БД с правильной суммой
-            await update_payment_status(
-                session=session, 
-                id=payment.id, 
-                payment_id=response['id'],
-                status=response['status'], 
-                amount=amount  # Используем переданную сумму, а не из response
             )
+            return
 
-            # Создаем финальную клавиатуру
-            keyboard = types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        types.InlineKeyboardButton(
-                            text="💳 Оплатить",
-                            url=response['url'],
-                        )
-                    ],
-                    [
-                        types.InlineKeyboardButton(
-                            text="✅ Проверить оплату",
-                            callback_data=f"check_payment:{payment.payment_id}"
-                        )
-                    ],
-                    [
-                        types.InlineKeyboardButton(
-                            text='❓ Поддержка',
-                            url=f'https://t.me/{TECH_SUPPORT_USERNAME}'
-                        )
-                    ],
-                    [
-                        types.InlineKeyboardButton(
-                            text="🏠 Домой",
-                            callback_data='home'
-                        )
-                    ]
+        # Создаем финальную клавиатуру
+        keyboard = types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    types.InlineKeyboardButton(
+                        text="💳 Оплатить",
+                        url=link.url,
+                    )
+                ],
+                [
+                    types.InlineKeyboardButton(
+                        text="✅ Проверить оплату",
+                        callback_data=f"check_payment:{link.wata_id}"
+                    )
+                ],
+                [
+                    types.InlineKeyboardButton(
+                        text='❓ Поддержка',
+                        url=f'https://t.me/{TECH_SUPPORT_USERNAME}'
+                    )
+                ],
+                [
+                    types.InlineKeyboardButton(
+                        text="🏠 Домой",
+                        callback_data='home'
+                    )
                 ]
-            )
-            
-            # Финальное сообщение с результатом
-            await loading_message.edit_text(
-                f"✅ Платеж создан!\n\n"
-                f"📌 Что нужно сделать:\n"
-                "1️⃣ Перейдите по ссылке «Оплатить»\n"
-                "2️⃣ Оплатите по СБП\n"
-                "3️⃣ Вернитесь в бота и нажмите «Проверить оплату»",
-                reply_markup=keyboard,
-                parse_mode="Markdown"
-            )
-            
+            ]
+        )
+        
+        # Финальное сообщение с результатом
+        await loading_message.edit_text(
+            f"✅ Платеж создан!\n\n"
+            f"📌 Что нужно сделать:\n"
+            "1️⃣ Перейдите по ссылке «Оплатить»\n"
+            "2️⃣ Оплатите по СБП\n"
+            "3️⃣ Вернитесь в бота и нажмите «Проверить оплату»",
+            reply_markup=keyboard,
+            parse_mode="Markdown"
+        )
+        
     except Exception as e:
         logger.error(f"Ошибка при создании платежа: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
@@ -220,6 +203,22 @@ async def create_payment_with_amount(callback: types.CallbackQuery, amount: floa
             )
 
 
+async def answer_payment_result(callback: types.CallbackQuery, result: dict):
+    """Показывает пользователю результат зачисления платежа"""
+    status = result['status']
+    if status == 'already_processed':
+        await callback.answer("✅ Этот платёж уже зачислен", show_alert=True)
+    elif status == 'insufficient':
+        user = result['user']
+        await callback.answer(
+            f"Платеж обработан, но недостаточно средств для продления подписки.\n"
+            f"Баланс: {user.balance} ₽. Необходимо минимум: {int(VPN_PRICE)} ₽.",
+            show_alert=True
+        )
+    else:
+        await callback.message.answer(text=result['text'], reply_markup=success_keyboard(), parse_mode="Markdown")
+
+
 @router.callback_query(F.data.startswith("check_payment:"))
 async def check_payment(callback: types.CallbackQuery):
     """
@@ -230,6 +229,29 @@ async def check_payment(callback: types.CallbackQuery):
         user = await get_or_create_user(session, callback.from_user)
         payment = await get_payment_by_payment_id(session, payment_id)
 
+        if not payment:
+            await callback.answer("Платёж не создался, попробуйте заново", show_alert=True)
+            return
+
+        if payment.user_id != user.id:
+            await callback.answer("Этот платёж не принадлежит вам.", show_alert=True)
+            return
+
+        # Платеж уже подтвержден (webhook'ом или предыдущей проверкой)
+        if payment.status == PAID_STATUS:
+            await callback.answer("✅ Оплата получена, подписка продлена", show_alert=True)
+            return
+
+        # Истекший платеж все равно проверяем в WATA: его могли оплатить перед самым истечением
+        if WATA_WEBHOOK_ENABLED and payment.status != EXPIRED_STATUS:
+            # Подтверждение придет webhook'ом, запрос в WATA не нужен
+            await callback.answer(
+                "Проверка оплаты...\n"
+                "Если вы уже оплатили, бот пришлет уведомление в течение нескольких минут.",
+                show_alert=True
+            )
+            return
+
         donate_api = DonateApi()
         response = await donate_api.find_donate_url(payment_id)
 
@@ -246,112 +268,16 @@ async def check_payment(callback: types.CallbackQuery):
             )
             return
 
-        if not payment:
-            await callback.answer("Платёж не создался, попробуйте заново", show_alert=True)
-            return
-
-        if payment.user_id != user.id:
-            await callback.answer("Этот платёж не принадлежит вам.", show_alert=True)
+        if response['status'] == 'Closed':
+            result = await complete_payment(session, payment, float(response['amount']))
+            await answer_payment_result(callback, result)
             return
 
         now = datetime.utcnow()
         dt = datetime.strptime(response['expirationDateTime'], "%Y-%m-%dT%H:%M:%S.%fZ")
 
-        if dt < now:
+        if dt < now or payment.status == EXPIRED_STATUS:
             await callback.answer("Время на оплату истекло, создайте новый платёж", show_alert=True)
-            return
-
-        if response['status'] == 'Closed':
-            await update_user_balance(session, username=user.username, amount=float(response['amount']))
-            await update_payment_status(session, id=payment.id, status=response['status'])
-
-            # Определяем период подписки автоматически по пополненному балансу
-            await session.refresh(user)  # Обновляем данные пользователя
-            
-            if user.balance >= VPN_PRICE_6:
-                period_months = 6
-                price = VPN_PRICE_6
-                period_text = "6 месяцев"
-            elif user.balance >= VPN_PRICE_3:
-                period_months = 3
-                price = VPN_PRICE_3
-                period_text = "3 месяца"
-            elif user.balance >= VPN_PRICE:
-                period_months = 1
-                price = VPN_PRICE
-                period_text = "1 месяц"
-            else:
-                # Недостаточно средств даже на минимальный период
-                await callback.answer(
-                    f"Платеж обработан, но недостаточно средств для продления подписки.\n"
-                    f"Баланс: {user.balance} ₽. Необходимо минимум: {int(VPN_PRICE)} ₽.",
-                    show_alert=True
-                )
-                return
-            was_active = user.is_active
-            old_sub_end = user.subscription_end
-            success = await renew_subscription(session, user.id, period_months * 30, price)
-
-            if success:
-                # Обновляем VPN конфигурацию
-                vpn_manager = VPNManager(session)
-                success_2 = await vpn_manager.renew_subscription(
-                    user=user,
-                    subscription_days=period_months * 30
-                )
-
-                if success_2:
-                    # Получаем обновленного пользователя из базы
-                    updated_user_result = await session.execute(select(User).where(User.id == user.id))
-                    updated_user = updated_user_result.scalar_one_or_none()
-                    
-                    if updated_user and updated_user.vpn_link:
-                        message_text = (
-                            f"✅ Подписка успешно продлена!\n\n"
-                            f"📅 Период: {period_text}\n"
-                            f"📅 Подписка активна до: {updated_user.subscription_end.strftime('%d.%m.%Y')}\n\n"
-                            f"🔗 Ваша VPN ссылка:\n\n"
-                            f"{updated_user.vpn_link}\n\n"
-                        )
-                    else:
-                        message_text = (
-                            f"✅ Подписка продлена!\n\n"
-                            f"📅 Период: {period_text}\n"
-                            f"Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y')}\n\n"
-                            f"❌ Не удалось получить VPN конфигурацию. Попробуйте позже в разделе 'Мои ключи'."
-                        )
-                else:
-                    # VPN не создался - возвращаем деньги
-                    user.balance += price
-                    user.subscription_end = old_sub_end
-                    user.is_active = was_active
-                    await session.commit()
-                    
-                    message_text = (
-                        f"❌ Ошибка при обновлении/создании VPN конфигурации.\n\n"
-                        f"💰 Деньги возвращены на баланс: {price} ₽.\n"
-                        "Пожалуйста, попробуйте продлить подписку через главное меню \"Продлить подписку\"."
-                    )
-
-                success_keyboard = types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="💳 Продлить подписку",
-                                callback_data="update_sub"
-                            )
-                        ],
-                        [
-                            types.InlineKeyboardButton(
-                                text="🏠 Домой",
-                                callback_data="home"
-                            )
-                        ]
-                    ]
-                )
-                await callback.message.answer(text=message_text, reply_markup=success_keyboard, parse_mode="Markdown")
-            else:
-                await callback.answer("Ошибка при продлении подписки", show_alert=True)
         else:
             await callback.answer(
                 "Проверка оплаты...\n"
@@ -359,3 +285,75 @@ async def check_payment(callback: types.CallbackQuery):
                 show_alert=True
             )
 
+
+# ======================== WEBHOOK WATA ========================
+
+_wata_public_key = WATA_PUBLIC_KEY
+# Когда ключ последний раз запрашивали у WATA (time.monotonic)
+_wata_public_key_fetched_at = None
+_wata_public_key_lock = asyncio.Lock()
+# Не чаще: запрос идет через общий лимит WATA, а повторить его может любой с неверной подписью
+PUBLIC_KEY_REFRESH_INTERVAL = 300
+
+
+async def get_wata_public_key(refresh: bool = False) -> Optional[str]:
+    """
+    Публичный ключ WATA: из конфигурации или запрошенный у API.
+    Повторный запрос (refresh) - не чаще раза в PUBLIC_KEY_REFRESH_INTERVAL секунд;
+    если запрос не удался, остается последний полученный ключ
+    """
+    global _wata_public_key, _wata_public_key_fetched_at
+    if WATA_PUBLIC_KEY:
+        return WATA_PUBLIC_KEY
+
+    async with _wata_public_key_lock:
+        due = (
+            _wata_public_key_fetched_at is None
+            or time.monotonic() - _wata_public_key_fetched_at >= PUBLIC_KEY_REFRESH_INTERVAL
+        )
+        if due and (refresh or not _wata_public_key):
+            _wata_public_key_fetched_at = time.monotonic()
+            _wata_public_key = await DonateApi().get_public_key() or _wata_public_key
+    return _wata_public_key
+
+
+@webhook_router.post("/wata")
+async def wata_webhook(request: Request):
+    """
+    Принимает уведомление WATA об оплате, проверяет подпись
+    и зачисляет платеж по orderId (повторная доставка ничего не меняет)
+    """
+    raw_body = await request.body()
+    signature = request.headers.get("X-Signature")
+
+    public_key = await get_wata_public_key()
+    verified = verify_webhook_signature(raw_body, signature, public_key)
+    if not verified and not WATA_PUBLIC_KEY:
+        # Ключ мог смениться - запрашиваем заново (не чаще PUBLIC_KEY_REFRESH_INTERVAL)
+        refreshed = await get_wata_public_key(refresh=True)
+        if refreshed != public_key:
+            verified = verify_webhook_signature(raw_body, signature, refreshed)
+    if not verified:
+        logger.warning("WATA webhook с неверной подписью отклонен")
+        return Response(status_code=400)
+
+    data = json.loads(raw_body)
+    if data.get('transactionStatus') != 'Paid':
+        return {'status': 'ignored'}
+
+    try:
+        id = int(data.get('orderId'))
+    except (TypeError, ValueError):
+        logger.warning(f"WATA webhook с некорректным orderId: {data.get('orderId')}")
+        return {'status': 'ignored'}
+
+    async with async_session() as session:
+        payment = await get_payment_by_id(session, id)
+        if not payment:
+            logger.warning(f"WATA webhook для неизвестного платежа {id}")
+            return {'status': 'unknown_order'}
+
+        result = await complete_payment(session, payment, float(data['amount']))
+
+    await notify_payment_result(bot, result)
+    return {'status': result['status']}
@@ -1,9 +1,11 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from db.service.user_service import get_or_create_user, is_user_exist, get_user_by_telegram_id, renew_subscription
+from db.service.user_service import get_or_create_user, is_user_exist, get_user_by_telegram_id, renew_subscription, \
+    set_bot_blocked
+from aiogram.enums import ChatType, ChatMemberStatus
 from config.config import CHANNEL_ID, CHANNEL_USERNAME, TECH_SUPPORT_USERNAME
-from bot.utils import check_subscription
+from bot.utils import check_subscription, remember_membership, is_channel, MEMBER_STATUSES
 from bot.handlers.home import process_home_action
 from db.database import async_session
 from bot.handlers.home import home_callback
@@ -58,6 +60,24 @@ async def cmd_start(message: types.Message, bot):
         reply_markup=keyboard
     )
 
+@router.chat_member()
+async def channel_member_updated(update: types.ChatMemberUpdated):
+    """
+    Обновляет кэш подписки по событиям канала.
+    Telegram присылает их, только если бот - администратор канала
+    """
+    if is_channel(update.chat):
+        remember_membership(update.new_chat_member.user.id, update.new_chat_member.status in MEMBER_STATUSES)
+
+
+@router.my_chat_member(F.chat.type == ChatType.PRIVATE)
+async def bot_blocked_changed(update: types.ChatMemberUpdated):
+    """Пользователь заблокировал или разблокировал бота: заблокировавших рассылки пропускают"""
+    async with async_session() as session:
+        await set_bot_blocked(session, [update.from_user.id], update.new_chat_member.status == ChatMemberStatus.KICKED)
+        await session.commit()
+
+
 @router.callback_query(F.data.startswith("check_subscription_"))
 async def check_subscription_callback(callback: types.CallbackQuery, bot):
     # Получаем данные из callback
@@ -77,8 +97,8 @@ async def check_subscription_callback(callback: types.CallbackQuery, bot):
     # if referrer_id is not None:
     #     await asyncio.sleep(2)
     
-    # Проверяем подписку
-    if not await check_subscription(callback.from_user.id, bot):
+    # Проверяем подписку: пользователь мог только что подписаться, поэтому мимо кэша
+    if not await check_subscription(callback.from_user.id, bot, use_cache=False):
         await callback.answer(
             "❌ Вы еще не подписаны на канал. Пожалуйста, подпишитесь и попробуйте снова.",
             show_alert=True
@@ -0,0 +1,392 @@
+"""
+Метрики в формате Prometheus (text format 0.0.4).
+Обработчики бота, запросы к БД, панели VPN, WATA и Telegram пишут в один реестр,
+который отдается по /metrics: из api.py, а в процессе бота (main.py) и в
+процессах-воркерах обновлений - из небольшого HTTP-сервера на METRICS_PORT
+(воркер N слушает METRICS_PORT + 1 + N).
+
+Реестр свой, без prometheus_client: метрик немного, а у каждого процесса
+свой реестр, как и у профилировщика запросов.
+"""
+
+import logging
+import operator
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LABEL_LENGTH = 40
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name}: ожидались метки {self.label_names}, получено {labels}")
+        return tuple(str(value) for value in labels)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels):
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Счетчики по корзинам (не накопительные), сумма, количество
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels) -> int:
+        state = self.values.get(self._key(labels))
+        return state[2] if state else 0
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f'{self.name}_bucket', _format_labels(self.label_names, key, le), cumulative
+            yield f'{self.name}_sum', _format_labels(self.label_names, key), total
+            yield f'{self.name}_count', _format_labels(self.label_names, key), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, **kwargs))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+handler_duration = registry.histogram(
+    'bot_handler_duration_seconds', 'Время обработки сообщения или нажатия кнопки', ('event', 'handler'))
+handler_in_flight = registry.gauge(
+    'bot_handler_in_flight', 'Обновления, которые сейчас обрабатываются', ('event', 'handler'))
+handler_errors = registry.counter(
+    'bot_handler_errors_total', 'Необработанные исключения в обработчиках', ('event', 'handler', 'error'))
+throttled = registry.counter(
+    'bot_throttled_total', 'Запросы, отсеченные антифлудом', ('group', 'action'))
+broadcast_messages = registry.counter(
+    'bot_broadcast_messages_total', 'Сообщения рассылок по результату отправки', ('result',))
+db_query_duration = registry.histogram(
+    'db_query_duration_seconds', 'Время SQL-запросов', ('engine', 'operation'))
+db_query_errors = registry.counter(
+    'db_query_errors_total', 'SQL-запросы, завершившиеся ошибкой', ('engine', 'operation'))
+external_duration = registry.histogram(
+    'external_request_duration_seconds', 'Время запросов к внешним сервисам до получения ответа',
+    ('service', 'operation', 'status'))
+
+
+# ======================== МЕТКИ ОБРАБОТЧИКОВ ========================
+
+# Команды и callback_data, которые обрабатывает бот (register_handler_labels).
+# Текст команды и callback_data присылает клиент, поэтому все остальное идет в
+# метку 'other': иначе любой пользователь плодит новые серии метрик
+_known_commands = set()
+_known_callbacks = set()
+_known_callback_prefixes = set()
+
+
+def _callback_filter_values(magic) -> Tuple[Optional[str], Optional[str]]:
+    """(точное значение, префикс) из фильтров F.data == '...' и F.data.startswith('...')"""
+    operations = getattr(magic, '_operations', ())
+    if not operations or getattr(operations[0], 'name', None) != 'data':
+        return None, None
+    if len(operations) == 2 and getattr(operations[1], 'comparator', None) is operator.eq:
+        value = operations[1].right
+        return (value, None) if isinstance(value, str) else (None, None)
+    if len(operations) == 3 and getattr(operations[1], 'name', None) == 'startswith':
+        args = getattr(operations[2], 'args', ())
+        return (None, args[0]) if len(args) == 1 and isinstance(args[0], str) else (None, None)
+    return None, None
+
+
+def register_handler_labels(router, commands: Iterable = ()):
+    """Собирает команды (Command в фильтрах и commands) и callback_data из фильтров обработчиков"""
+    from aiogram.filters import Command
+
+    for command in commands:
+        _known_commands.add('/' + getattr(command, 'command', command))
+    for handler in router.message.handlers:
+        for filter_object in handler.filters or ():
+            if isinstance(filter_object.callback, Command):
+                for command in filter_object.callback.commands:
+                    if isinstance(command, str):
+                        _known_commands.add('/' + command)
+                    elif hasattr(command, 'command'):
+                        _known_commands.add('/' + command.command)
+    for handler in router.callback_query.handlers:
+        for filter_object in handler.filters or ():
+            value, prefix = _callback_filter_values(getattr(filter_object.callback, '__self__', None))
+            if value:
+                _known_callbacks.add(value)
+            if prefix:
+                _known_callback_prefixes.add(prefix)
+    for sub_router in router.sub_routers:
+        register_handler_labels(sub_router)
+
+
+def callback_label(data: Optional[str]) -> str:
+    """
+    Метка callback_data: известное значение или самый длинный известный префикс
+    без разделителя ('admin_user_5' -> 'admin_user'); неизвестные - 'other'
+    """
+    if not data:
+        return 'empty'
+    if data in _known_callbacks:
+        return data[:MAX_LABEL_LENGTH]
+    prefixes = [prefix for prefix in _known_callback_prefixes if data.startswith(prefix)]
+    if not prefixes:
+        return 'other'
+    return (max(prefixes, key=len).rstrip('_:') or 'other')[:MAX_LABEL_LENGTH]
+
+
+def message_label(text: Optional[str]) -> str:
+    """Известная команда сообщения ('/start'), 'other' для прочих команд, 'message' для остальных сообщений"""
+    if text and text.startswith('/'):
+        command = text.split(maxsplit=1)[0].split('@', 1)[0]
+        return command if command in _known_commands else 'other'
+    return 'message'
+
+
+# ======================== БД ========================
+
+def _operation(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].upper() if words else 'UNKNOWN'
+
+
+_attached_engines = set()
+
+
+def attach_db(engine, name: str):
+    """Замеряет SQL-запросы движка (как профилировщик, через события курсора)"""
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if id(sync_engine) in _attached_engines:
+        return
+    _attached_engines.add(id(sync_engine))
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('metrics_start')
+        if started:
+            db_query_duration.observe(time.perf_counter() - started.pop(), name, _operation(statement))
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def _error(context):
+        started = context.connection.info.get('metrics_start') if context.connection is not None else None
+        if started:
+            started.pop()
+        db_query_errors.inc(name, _operation(context.statement or ''))
+
+
+def attach_databases():
+    """
+    Замеряет запросы движков primary и реплики из db.database. Вызывается точками
+    входа (main.py, api.py, воркеры обновлений), чтобы слой db не зависел от bot
+    """
+    from db.database import engine, replica_engine
+    attach_db(engine, 'primary')
+    if replica_engine is not engine:
+        attach_db(replica_engine, 'replica')
+
+
+# ======================== ВНЕШНИЕ СЕРВИСЫ ========================
+
+class TimedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт httpx, замеряющий запросы к сервису до получения заголовков ответа.
+    operation - метод и первый сегмент пути после base_url ('POST links')
+    """
+
+    def __init__(self, service: str, base_url: Optional[str] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, **kwargs):
+        self.service = service
+        self.base_path = urlparse(base_url).path.rstrip('/') if base_url else ''
+        self.transport = transport or httpx.AsyncHTTPTransport(**kwargs)
+
+    def operation(self, request: httpx.Request) -> str:
+        path = request.url.path
+        if self.base_path and path.startswith(self.base_path):
+            path = path[len(self.base_path):]
+        segment = path.strip('/').split('/', 1)[0]
+        return f'{request.method} {segment}'.strip()[:MAX_LABEL_LENGTH]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            status = 'timeout'
+            raise
+        finally:
+            external_duration.observe(time.perf_counter() - started, self.service, self.operation(request), status)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class TelegramRequestMetrics:
+    """Middleware сессии aiogram: время вызовов Bot API по методам"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await make_request(bot, method)
+            status = 'ok'
+            return response
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            external_duration.observe(time.perf_counter() - started, 'telegram', method.__api_method__, status)
+
+
+def instrument_bot(bot):
+    """Подключает замер запросов к Telegram для экземпляра Bot (повторно не подключает)"""
+    if not getattr(bot.session, 'metrics_attached', False):
+        bot.session.middleware(TelegramRequestMetrics())
+        bot.session.metrics_attached = True
+    return bot
+
+
+# ======================== HTTP ========================
+
+async def start_metrics_server(port: int, host: str = '0.0.0.0'):
+    """Отдает /metrics из процесса без FastAPI (бот, воркеры обновлений)"""
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
@@ -1,8 +1,11 @@
 from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery, TelegramObject
 from typing import Callable, Dict, Any, Awaitable
 from bot.utils import check_subscription
 from config.config import CHANNEL_USERNAME
+from db.query_profiler import query_profiler
+from bot.throttling import throttler, handler_group
+from bot.metrics import handler_duration, handler_in_flight, handler_errors, callback_label, message_label
 
 
 class SubscriptionMiddleware(BaseMiddleware):
@@ -25,4 +28,90 @@ class SubscriptionMiddleware(BaseMiddleware):
             )
             return
             
-        return await handler(event, data) 
\ No newline at end of file
+        return await handler(event, data)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время обработки, число обрабатываемых сейчас обновлений и ошибки (bot/metrics.py).
+    Регистрируется как внешний middleware, чтобы в замер попали проверка подписки и антифлуд.
+    Метка - известная команда сообщения или префикс callback_data из фильтров обработчиков.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, CallbackQuery):
+            labels = ('callback_query', callback_label(event.data))
+        else:
+            labels = ('message', message_label(getattr(event, 'text', None)))
+
+        with handler_in_flight.track(*labels), handler_duration.time(*labels):
+            try:
+                return await handler(event, data)
+            except Exception as e:
+                handler_errors.inc(*labels, type(e).__name__)
+                raise
+
+
+class QueryProfilerMiddleware(BaseMiddleware):
+    """
+    Относит SQL-запросы к обработчику, который их выполнил.
+    Регистрируется как внутренний middleware, чтобы знать выбранный обработчик.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        name = getattr(callback, '__name__', type(event).__name__)
+
+        with query_profiler.scope(f"handler:{name}"):
+            return await handler(event, data)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд для сообщений и нажатий кнопок (bot/throttling.py).
+    Регистрируется как внутренний middleware, чтобы группа определялась по выбранному обработчику.
+    Лишние сообщения отбрасываются молча, на лишние нажатия сразу отвечаем callback.answer,
+    чтобы у пользователя пропали часики на кнопке.
+    """
+
+    def __init__(self, limiter=throttler):
+        self.limiter = limiter
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+        group = handler_group(getattr(data.get('handler'), 'callback', None))
+        self.limiter.log_report()
+
+        if not isinstance(event, CallbackQuery):
+            if not self.limiter.allow(user.id, group):
+                return
+            return await handler(event, data)
+
+        if not self.limiter.begin(user.id, event.data, group):
+            await event.answer("⏳ Уже обрабатываю, подождите...")
+            return
+        try:
+            if not self.limiter.allow(user.id, group):
+                wait = max(int(self.limiter.retry_after(user.id, group) + 0.999), 1)
+                await event.answer(f"Слишком часто. Попробуйте через {wait} сек.")
+                return
+            return await handler(event, data)
+        finally:
+            self.limiter.end(user.id, event.data)
@@ -0,0 +1,155 @@
+"""
+Заблаговременное создание платежных ссылок.
+При открытии меню оплаты бот в фоне создает платеж и ссылку WATA для самого
+вероятного тарифа, чтобы нажатие кнопки отвечало сразу. Неоплаченная ссылка
+переиспользуется для того же пользователя и суммы, пока ей не больше PREPARED_LINK_TTL:
+ссылки ищутся в payments (payments.url), а не в памяти процесса.
+Невыбранные заранее созданные ссылки истекают в фоновой проверке платежей.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from config.config import VPN_PRICE
+from db.database import async_session
+from db.models import User, Payment
+from db.service.payment_service import create_payment, update_payment_status
+from db.service.user_service import get_or_create_user
+from bot.donate_api import DonateApi, wata_limiter
+from bot.payment_processing import OPENED_STATUS, PAID_STATUS, EXPIRED_STATUS, PREPARED_STATUS
+
+logger = logging.getLogger(__name__)
+
+# Сколько переиспользуем неоплаченную ссылку (сама ссылка WATA живет LINK_LIFETIME)
+PREPARED_LINK_TTL = timedelta(hours=1)
+
+
+@dataclass
+class PaymentLink:
+    payment_id: int  # payments.id
+    wata_id: str
+    url: str
+    amount: float
+    created_at: datetime
+
+
+async def likely_amount(session, user_id: int, amounts: list) -> float:
+    """Самый вероятный тариф: сумма последней оплаты, если это один из тарифов, иначе 1 месяц"""
+    result = await session.execute(
+        select(Payment.amount)
+        .where(Payment.user_id == user_id, Payment.status == PAID_STATUS)
+        .order_by(Payment.completed_at.desc())
+        .limit(1)
+    )
+    last_amount = result.scalar_one_or_none()
+    return last_amount if last_amount in amounts else VPN_PRICE
+
+
+class PaymentLinkCache:
+    def __init__(self):
+        self.pending = {}  # telegram_id -> фоновая задача создания ссылки
+        self.prefetching = {}  # telegram_id -> сумма, для которой фоновая задача создает ссылку
+
+    async def _create(self, session, user, amount: float, status: Optional[str]) -> Optional[PaymentLink]:
+        payment = await create_payment(session=session, user_id=user.id, nickname=user.username)
+        response = await DonateApi().create_donate_url(payment_id=payment.id, amount=amount)
+        if response is None:
+            return None
+        await update_payment_status(
+            session=session,
+            id=payment.id,
+            payment_id=response['id'],
+            status=status or response['status'],
+            amount=amount,
+            url=response['url']
+        )
+        return PaymentLink(payment.id, response['id'], response['url'], amount, payment.created_at)
+
+    async def _find_open(self, session, telegram_id: int, amount: float) -> Optional[PaymentLink]:
+        """
+        Неоплаченная ссылка пользователя на эту сумму моложе PREPARED_LINK_TTL:
+        ищется в payments, поэтому переживает перезапуск и общая для всех процессов
+        """
+        result = await session.execute(
+            select(Payment.id, Payment.payment_id, Payment.url, Payment.amount, Payment.created_at)
+            .join(User, User.id == Payment.user_id)
+            .where(
+                User.telegram_id == telegram_id,
+                Payment.amount == amount,
+                Payment.status.in_([PREPARED_STATUS, OPENED_STATUS]),
+                Payment.url.isnot(None),
+                Payment.created_at > datetime.utcnow() - PREPARED_LINK_TTL
+            )
+            .order_by(Payment.created_at.desc())
+            .limit(1)
+        )
+        row = result.first()
+        return PaymentLink(*row) if row else None
+
+    def prefetch(self, tg_user, amounts: list):
+        """Запускает фоновое создание ссылки для самого вероятного тарифа"""
+        if tg_user.id in self.pending or wata_limiter.remaining():
+            return
+        task = asyncio.create_task(self._prefetch(tg_user, amounts))
+        self.pending[tg_user.id] = task
+
+        def done(_):
+            self.pending.pop(tg_user.id, None)
+            self.prefetching.pop(tg_user.id, None)
+        task.add_done_callback(done)
+
+    async def _prefetch(self, tg_user, amounts: list):
+        try:
+            async with async_session() as session:
+                user = await get_or_create_user(session, tg_user)
+                amount = await likely_amount(session, user.id, amounts)
+                if await self._find_open(session, tg_user.id, amount):
+                    return
+                self.prefetching[tg_user.id] = amount
+                link = await self._create(session, user, amount, PREPARED_STATUS)
+            if link:
+                logger.info("Ссылка на %s ₽ для пользователя %s создана заранее", amount, tg_user.id)
+        except Exception as e:
+            logger.warning("Не удалось заранее создать ссылку для пользователя %s: %r", tg_user.id, e)
+
+    async def ready(self, tg_user, amount: float) -> Optional[PaymentLink]:
+        """
+        Уже созданная неоплаченная ссылка на эту сумму (заранее или показанная ранее),
+        открытая пользователю; None - ссылку нужно создавать. Фоновое создание
+        ждем, только если оно идет для этой же суммы
+        """
+        task = self.pending.get(tg_user.id)
+        if task and self.prefetching.get(tg_user.id) == amount:
+            await asyncio.shield(task)
+
+        async with async_session() as session:
+            link = await self._find_open(session, tg_user.id, amount)
+            if link is None:
+                return None
+            # Платеж могли оплатить или пометить истекшим между выборкой и этим запросом
+            result = await session.execute(
+                update(Payment)
+                .where(Payment.id == link.payment_id, Payment.status.notin_([PAID_STATUS, EXPIRED_STATUS]))
+                .values(status=OPENED_STATUS)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return link if result.rowcount == 1 else None
+
+    async def create(self, tg_user, amount: float) -> Optional[PaymentLink]:
+        """Создает новый платеж и ссылку WATA"""
+        async with async_session() as session:
+            user = await get_or_create_user(session, tg_user)
+            return await self._create(session, user, amount, None)
+
+    async def take(self, tg_user, amount: float) -> Optional[PaymentLink]:
+        """Ссылка на оплату для пользователя и суммы: уже созданная, если она не оплачена, иначе новая"""
+        return await self.ready(tg_user, amount) or await self.create(tg_user, amount)
+
+
+payment_links = PaymentLinkCache()
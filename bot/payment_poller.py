@@ -0,0 +1,186 @@
+"""
+Фоновая проверка неоплаченных платежей в WATA.
+Свежие платежи опрашиваются часто, старые - реже; время последнего запроса
+хранится в payments.checked_at, поэтому очередь опроса выбирается одним
+запросом и переживает перезапуск. При ответе 429 опрос откладывается
+с экспоненциально растущей паузой.
+
+Статус Expired ставится только по ответу WATA: ссылку, оплаченную перед самым
+истечением срока, еще можно зачислить. Без запроса к WATA истекают лишь заранее
+созданные ссылки, которые пользователю так и не показали.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_, and_, nullsfirst
+
+from config.config import PAYMENT_POLL_CONCURRENCY
+from db.database import async_session
+from db.models import Payment
+from db.service.payment_service import get_payment_by_id, update_payment_status
+from bot.donate_api import DonateApi
+from bot.payment_processing import complete_payment, notify_payment_result, PAID_STATUS, EXPIRED_STATUS, \
+    PREPARED_STATUS
+from bot.payment_links import PREPARED_LINK_TTL
+
+logger = logging.getLogger(__name__)
+
+# (максимальный возраст платежа, интервал опроса); None - старше, в том числе
+# ссылки после LINK_LIFETIME, пока WATA не подтвердит оплату или истечение
+POLL_SCHEDULE = [
+    (timedelta(minutes=15), timedelta(minutes=1)),
+    (timedelta(hours=2), timedelta(minutes=5)),
+    (None, timedelta(minutes=30)),
+]
+
+MIN_BACKOFF = 30  # секунд
+MAX_BACKOFF = 600
+
+
+def poll_interval(age: timedelta) -> timedelta:
+    """Как часто опрашивать платеж данного возраста"""
+    for max_age, interval in POLL_SCHEDULE:
+        if max_age is None or age < max_age:
+            return interval
+
+
+def due_condition(now: datetime):
+    """Условие SQL: платежу по возрасту пора на повторный опрос (см. POLL_SCHEDULE)"""
+    conditions = []
+    younger_than = None
+    for max_age, interval in POLL_SCHEDULE:
+        bucket = [or_(Payment.checked_at.is_(None), Payment.checked_at <= now - interval)]
+        if max_age is not None:
+            bucket.append(Payment.created_at > now - max_age)
+        if younger_than is not None:
+            bucket.append(Payment.created_at <= now - younger_than)
+        conditions.append(and_(*bucket))
+        younger_than = max_age
+    return or_(*conditions)
+
+
+class PaymentPoller:
+    def __init__(self, bot, concurrency: int = PAYMENT_POLL_CONCURRENCY, batch_limit: int = 200):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.batch_limit = batch_limit
+        self.donate_api = DonateApi()
+        self.backoff = 0
+        self.backoff_until = None
+        self.throttled = False
+        self.stats = Counter()
+
+    async def _expire_stale(self, session, now: datetime) -> int:
+        """
+        Одним запросом помечает истекшими заранее созданные ссылки, которые
+        пользователь так и не выбрал: оплатить их он не мог, спрашивать WATA не нужно
+        """
+        result = await session.execute(
+            update(Payment)
+            .where(Payment.status == PREPARED_STATUS, Payment.created_at < now - PREPARED_LINK_TTL)
+            .values(status=EXPIRED_STATUS)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return result.rowcount
+
+    async def load_due_payments(self, now: datetime) -> list:
+        """
+        Открытые платежи, которым по возрасту пора на повторный опрос.
+        Отбор идет в SQL до LIMIT; первыми - те, кого дольше всего не проверяли
+        """
+        async with async_session() as session:
+            expired = await self._expire_stale(session, now)
+            if expired:
+                self.stats['expired'] += expired
+
+            result = await session.execute(
+                select(Payment.id, Payment.payment_id)
+                .where(
+                    Payment.status.notin_([PAID_STATUS, EXPIRED_STATUS, PREPARED_STATUS]),
+                    Payment.payment_id.isnot(None),
+                    due_condition(now)
+                )
+                .order_by(nullsfirst(Payment.checked_at.asc()), Payment.id)
+                .limit(self.batch_limit)
+            )
+            return [tuple(row) for row in result.all()]
+
+    async def _mark_checked(self, id: int):
+        async with async_session() as session:
+            await session.execute(
+                update(Payment)
+                .where(Payment.id == id)
+                .values(checked_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+    def _on_rate_limited(self):
+        """Ответ 429: прекращаем текущий проход и откладываем следующий"""
+        self.throttled = True
+        self.backoff = min(max(self.backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+        self.backoff_until = datetime.utcnow() + timedelta(seconds=self.backoff)
+        self.stats['rate_limited'] += 1
+        logger.warning("WATA вернул 429, опрос платежей отложен на %s сек", self.backoff)
+
+    async def poll_payment(self, id: int, payment_id: str):
+        response = await self.donate_api.find_donate_url(payment_id)
+        self.stats['requests'] += 1
+
+        if response is None:
+            self.stats['errors'] += 1
+            await self._mark_checked(id)
+            return
+        if response['status'] == 'Time':
+            # checked_at не трогаем: после паузы платеж снова будет в начале очереди
+            self._on_rate_limited()
+            return
+        await self._mark_checked(id)
+
+        if response['status'] == 'Closed':
+            async with async_session() as session:
+                payment = await get_payment_by_id(session, id)
+                result = await complete_payment(session, payment, float(response['amount']))
+            await notify_payment_result(self.bot, result)
+            self.stats['completed'] += 1
+            return
+
+        expiration = datetime.strptime(response['expirationDateTime'], "%Y-%m-%dT%H:%M:%S.%fZ")
+        if expiration < datetime.utcnow():
+            async with async_session() as session:
+                await update_payment_status(session, id=id, status=EXPIRED_STATUS)
+            self.stats['expired'] += 1
+
+    async def run(self):
+        """Один проход опроса: вызывается планировщиком"""
+        now = datetime.utcnow()
+        if self.backoff_until and now < self.backoff_until:
+            return
+
+        due = await self.load_due_payments(now)
+        if not due:
+            return
+
+        self.throttled = False
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def poll(id, payment_id):
+            async with semaphore:
+                if self.throttled:
+                    return
+                try:
+                    await self.poll_payment(id, payment_id)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Ошибка фоновой проверки платежа {id}: {e}")
+
+        await asyncio.gather(*(poll(id, payment_id) for id, payment_id in due))
+
+        if not self.throttled:
+            self.backoff = 0
+
+        logger.info("Фоновая проверка платежей: %d к опросу, итого %s", len(due), dict(self.stats))
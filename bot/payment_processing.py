@@ -0,0 +1,199 @@
+"""
+Зачисление оплаченных платежей.
+Общий код для кнопки «Проверить оплату», webhook'а WATA и фоновой проверки.
+Зачисление идет в два шага: сначала баланс и подписка меняются одной транзакцией
+(credit_payment), затем конфигурация продлевается в панели (renew_panel).
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import types
+from sqlalchemy import select
+
+from config.config import VPN_PRICE, VPN_PRICE_3, VPN_PRICE_6
+from db.models import User, Payment
+from db.service.payment_service import claim_payment
+from db.service.user_service import renew_subscription
+from bot.vpn_manager import VPNManager
+
+logger = logging.getLogger(__name__)
+
+# Статусы ссылки WATA, которые храним в payments.status
+OPENED_STATUS = 'Opened'
+PAID_STATUS = 'Closed'
+EXPIRED_STATUS = 'Expired'
+# Ссылка создана заранее и пользователю еще не показана
+PREPARED_STATUS = 'Prepared'
+
+
+def choose_period(balance: float) -> Optional[tuple]:
+    """Максимальный период подписки, который покрывает баланс: (месяцы, цена, текст)"""
+    if balance >= VPN_PRICE_6:
+        return 6, VPN_PRICE_6, "6 месяцев"
+    if balance >= VPN_PRICE_3:
+        return 3, VPN_PRICE_3, "3 месяца"
+    if balance >= VPN_PRICE:
+        return 1, VPN_PRICE, "1 месяц"
+    return None
+
+
+def success_keyboard() -> types.InlineKeyboardMarkup:
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                types.InlineKeyboardButton(
+                    text="💳 Продлить подписку",
+                    callback_data="update_sub"
+                )
+            ],
+            [
+                types.InlineKeyboardButton(
+                    text="🏠 Домой",
+                    callback_data="home"
+                )
+            ]
+        ]
+    )
+
+
+async def credit_payment(session, payment: Payment, amount: float) -> dict:
+    """
+    Первый шаг: одной транзакцией захватывает платеж, зачисляет сумму
+    и продлевает подписку в БД. Панель здесь не вызывается.
+
+    Возвращает словарь со статусом:
+    - already_processed: платеж уже зачислен или зачисляется параллельно
+    - insufficient: сумма зачислена, но ее не хватает на продление
+    - credited: подписка продлена в БД, дальше нужен renew_panel
+    """
+    if not await claim_payment(session, payment.id, PAID_STATUS, amount=amount, completed_at=datetime.utcnow()):
+        await session.rollback()
+        return {'status': 'already_processed'}
+
+    # Блокируем пользователя, чтобы параллельные зачисления не потеряли изменения баланса
+    result = await session.execute(
+        select(User).where(User.id == payment.user_id).with_for_update().execution_options(populate_existing=True)
+    )
+    user = result.scalar_one()
+    user.balance += amount
+
+    period = choose_period(user.balance)
+    if period is None:
+        await session.commit()
+        logger.info("Платеж %s зачислен: пользователь %s, сумма %s", payment.id, user.telegram_id, amount)
+        return {'status': 'insufficient', 'user': user}
+    period_months, price, period_text = period
+
+    old_sub_end = user.subscription_end
+    was_active = user.is_active
+    await renew_subscription(session, user.id, period_months * 30, price, commit=False)
+    new_sub_end = user.subscription_end
+    await session.commit()
+    logger.info("Платеж %s зачислен, подписка продлена на %s мес.: пользователь %s",
+                payment.id, period_months, user.telegram_id)
+    return {
+        'status': 'credited',
+        'user': user,
+        'period': period,
+        'old_sub_end': old_sub_end,
+        'new_sub_end': new_sub_end,
+        'was_active': was_active
+    }
+
+
+async def refund_credit(session, credit: dict) -> User:
+    """
+    Возвращает деньги и срок подписки после ошибки панели относительно текущих
+    значений, под блокировкой строки пользователя: продление, сделанное между
+    зачислением и возвратом (например, другим платежом), сохраняется
+    """
+    period_months, price, period_text = credit['period']
+    result = await session.execute(
+        select(User).where(User.id == credit['user'].id).with_for_update().execution_options(populate_existing=True)
+    )
+    user = result.scalar_one()
+    user.balance += price
+    if user.subscription_end == credit['new_sub_end']:
+        # Срок с момента зачисления не менялся - возвращаем прежний как был
+        user.subscription_end = credit['old_sub_end']
+        user.is_active = credit['was_active']
+    elif user.subscription_end is not None:
+        user.subscription_end -= timedelta(days=period_months * 30)
+    await session.commit()
+    return user
+
+
+async def renew_panel(session, credit: dict) -> dict:
+    """
+    Второй шаг: продление конфигурации в панели после фиксации зачисления.
+    Если панель не ответила, возвращает деньги на баланс и прежний срок подписки.
+
+    Возвращает словарь со статусом renewed или vpn_failed и текстом для пользователя
+    """
+    user = credit['user']
+    period_months, price, period_text = credit['period']
+
+    vpn_manager = VPNManager(session)
+    if not await vpn_manager.renew_subscription(user=user, subscription_days=period_months * 30):
+        user = await refund_credit(session, credit)
+        return {
+            'status': 'vpn_failed',
+            'user': user,
+            'text': (
+                f"❌ Ошибка при обновлении/создании VPN конфигурации.\n\n"
+                f"💰 Деньги возвращены на баланс: {price} ₽.\n"
+                "Пожалуйста, попробуйте продлить подписку через главное меню \"Продлить подписку\"."
+            )
+        }
+
+    # VPNManager меняет vpn_link, но сохранение оставляет вызывающему коду
+    await session.commit()
+    if user.vpn_link:
+        text = (
+            f"✅ Подписка успешно продлена!\n\n"
+            f"📅 Период: {period_text}\n"
+            f"📅 Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y')}\n\n"
+            f"🔗 Ваша VPN ссылка:\n\n"
+            f"{user.vpn_link}\n\n"
+        )
+    else:
+        text = (
+            f"✅ Подписка продлена!\n\n"
+            f"📅 Период: {period_text}\n"
+            f"Подписка активна до: {user.subscription_end.strftime('%d.%m.%Y')}\n\n"
+            f"❌ Не удалось получить VPN конфигурацию. Попробуйте позже в разделе 'Мои ключи'."
+        )
+    return {'status': 'renewed', 'user': user, 'text': text}
+
+
+async def complete_payment(session, payment: Payment, amount: float) -> dict:
+    """
+    Зачисляет оплаченный платеж ровно один раз и продлевает конфигурацию в панели.
+    Параллельные вызовы для одного платежа безопасны: панель вызовет только первый.
+    Статусы - см. credit_payment и renew_panel
+    """
+    result = await credit_payment(session, payment, amount)
+    if result['status'] != 'credited':
+        return result
+    return await renew_panel(session, result)
+
+
+async def notify_payment_result(bot, result: dict):
+    """Отправляет пользователю результат зачисления, найденного без его участия (webhook, фоновая проверка)"""
+    status = result['status']
+    if status == 'already_processed':
+        return
+    user = result['user']
+    if status == 'insufficient':
+        text = (
+            f"✅ Оплата получена, баланс пополнен.\n\n"
+            f"💰 Баланс: {user.balance} ₽. Для продления необходимо минимум: {int(VPN_PRICE)} ₽."
+        )
+    else:
+        text = result['text']
+    try:
+        await bot.send_message(user.telegram_id, text, reply_markup=success_keyboard(), parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Не удалось уведомить пользователя {user.telegram_id} об оплате: {e}")
@@ -0,0 +1,193 @@
+"""
+Ночная сверка таблицы payments с WATA.
+Платежи за последние RECONCILE_WINDOW читаются страницами по id, каждая в своей
+короткой транзакции: пока идут запросы к WATA (с паузами на 429 это минуты),
+транзакция на primary не держится. Статус каждой ссылки запрашивается в WATA
+с ограниченным параллелизмом. Безопасные исправления (истекшие и так и не
+созданные ссылки) применяются пакетными UPDATE, остальные расхождения попадают
+в отчет для администраторов; платежи, которые проверить не удалось (429 или
+ошибка запроса), показываются отдельно от не найденных в WATA.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import httpx
+from sqlalchemy import select, update
+
+from config.config import PAYMENT_POLL_CONCURRENCY
+from db.database import async_session
+from db.models import Payment
+from bot.donate_api import DonateApi, WataRateLimited, wata_limiter
+from bot.payment_processing import PAID_STATUS, EXPIRED_STATUS
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_WINDOW = timedelta(days=7)
+# Платеж без ссылки WATA старше этого срока считаем брошенным
+STUCK_PENDING_AGE = timedelta(hours=1)
+BATCH_SIZE = 500
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Категории расхождений
+EXPIRED = 'expired'                # ссылка истекла в WATA, у нас еще открыта - исправляется
+STUCK_PENDING = 'stuck_pending'    # ссылка так и не создалась - исправляется
+MISSED_PAID = 'missed_paid'        # оплачено в WATA, у нас не зачислено
+AMOUNT_MISMATCH = 'amount_mismatch'  # оплачено с обеих сторон, но суммы различаются
+NOT_FOUND = 'not_found'            # WATA не знает ссылку (404)
+THROTTLED = 'throttled'            # не проверено: WATA ограничила частоту запросов
+ERROR = 'error'                    # не проверено: ошибка запроса к WATA
+SAFE_FIXES = (EXPIRED, STUCK_PENDING)
+
+CATEGORY_TITLES = {
+    EXPIRED: "Истекшие ссылки (закрыты)",
+    STUCK_PENDING: "Платежи без ссылки (закрыты)",
+    MISSED_PAID: "Оплачено в WATA, не зачислено",
+    AMOUNT_MISMATCH: "Расхождение суммы",
+    NOT_FOUND: "Ссылка не найдена в WATA",
+    THROTTLED: "Не проверено: ограничение частоты WATA",
+    ERROR: "Не проверено: ошибка запроса к WATA",
+}
+
+
+@dataclass
+class ReconciliationReport:
+    checked: int = 0
+    mismatches: dict = field(default_factory=lambda: defaultdict(list))  # категория -> [payments.id]
+    fixed: int = 0
+
+    def format(self) -> str:
+        text = "🧾 <b>Сверка платежей с WATA</b>\n"
+        text += f"📅 Время: {datetime.utcnow().strftime('%d.%m.%Y %H:%M:%S')}\n\n"
+        text += f"🔎 Проверено платежей: {self.checked}\n"
+        text += f"🛠 Исправлено автоматически: {self.fixed}\n"
+        if not any(self.mismatches.values()):
+            text += "\n✅ Расхождений нет"
+            return text
+        for category, title in CATEGORY_TITLES.items():
+            ids = self.mismatches.get(category)
+            if not ids:
+                continue
+            shown = ", ".join(str(id) for id in ids[:20])
+            more = f" и еще {len(ids) - 20}" if len(ids) > 20 else ""
+            text += f"\n<b>{title}:</b> {len(ids)}\n{shown}{more}\n"
+        return text
+
+
+def classify(payment_status: str, payment_amount: Optional[float], response: Optional[dict],
+             now: datetime) -> Optional[str]:
+    """Категория расхождения между нашей записью и ответом WATA; None - записи совпадают"""
+    if response is None:
+        return NOT_FOUND
+    wata_paid = response.get('status') == PAID_STATUS
+    if wata_paid and payment_status != PAID_STATUS:
+        return MISSED_PAID
+    if wata_paid and payment_amount is not None and float(response.get('amount', 0)) != float(payment_amount):
+        return AMOUNT_MISMATCH
+    if payment_status in (PAID_STATUS, EXPIRED_STATUS) or wata_paid:
+        return None
+    expiration = datetime.strptime(response['expirationDateTime'], "%Y-%m-%dT%H:%M:%S.%fZ")
+    if expiration < now:
+        return EXPIRED
+    return None
+
+
+class PaymentReconciler:
+    def __init__(self, concurrency: int = PAYMENT_POLL_CONCURRENCY, window: timedelta = RECONCILE_WINDOW):
+        self.concurrency = concurrency
+        self.window = window
+        self.donate_api = DonateApi()
+
+    async def _find(self, wata_id: str) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        Запрос в WATA с ожиданием общей паузы после 429.
+        Возвращает (категория, ответ): THROTTLED или ERROR, если ответа нет
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES):
+            try:
+                return None, await self.donate_api.get_link(wata_id)
+            except WataRateLimited:
+                if attempt == MAX_RATE_LIMIT_RETRIES - 1:
+                    break
+                await asyncio.sleep(max(wata_limiter.remaining(), 1.0))
+            except httpx.HTTPError as e:
+                logger.warning("Сверка: ошибка запроса ссылки %s: %r", wata_id, e)
+                return ERROR, None
+        return THROTTLED, None
+
+    async def _check_batch(self, rows, report: ReconciliationReport, now: datetime):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(id, wata_id, status, amount):
+            async with semaphore:
+                category, response = await self._find(wata_id)
+            category = category or classify(status, amount, response, now)
+            if category:
+                report.mismatches[category].append(id)
+
+        await asyncio.gather(*(check(*row) for row in rows))
+        report.checked += len(rows)
+
+    async def _expire(self, ids: list) -> int:
+        """Пакетно закрывает платежи, если они все еще не оплачены"""
+        fixed = 0
+        async with async_session() as session:
+            for i in range(0, len(ids), BATCH_SIZE):
+                result = await session.execute(
+                    update(Payment)
+                    .where(
+                        Payment.id.in_(ids[i:i + BATCH_SIZE]),
+                        Payment.status.notin_([PAID_STATUS, EXPIRED_STATUS])
+                    )
+                    .values(status=EXPIRED_STATUS)
+                    .execution_options(synchronize_session=False)
+                )
+                fixed += result.rowcount
+            await session.commit()
+        return fixed
+
+    async def run(self) -> ReconciliationReport:
+        now = datetime.utcnow()
+        report = ReconciliationReport()
+
+        async with async_session() as session:
+            # Платежи без ссылки WATA сверять не с чем
+            stuck = await session.execute(
+                select(Payment.id).where(
+                    Payment.payment_id.is_(None),
+                    Payment.status.notin_([PAID_STATUS, EXPIRED_STATUS]),
+                    Payment.created_at < now - STUCK_PENDING_AGE
+                )
+            )
+            report.mismatches[STUCK_PENDING].extend(stuck.scalars().all())
+
+        last_id = 0
+        while True:
+            # Страница читается в отдельной транзакции, запросы к WATA идут уже без нее
+            async with async_session() as session:
+                result = await session.execute(
+                    select(Payment.id, Payment.payment_id, Payment.status, Payment.amount)
+                    .where(
+                        Payment.id > last_id,
+                        Payment.payment_id.isnot(None),
+                        Payment.created_at >= now - self.window
+                    )
+                    .order_by(Payment.id)
+                    .limit(BATCH_SIZE)
+                )
+                rows = result.all()
+            if not rows:
+                break
+            await self._check_batch(rows, report, now)
+            last_id = rows[-1][0]
+
+        report.fixed = await self._expire([id for category in SAFE_FIXES for id in report.mismatches[category]])
+        logger.info(
+            "Сверка платежей: проверено %d, исправлено %d, расхождения %s",
+            report.checked, report.fixed, {k: len(v) for k, v in report.mismatches.items() if v}
+        )
+        return report
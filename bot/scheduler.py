@@ -1,20 +1,31 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from db.database import async_session
 from db.models import User
 from sqlalchemy import select, update, or_, and_
 from datetime import datetime, timedelta
 from aiogram import Bot
 from aiogram import types
-from config.config import BOT_TOKEN, ADMIN_NAME_1, ADMIN_NAME_2
+from config.config import BOT_TOKEN, ADMIN_NAME_1, ADMIN_NAME_2, SHEETS_SYNC_INTERVAL, SHEETS_FULL_REBUILD_HOURS, \
+    FSM_STORAGE, FSM_STATE_TTL, BOT_MODE
 from db.service.user_cleanup_service import (
     cleanup_expired_users, get_cleanup_stats
 )
+from db.query_profiler import query_profiler
+from bot.payment_poller import PaymentPoller
+from bot.payment_reconciliation import PaymentReconciler
+from db.service.stats_service import rollup_recent
+from bot.fsm_storage import DatabaseStorage
+from bot.metrics import instrument_bot
+from bot.broadcast import broadcast_engine
 import asyncio
+import functools
 
-bot = Bot(token=BOT_TOKEN)
+bot = instrument_bot(Bot(token=BOT_TOKEN))
 scheduler = AsyncIOScheduler()
 ADMINS = [ADMIN_NAME_1, ADMIN_NAME_2]
+payment_poller = PaymentPoller(bot)
 
 async def check_expired_subscriptions():
     """Проверяет истекшие подписки"""
@@ -186,11 +197,90 @@ async def cleanup_vpn_servers():
                     except Exception as notify_error:
                         print(f"❌ Не удалось уведомить админа @{admin} об ошибке: {notify_error}")
 
+async def send_admin_report(text: str):
+    """Отправляет отчет всем админам, найденным в базе по username"""
+    async with async_session() as session:
+        for admin in ADMINS:
+            if not admin:
+                continue
+            result = await session.execute(
+                select(User).where(User.username == admin.replace('@', ''))
+            )
+            admin_user = result.scalar_one_or_none()
+            if not admin_user:
+                print(f"⚠️ Админ @{admin} не найден в базе данных")
+                continue
+            try:
+                await bot.send_message(admin_user.telegram_id, text, parse_mode='HTML')
+            except Exception as e:
+                print(f"❌ Ошибка отправки отчета админу @{admin}: {e}")
+
+
+async def reconcile_payments():
+    """Ночная сверка платежей с WATA"""
+    report = await PaymentReconciler().run()
+    await send_admin_report(report.format())
+
+
+async def rollup_daily_stats():
+    """Пересчитывает дневные сводки за последние дни"""
+    async with async_session() as session:
+        await rollup_recent(session)
+
+
+async def reconcile_daily_stats():
+    """Пересчитывает итоги последней сводки полным подсчетом по таблицам"""
+    async with async_session() as session:
+        await rollup_recent(session, reconcile=True)
+
+
+async def sync_sheets_delta():
+    """Выгружает изменения в Google Sheets; раз в SHEETS_FULL_REBUILD_HOURS перезаписывает листы целиком"""
+    from sheets.sync_to_sheets import SheetsSync
+    full_rebuild_after = timedelta(hours=SHEETS_FULL_REBUILD_HOURS) if SHEETS_FULL_REBUILD_HOURS else None
+    results = await SheetsSync().delta_sync(full_rebuild_after=full_rebuild_after)
+    print(f"📊 Синхронизация с Google Sheets: {results}")
+
+
+async def cleanup_fsm_states():
+    """Удаляет давно не менявшиеся состояния FSM"""
+    removed = await DatabaseStorage().cleanup()
+    if removed:
+        print(f"🧹 Удалено устаревших состояний FSM: {removed}")
+
+
+async def cleanup_telegram_updates():
+    """Удаляет старые update_id, по которым webhook отсекал повторы"""
+    from bot.telegram_webhook import deduplicator
+    await deduplicator.cleanup()
+
+
+async def resume_broadcasts():
+    """Продолжает рассылки, которые никто не отправляет (после перезапуска или падения процесса)"""
+    resumed = await broadcast_engine.resume(bot)
+    if resumed:
+        print(f"📨 Продолжены рассылки: {resumed}")
+
+
+async def poll_pending_payments():
+    """Фоновая проверка неоплаченных платежей в WATA"""
+    await payment_poller.run()
+
+
+def profiled_job(func):
+    """Относит SQL-запросы задачи планировщика к ее имени в профилировщике"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with query_profiler.scope(f"job:{func.__name__}"):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
 def start_scheduler():
     """Запускает планировщик"""
     # Проверяем истекшие подписки каждый день в полночь
     scheduler.add_job(
-        check_expired_subscriptions,
+        profiled_job(check_expired_subscriptions),
         CronTrigger(hour=9, minute=0),
         id='check_subscriptions',
         replace_existing=True
@@ -198,7 +288,7 @@ def start_scheduler():
     
     # Проверяем подписки, которые скоро истекают, каждый день в 12:00
     scheduler.add_job(
-        check_upcoming_expirations,
+        profiled_job(check_upcoming_expirations),
         CronTrigger(hour=12, minute=0),
         id='check_upcoming_expirations',
         replace_existing=True
@@ -206,10 +296,85 @@ def start_scheduler():
     
     # Автоматическая очистка VPN серверов каждый день в 02:00
     scheduler.add_job(
-        cleanup_vpn_servers,
+        profiled_job(cleanup_vpn_servers),
         CronTrigger(hour=2, minute=0),
         id='cleanup_vpn_servers',
         replace_existing=True
     )
     
+    # Сверка платежей с WATA каждый день в 03:30
+    scheduler.add_job(
+        profiled_job(reconcile_payments),
+        CronTrigger(hour=3, minute=30),
+        id='reconcile_payments',
+        replace_existing=True
+    )
+    
+    # Дневные сводки для статистики админов каждый час
+    scheduler.add_job(
+        profiled_job(rollup_daily_stats),
+        CronTrigger(minute=5),
+        id='rollup_daily_stats',
+        replace_existing=True,
+        next_run_time=datetime.now()  # сразу после старта: досчитывает пропущенные дни
+    )
+    
+    # Сверка итогов дневных сводок с таблицами раз в сутки
+    scheduler.add_job(
+        profiled_job(reconcile_daily_stats),
+        CronTrigger(hour=4, minute=35),
+        id='reconcile_daily_stats',
+        replace_existing=True
+    )
+    
+    # Выгрузка изменений в Google Sheets
+    if SHEETS_SYNC_INTERVAL:
+        scheduler.add_job(
+            profiled_job(sync_sheets_delta),
+            IntervalTrigger(minutes=SHEETS_SYNC_INTERVAL),
+            id='sync_sheets_delta',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+    
+    # Очистка устаревших состояний FSM каждый час
+    if FSM_STORAGE == 'db' and FSM_STATE_TTL:
+        scheduler.add_job(
+            profiled_job(cleanup_fsm_states),
+            CronTrigger(minute=20),
+            id='cleanup_fsm_states',
+            replace_existing=True
+        )
+    
+    # Очистка принятых update_id в режиме webhook раз в сутки
+    if BOT_MODE == 'webhook':
+        scheduler.add_job(
+            profiled_job(cleanup_telegram_updates),
+            CronTrigger(hour=4, minute=0),
+            id='cleanup_telegram_updates',
+            replace_existing=True
+        )
+    
+    # Незавершенные рассылки: сразу после старта и затем каждую минуту
+    scheduler.add_job(
+        profiled_job(resume_broadcasts),
+        IntervalTrigger(minutes=1),
+        id='resume_broadcasts',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now()
+    )
+    
+    # Фоновая проверка неоплаченных платежей каждую минуту
+    scheduler.add_job(
+        profiled_job(poll_pending_payments),
+        IntervalTrigger(minutes=1),
+        id='poll_pending_payments',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+    
     scheduler.start() 
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Прием обновлений Telegram через webhook (BOT_MODE=webhook).
+api.py принимает POST от Telegram, проверяет секрет из заголовка
+X-Telegram-Bot-Api-Secret-Token, отбрасывает повторы по update_id и передает
+обновление диспетчеру в фоне, чтобы сразу ответить Telegram 200.
+
+Повторы отсекаются сначала в памяти воркера, затем вставкой update_id в таблицу
+telegram_updates (создает db/migrations/add_telegram_updates.py): повторная
+доставка может прийти в другой воркер uvicorn.
+Webhook регистрирует main.py, который в этом режиме запускает только планировщик.
+
+При UPDATE_WORKERS > 0 обновления не обрабатываются в процессе api.py, а уходят
+в процессы-воркеры по id пользователя (bot/update_sharding.py); api.py тогда
+запускается с одним воркером uvicorn.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import types
+from fastapi import APIRouter, Request, Response
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from config.config import TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET, UPDATE_WORKERS
+from db.database import async_session
+from db.models import TelegramUpdate
+from bot.dispatcher import bot, dp
+from bot.update_sharding import ShardedDispatcher
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+WORKER_CHECK_INTERVAL = 1.0
+RECENT_UPDATES = 10000
+# Telegram повторяет доставку недолго, сутки с запасом
+UPDATE_RETENTION = timedelta(days=1)
+
+
+class UpdateDeduplicator:
+    def __init__(self, session_factory=async_session, recent: int = RECENT_UPDATES):
+        self.session_factory = session_factory
+        self.recent = OrderedDict()
+        self.recent_limit = recent
+
+    def _remember(self, update_id: int):
+        self.recent[update_id] = None
+        if len(self.recent) > self.recent_limit:
+            self.recent.popitem(last=False)
+
+    async def claim(self, update_id: int) -> bool:
+        """True, если обновление пришло впервые и его нужно обработать"""
+        if update_id in self.recent:
+            return False
+        async with self.session_factory() as session:
+            session.add(TelegramUpdate(update_id=update_id, received_at=datetime.utcnow()))
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                self._remember(update_id)
+                return False
+        self._remember(update_id)
+        return True
+
+    async def release(self, update_id: int):
+        """Забывает update_id, чтобы повторная доставка обновления была обработана"""
+        self.recent.pop(update_id, None)
+        async with self.session_factory() as session:
+            await session.execute(delete(TelegramUpdate).where(TelegramUpdate.update_id == update_id))
+            await session.commit()
+
+    async def cleanup(self, now: Optional[datetime] = None) -> int:
+        """Удаляет update_id старше UPDATE_RETENTION"""
+        now = now or datetime.utcnow()
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(TelegramUpdate).where(TelegramUpdate.received_at < now - UPDATE_RETENTION)
+            )
+            await session.commit()
+        return result.rowcount
+
+
+deduplicator = UpdateDeduplicator()
+telegram_router = APIRouter()
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_tasks = set()
+sharded: Optional[ShardedDispatcher] = None
+
+
+def check_secret(received: Optional[str]) -> bool:
+    return bool(TELEGRAM_WEBHOOK_SECRET) and hmac.compare_digest(received or '', TELEGRAM_WEBHOOK_SECRET)
+
+
+async def _process(update: types.Update):
+    try:
+        await dp.feed_update(bot, update)
+    except Exception:
+        logger.exception("Ошибка обработки обновления %s", update.update_id)
+
+
+@telegram_router.post(TELEGRAM_WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    if not check_secret(request.headers.get(SECRET_HEADER)):
+        logger.warning("Обновление Telegram с неверным секретом отклонено")
+        return Response(status_code=403)
+
+    if sharded is not None:
+        # Разбор Update и обработка - в воркере; здесь нужны только update_id и пользователь
+        raw = await request.body()
+        data = json.loads(raw)
+        if not await deduplicator.claim(data['update_id']):
+            return {'status': 'duplicate'}
+        if sharded.submit(raw, data) is None:
+            # Очередь переполнена: пусть Telegram повторит доставку позже
+            await deduplicator.release(data['update_id'])
+            return Response(status_code=503)
+        return {'status': 'ok'}
+
+    update = types.Update.model_validate(await request.json(), context={'bot': bot})
+    if not await deduplicator.claim(update.update_id):
+        return {'status': 'duplicate'}
+
+    task = asyncio.create_task(_process(update))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return {'status': 'ok'}
+
+
+async def set_webhook():
+    """Регистрирует webhook в Telegram (вызывает main.py при BOT_MODE=webhook)"""
+    if not TELEGRAM_WEBHOOK_URL or not TELEGRAM_WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook нужны TELEGRAM_WEBHOOK_URL и TELEGRAM_WEBHOOK_SECRET")
+    await bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL.rstrip('/') + TELEGRAM_WEBHOOK_PATH,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+
+
+async def _watch_workers():
+    while True:
+        await asyncio.sleep(WORKER_CHECK_INTERVAL)
+        sharded.check_workers()
+
+
+async def startup():
+    """Запускает процессы-воркеры, если обновления обрабатываются в них"""
+    global sharded
+    if UPDATE_WORKERS:
+        sharded = ShardedDispatcher(UPDATE_WORKERS)
+        sharded.start()
+        task = asyncio.create_task(_watch_workers())
+        _tasks.add(task)
+
+
+async def shutdown():
+    """Дожидается обработки принятых обновлений и закрывает сессию бота"""
+    global sharded
+    if sharded is not None:
+        for task in list(_tasks):
+            task.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, sharded.stop)
+        sharded = None
+    if _tasks:
+        await asyncio.wait(list(_tasks), timeout=10)
+    await dp.storage.close()
+    await bot.session.close()
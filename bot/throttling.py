@@ -0,0 +1,160 @@
+"""
+Ограничение частоты запросов пользователя (антифлуд).
+У каждого пользователя своя корзина токенов на каждую группу обработчиков
+(payments, configs, admin, default): корзина пополняется со скоростью rate в секунду
+до burst токенов, каждое сообщение или нажатие кнопки забирает один токен.
+
+Повторное нажатие той же кнопки, пока первое еще обрабатывается, объединяется
+с ним: обработчик не вызывается, пользователю сразу отвечает callback.answer.
+Отброшенные и объединенные запросы считаются по группам (report и метрика
+bot_throttled_total); раз в
+REPORT_INTERVAL сводка пишется в лог из того процесса, где работают обработчики
+(в режиме webhook это api.py или воркеры, а не main.py с планировщиком).
+"""
+
+import logging
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from config.config import THROTTLE_RATES
+from bot.metrics import throttled
+
+logger = logging.getLogger(__name__)
+
+# Группа по имени обработчика важнее группы по модулю
+HANDLER_GROUPS = {
+    'configs_callback': 'configs',
+    'update_subscription_auto': 'payments',
+    'confirm_subscription': 'payments',
+}
+MODULE_GROUPS = {
+    'bot.handlers.payment': 'payments',
+    'bot.handlers.device': 'configs',
+    'bot.handlers.admin': 'admin',
+}
+DEFAULT_GROUP = 'default'
+MAX_BUCKETS = 100000
+REPORT_INTERVAL = 3600
+
+
+def parse_rates(value: str) -> Dict[str, Tuple[float, float]]:
+    """Разбирает строку вида 'payments=0.2/3,admin=5/30' в {группа: (rate, burst)}"""
+    rates = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        group, limits = item.split('=')
+        rate, burst = limits.split('/')
+        rates[group.strip()] = (float(rate), float(burst))
+    rates.setdefault(DEFAULT_GROUP, (1.0, 10.0))
+    return rates
+
+
+def handler_group(callback) -> str:
+    """Группа обработчика по его имени или модулю"""
+    name = getattr(callback, '__name__', None)
+    if name in HANDLER_GROUPS:
+        return HANDLER_GROUPS[name]
+    return MODULE_GROUPS.get(getattr(callback, '__module__', None), DEFAULT_GROUP)
+
+
+class Throttler:
+    def __init__(self, rates: Optional[Dict[str, Tuple[float, float]]] = None, clock=time.monotonic):
+        self.rates = rates or parse_rates(THROTTLE_RATES)
+        self.clock = clock
+        # (user_id, группа) -> [токены, время последнего пополнения]
+        self.buckets = {}
+        # (user_id, callback.data) нажатий, которые сейчас обрабатываются
+        self.in_flight = set()
+        self.passed = Counter()
+        self.dropped = Counter()
+        self.merged = Counter()
+        self.reported_at = clock()
+
+    def _limits(self, group: str) -> Tuple[float, float]:
+        return self.rates.get(group) or self.rates[DEFAULT_GROUP]
+
+    def allow(self, user_id: int, group: str) -> bool:
+        """Забирает токен из корзины пользователя; False, если корзина пуста"""
+        rate, burst = self._limits(group)
+        now = self.clock()
+        bucket = self.buckets.get((user_id, group))
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self._purge(now)
+            bucket = self.buckets[(user_id, group)] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.passed[group] += 1
+            return True
+        self.dropped[group] += 1
+        throttled.inc(group, 'dropped')
+        return False
+
+    def retry_after(self, user_id: int, group: str) -> float:
+        """Через сколько секунд в корзине появится токен"""
+        rate, _ = self._limits(group)
+        bucket = self.buckets.get((user_id, group))
+        if bucket is None or bucket[0] >= 1 or not rate:
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+    def _purge(self, now: float):
+        # Полные корзины ничем не отличаются от отсутствующих
+        for key, (tokens, updated) in list(self.buckets.items()):
+            rate, burst = self._limits(key[1])
+            if tokens + (now - updated) * rate >= burst:
+                del self.buckets[key]
+
+    def begin(self, user_id: int, data: str, group: str) -> bool:
+        """Отмечает начало обработки нажатия; False, если такое же нажатие уже обрабатывается"""
+        key = (user_id, data)
+        if key in self.in_flight:
+            self.merged[group] += 1
+            throttled.inc(group, 'merged')
+            return False
+        self.in_flight.add(key)
+        return True
+
+    def end(self, user_id: int, data: str):
+        self.in_flight.discard((user_id, data))
+
+    def report(self) -> Dict[str, dict]:
+        """Пропущено, отброшено и объединено запросов по группам"""
+        report = {}
+        for group in sorted(set(self.passed) | set(self.dropped) | set(self.merged)):
+            total = self.passed[group] + self.dropped[group] + self.merged[group]
+            shed = self.dropped[group] + self.merged[group]
+            report[group] = {
+                'passed': self.passed[group],
+                'dropped': self.dropped[group],
+                'merged': self.merged[group],
+                'shed_share': round(shed / total, 4) if total else 0,
+            }
+        return report
+
+    def log_report(self, force: bool = False):
+        """Раз в REPORT_INTERVAL пишет в лог группы, где запросы отсекались, и обнуляет счетчики"""
+        now = self.clock()
+        if not force and now - self.reported_at < REPORT_INTERVAL:
+            return
+        self.reported_at = now
+        for group, stats in self.report().items():
+            if stats['dropped'] or stats['merged']:
+                logger.info("Антифлуд [%s]: пропущено %d, отброшено %d, объединено %d (%.0f%%)",
+                            group, stats['passed'], stats['dropped'], stats['merged'], stats['shed_share'] * 100)
+        self.reset()
+
+    def reset(self):
+        self.passed.clear()
+        self.dropped.clear()
+        self.merged.clear()
+
+
+throttler = Throttler()
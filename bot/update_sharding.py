@@ -0,0 +1,224 @@
+"""
+Распределение обновлений Telegram по процессам-воркерам (UPDATE_WORKERS > 0).
+Процесс api.py (один воркер uvicorn) только принимает webhook и по id пользователя
+выбирает воркер рандеву-хешированием; обновление уходит в очередь этого воркера
+как есть, в байтах. Разбор Update, обработчики и работа с БД идут в воркерах,
+поэтому используются все ядра.
+
+Обновления одного пользователя всегда попадают в один воркер и обрабатываются там
+строго по очереди (как операции с одним key в sheets_writer), поэтому порядок
+сообщений и состояние FSM не ломаются. Упавший воркер перезапускается на той же
+очереди, и еще не взятые им обновления не теряются. Если воркер падает чаще
+MAX_RESTARTS раз за RESTART_WINDOW, его слот выключается, а его пользователи и очередь
+переходят к остальным воркерам (рандеву-хеширование переносит только их).
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import queue
+import time
+import zlib
+from collections import Counter, deque
+from typing import Callable, Optional
+
+from config.config import UPDATE_WORKERS, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HANDLER = 'bot.update_sharding:feed_dispatcher'
+QUEUE_SIZE = 10000
+WORKER_CONCURRENCY = 100
+DRAIN_BATCH = 100
+MAX_RESTARTS = 3
+RESTART_WINDOW = 60.0
+
+
+def user_key(update: dict):
+    """Ключ упорядочивания: id пользователя, иначе id чата, иначе само update_id"""
+    for name, value in update.items():
+        if name == 'update_id' or not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user')
+        if isinstance(sender, dict) and 'id' in sender:
+            return sender['id']
+        chat = value.get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return update.get('update_id')
+
+
+def pick_slot(key, slots) -> int:
+    """Рандеву-хеширование: при выключении слота переезжают только его ключи"""
+    return max(slots, key=lambda slot: zlib.crc32(f"{key}:{slot}".encode()))
+
+
+def load_handler(path: str) -> Callable:
+    module, name = path.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+async def feed_dispatcher(update: dict):
+    """Обработчик по умолчанию: передает обновление диспетчеру бота"""
+    from aiogram import types
+    from bot.dispatcher import bot, dp
+    await dp.feed_update(bot, types.Update.model_validate(update, context={'bot': bot}))
+
+
+# ======================== ВОРКЕР ========================
+
+def worker_main(index: int, updates, results, processed, handler_path: str):
+    """Точка входа процесса-воркера"""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_worker_loop(index, updates, results, processed, load_handler(handler_path)))
+
+
+async def _worker_loop(index: int, updates, results, processed, handler: Callable):
+    loop = asyncio.get_running_loop()
+    if METRICS_PORT:
+        # У каждого воркера свой реестр метрик и свой порт
+        from bot.metrics import start_metrics_server, attach_databases
+        attach_databases()
+        await start_metrics_server(METRICS_PORT + 1 + index)
+    slots = asyncio.Semaphore(WORKER_CONCURRENCY)
+    key_locks = {}
+    key_refs = Counter()
+
+    async def handle(key, update: dict):
+        lock = key_locks.setdefault(key, asyncio.Lock())
+        key_refs[key] += 1
+        try:
+            async with lock:
+                result = await handler(update)
+                if results is not None and result is not None:
+                    results.put((index, result))
+        except Exception:
+            logger.exception("Воркер %d: ошибка обработки обновления %s", index, update.get('update_id'))
+        finally:
+            key_refs[key] -= 1
+            if not key_refs[key]:
+                del key_refs[key]
+                del key_locks[key]
+            with processed.get_lock():
+                processed.value += 1
+            slots.release()
+
+    tasks = set()
+    while True:
+        batch = [await loop.run_in_executor(None, updates.get)]
+        try:
+            while len(batch) < DRAIN_BATCH:
+                batch.append(updates.get_nowait())
+        except queue.Empty:
+            pass
+        for raw in batch:
+            if raw is None:
+                if tasks:
+                    await asyncio.wait(tasks)
+                return
+            update = json.loads(raw)
+            await slots.acquire()
+            task = asyncio.create_task(handle(user_key(update), update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+
+# ======================== ФРОНТ ========================
+
+class ShardedDispatcher:
+    def __init__(self, workers: int = UPDATE_WORKERS, handler: str = DEFAULT_HANDLER,
+                 queue_size: int = QUEUE_SIZE, collect_results: bool = False):
+        self.workers = workers
+        self.handler = handler
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue(queue_size) for _ in range(workers)]
+        self.processed = [self.context.Value('q', 0) for _ in range(workers)]
+        self.results = self.context.Queue() if collect_results else None
+        self.processes: list = [None] * workers
+        self.restarts = [deque() for _ in range(workers)]
+        self.live = set(range(workers))
+        self.dropped = 0
+
+    def _spawn(self, index: int):
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self.results, self.processed[index], self.handler),
+            name=f'update-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    @property
+    def total_processed(self) -> int:
+        return sum(counter.value for counter in self.processed)
+
+    def submit(self, raw: bytes, update: Optional[dict] = None) -> Optional[int]:
+        """Ставит обновление в очередь воркера; номер воркера или None, если очередь переполнена"""
+        if not self.live:
+            raise RuntimeError("Нет живых воркеров обработки обновлений")
+        update = update if update is not None else json.loads(raw)
+        slot = pick_slot(user_key(update), self.live)
+        try:
+            self.queues[slot].put_nowait(raw)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Очередь воркера %d переполнена, обновление %s не принято", slot, update.get('update_id'))
+            return None
+        return slot
+
+    def check_workers(self) -> list:
+        """Перезапускает упавшие воркеры; возвращает номера перезапущенных"""
+        restarted = []
+        now = time.monotonic()
+        for index in list(self.live):
+            process = self.processes[index]
+            if process is None or process.is_alive():
+                continue
+            history = self.restarts[index]
+            while history and now - history[0] > RESTART_WINDOW:
+                history.popleft()
+            if len(history) >= MAX_RESTARTS:
+                self._retire(index)
+                continue
+            logger.warning("Воркер %d завершился с кодом %s, перезапускаю", index, process.exitcode)
+            history.append(now)
+            self._spawn(index)
+            restarted.append(index)
+        return restarted
+
+    def _retire(self, index: int):
+        """Выключает слот и передает его очередь оставшимся воркерам"""
+        logger.error("Воркер %d падает слишком часто, его пользователи переходят к другим", index)
+        self.live.discard(index)
+        pending = []
+        try:
+            while True:
+                pending.append(self.queues[index].get_nowait())
+        except queue.Empty:
+            pass
+        if self.live:
+            for raw in pending:
+                if raw is not None:
+                    self.submit(raw)
+
+    def stop(self, timeout: float = 10.0):
+        """Дожидается обработки очередей и останавливает воркеры"""
+        for index in self.live:
+            try:
+                self.queues[index].put(None, timeout=timeout)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.terminate()
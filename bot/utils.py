@@ -1,21 +1,70 @@
+import time
+from typing import Optional
+
 from aiogram import Bot
-from config.config import CHANNEL_ID
+from config.config import CHANNEL_ID, SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_NEGATIVE_TTL
 from aiogram.enums import ChatMemberStatus
 
+MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR)
+
+# telegram_id -> (подписан ли, время проверки time.monotonic)
+_membership = {}
+
+
+def remember_membership(user_id: int, is_member: bool):
+    """
+    Запоминает подписку пользователя на канал.
+    Подписка хранится SUBSCRIPTION_CACHE_TTL секунд, отсутствие подписки -
+    SUBSCRIPTION_NEGATIVE_TTL, чтобы только что подписавшегося не держать у ворот
+    """
+    now = time.monotonic()
+    _membership[user_id] = (is_member, now)
+    # Периодически выбрасываем устаревшие записи
+    if len(_membership) > 100000:
+        for key, (member, checked_at) in list(_membership.items()):
+            if now - checked_at > (SUBSCRIPTION_CACHE_TTL if member else SUBSCRIPTION_NEGATIVE_TTL):
+                del _membership[key]
+
+
+def cached_membership(user_id: int) -> Optional[bool]:
+    """Подписка из кэша; None, если пользователя нет в кэше или запись устарела"""
+    entry = _membership.get(user_id)
+    if entry is None:
+        return None
+    is_member, checked_at = entry
+    ttl = SUBSCRIPTION_CACHE_TTL if is_member else SUBSCRIPTION_NEGATIVE_TTL
+    return is_member if time.monotonic() - checked_at < ttl else None
+
+
+def is_channel(chat) -> bool:
+    """Относится ли чат к каналу CHANNEL_ID (числовой id или @username)"""
+    if CHANNEL_ID is None:
+        return False
+    if str(chat.id) == str(CHANNEL_ID):
+        return True
+    return bool(chat.username) and CHANNEL_ID.lstrip('@').lower() == chat.username.lower()
+
 
-async def check_subscription(user_id: int, bot: Bot) -> bool:
+async def check_subscription(user_id: int, bot: Bot, use_cache: bool = True) -> bool:
     """
     Проверяет, подписан ли пользователь на канал
     :param user_id: ID пользователя
     :param bot: Объект бота
+    :param use_cache: Взять ответ из кэша, если он свежий (False - всегда спрашивать Telegram)
     :return: True если подписан, False если нет
     """
+    if use_cache:
+        cached = cached_membership(user_id)
+        if cached is not None:
+            return cached
     try:
         chat_member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        return chat_member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR]
     except Exception as e:
         print(f"Error checking subscription: {e}")
         return False
+    is_member = chat_member.status in MEMBER_STATUSES
+    remember_membership(user_id, is_member)
+    return is_member
 
 
 async def generate_ref_url(telegram_id) -> str:
@@ -3,6 +3,7 @@ from typing import Optional, Dict, Any, List, Union
 from config.config import API_TOKEN, API_URL
 from datetime import datetime, timedelta
 from bot.vpn_logger import vpn_api_logger as logger
+from bot.metrics import TimedTransport
 
 class VPNClient:
     def __init__(self, server_url: str, server_name: str = "VPN Server"):
@@ -43,6 +44,10 @@ class VPNClient:
             raise ValueError("Нет доступных серверов и fallback URL не настроен")
         return cls(server_url=API_URL, server_name="Fallback Server")
 
+    def _transport(self) -> TimedTransport:
+        """Транспорт с замером времени запросов к панели"""
+        return TimedTransport('panel', base_url=f"{self.base_url}/api")
+
     async def create_vpn_config(
         self, 
         username: str,
@@ -94,7 +99,7 @@ class VPNClient:
         logger.info(f"📄 Данные запроса: {request_data}")
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=30.0, transport=self._transport()) as client:
                 response = await client.post(
                     f"{self.base_url}/api/user",
                     headers=self.headers,
@@ -139,7 +144,7 @@ class VPNClient:
         logger.info(f"📤 GET запрос на {self.base_url}/api/user/{username}")
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=30.0, transport=self._transport()) as client:
                 response = await client.get(
                     f"{self.base_url}/api/user/{username}",
                     headers=self.headers
@@ -243,7 +248,7 @@ class VPNClient:
         logger.info(f"📄 Данные обновления: {update_data}")
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with httpx.AsyncClient(timeout=30.0, transport=self._transport()) as client:
                 response = await client.put(
                     f"{self.base_url}/api/user/{username}",
                     headers=self.headers,
@@ -294,7 +299,7 @@ class VPNClient:
 
     async def delete_user(self, username: str):
         try:
-            async with httpx.AsyncClient() as client:
+            async with httpx.AsyncClient(transport=self._transport()) as client:
                 response = await client.delete(
                     url=f"{self.base_url}/api/user/{username}",
                     headers=self.headers,
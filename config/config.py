@@ -3,8 +3,14 @@ from dotenv import load_dotenv
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_URL = os.getenv("DATABASE_URL")
+DB_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")  # Реплика для запросов только на чтение (необязательно)
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "30"))  # Сколько секунд после записи читать пользователя с primary
 CHANNEL_ID = os.getenv("CHANNEL_ID")  # ID канала для проверки подписки
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")  # Username канала для ссылки
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "600"))  # Сколько секунд верим, что пользователь подписан
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "30"))  # Сколько секунд верим, что не подписан
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "true").lower() == "true"  # Антифлуд для сообщений и кнопок
+THROTTLE_RATES = os.getenv("THROTTLE_RATES", "payments=0.2/3,configs=0.5/5,admin=5/30,default=1/10")  # группа=запросов в секунду/подряд без ожидания
 PAYMENT_TOKEN = os.getenv("PAYMENT_TOKEN")  # Токен платежной системы
 ADMIN_CHAT = os.getenv("ADMIN_CHAT")  # ID администратора для отправки сообщений
 DONATE_STREAM_URL = "https://donate.stream/donate_67f84fc4a11fb"
@@ -23,8 +29,44 @@ ADMIN_NAME_1 = os.getenv("ADMIN_NAME_1")
 ADMIN_NAME_2 = os.getenv("ADMIN_NAME_2")
 WATA_JWT_TOKEN = os.getenv("WATA_JWT_TOKEN")
 WATA_DONATE_URL = os.getenv("WATA_DONATE_URL")
+WATA_PUBLIC_KEY = os.getenv("WATA_PUBLIC_KEY")  # PEM ключ для проверки подписи webhook (иначе запрашивается у WATA)
+# Подтверждение оплаты приходит webhook'ом: кнопка «Проверить оплату» не ходит в WATA
+WATA_WEBHOOK_ENABLED = os.getenv("WATA_WEBHOOK_ENABLED", "false").lower() == "true"
+WATA_TIMEOUT = float(os.getenv("WATA_TIMEOUT", "10"))  # Таймаут запроса к WATA, сек
+WATA_MAX_RETRIES = int(os.getenv("WATA_MAX_RETRIES", "2"))  # Повторы при 5xx и сетевых ошибках
+PAYMENT_POLL_CONCURRENCY = int(os.getenv("PAYMENT_POLL_CONCURRENCY", "3"))  # Параллельных запросов фоновой проверки платежей
 BOT_LINK = os.getenv("BOT_LINK")
 
+# Получение обновлений Telegram: polling (main.py) или webhook (api.py, можно несколько воркеров)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # Публичный адрес api.py, например https://bot.example.com
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")  # Передается Telegram в X-Telegram-Bot-Api-Secret-Token
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "0"))  # Процессов обработки обновлений за api.py (webhook), 0 - в самом api.py
+
+# Хранилище состояний FSM
+FSM_STORAGE = os.getenv("FSM_STORAGE", "db")  # db - таблица fsm_states, memory - в памяти процесса
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))  # Секунд без изменений, после которых состояние сбрасывается, 0 - никогда
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "5"))  # Секунд, которые прочитанное состояние берется из памяти (один процесс)
+BOT_REPLICAS = int(os.getenv("BOT_REPLICAS", "1"))  # Экземпляров бота с общей БД; больше 1 - кэш FSM выключен
+
+# Очередь записи в Google Sheets
+SHEETS_QUEUE_SIZE = int(os.getenv("SHEETS_QUEUE_SIZE", "1000"))  # Сверх этого операции отбрасываются
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "2"))  # Потоков для вызовов gspread
+SHEETS_BATCH_WINDOW = float(os.getenv("SHEETS_BATCH_WINDOW", "2"))  # Секунд, за которые обновления строк собираются в один запрос
+SHEETS_SYNC_INTERVAL = int(os.getenv("SHEETS_SYNC_INTERVAL", "0"))  # Минут между выгрузками изменений, 0 - выключено
+SHEETS_FULL_REBUILD_HOURS = int(os.getenv("SHEETS_FULL_REBUILD_HOURS", "24"))  # Полная перезапись листов раз в N часов, 0 - никогда
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google")  # fake - таблицы в памяти (тесты и замеры синхронизации)
+
+# Рассылки администратора (bot/broadcast.py); общий лимит Telegram - около 30 сообщений в секунду
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # Сообщений в секунду на процесс
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))  # Одновременных запросов к Telegram
+
 # Настройки отладки
 DEBUG_VPN = os.getenv("DEBUG_VPN", "true").lower() == "true"
 
+# Профилирование SQL-запросов по обработчикам и задачам планировщика
+DB_PROFILE = os.getenv("DB_PROFILE", "false").lower() == "true"
+
+# Метрики Prometheus: api.py отдает /metrics сам, процессу бота нужен отдельный порт
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 - не поднимать HTTP-сервер метрик в main.py и воркерах
@@ -1,6 +1,10 @@
+import time
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from config.config import DB_URL
+from sqlalchemy.orm import sessionmaker, Session
+from config.config import DB_URL, DB_PROFILE, DB_REPLICA_URL, DB_REPLICA_MAX_LAG
+from db.models import User
+from db.query_profiler import query_profiler
 
 # Создаем асинхронный движок
 engine = create_async_engine(
@@ -8,9 +12,73 @@ engine = create_async_engine(
     echo=False
 )
 
+# Движок реплики для запросов только на чтение; без реплики читаем с primary
+replica_engine = create_async_engine(DB_REPLICA_URL, echo=False) if DB_REPLICA_URL else engine
+
+# Подключаем профилировщик запросов, если он включен
+if DB_PROFILE:
+    query_profiler.attach(engine)
+    query_profiler.attach(replica_engine)
+
+
+class PrimarySession(Session):
+    """Сессия primary: запоминает пользователей, которых она изменила"""
+
+
+# telegram_id -> время последней записи (time.monotonic)
+_recent_writes = {}
+
+
+def mark_user_write(telegram_id):
+    """Отмечает запись по пользователю: ближайшие DB_REPLICA_MAX_LAG секунд читаем его с primary"""
+    now = time.monotonic()
+    _recent_writes[telegram_id] = now
+    # Периодически выбрасываем устаревшие отметки
+    if len(_recent_writes) > 10000:
+        for key, written_at in list(_recent_writes.items()):
+            if now - written_at > DB_REPLICA_MAX_LAG:
+                del _recent_writes[key]
+
+
+def is_recently_written(telegram_id) -> bool:
+    written_at = _recent_writes.get(telegram_id)
+    return written_at is not None and time.monotonic() - written_at < DB_REPLICA_MAX_LAG
+
+
+@event.listens_for(PrimarySession, 'after_flush')
+def _remember_user_writes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User) and obj.telegram_id is not None:
+            mark_user_write(obj.telegram_id)
+
+
 # Создаем фабрику сессий
 async_session = sessionmaker(
     engine,
     class_=AsyncSession,
+    sync_session_class=PrimarySession,
+    expire_on_commit=False
+)
+
+# Фабрика сессий только для чтения (реплика)
+async_read_session = sessionmaker(
+    replica_engine,
+    class_=AsyncSession,
     expire_on_commit=False
-)
\ No newline at end of file
+)
+
+
+def read_session(telegram_id=None) -> AsyncSession:
+    """
+    Сессия для запросов только на чтение; обработчики, которые могут записать
+    (get_or_create_user), работают с async_session.
+    С telegram_id пользователь, которого этот процесс недавно изменил (например,
+    зачислил оплату), читается с primary. Проверка идет по отметке в памяти, без
+    запросов к primary; записи других процессов (вебхук WATA в api.py при отдельном
+    процессе бота) она не видит, и там возможна задержка до отставания реплики
+    """
+    if replica_engine is engine:
+        return async_session()
+    if telegram_id is not None and is_recently_written(telegram_id):
+        return async_session()
+    return async_read_session()
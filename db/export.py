@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Выгрузка таблиц users, payments и servers в локальные файлы для аналитики.
+Строки читаются потоком (серверный курсор) с реплики и пишутся пакетами
+в сжатые файлы Parquet или Arrow IPC (нужен pyarrow), без pyarrow - в CSV.gz.
+
+Выгрузка инкрементальная по id: файлы называются part-<первый id>-<последний id>,
+следующий запуск дописывает только строки с id больше последнего выгруженного.
+Файл пишется под временным именем и переименовывается после закрытия,
+поэтому прерванная выгрузка не оставляет неполных частей.
+
+Запуск: python db/export.py [--format parquet|arrow|csv] [--out exports] [таблицы...]
+"""
+
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, Integer, BigInteger, Float, Boolean, DateTime, Date
+
+from db.database import read_session
+from db.models import User, Payment, Server
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TABLES = {
+    'users': User,
+    'payments': Payment,
+    'servers': Server,
+}
+EXPORT_DIR = 'exports'
+EXPORT_BATCH = 5000
+ROWS_PER_FILE = 500_000
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow', 'csv': 'csv.gz'}
+
+_PART = re.compile(r'^part-(\d+)-(\d+)\.')
+
+
+def default_format() -> str:
+    return 'parquet' if pa is not None else 'csv'
+
+
+def last_exported_id(directory: str) -> int:
+    """Последний выгруженный id по именам готовых частей (в любом формате)"""
+    if not os.path.isdir(directory):
+        return 0
+    last = 0
+    for name in os.listdir(directory):
+        match = _PART.match(name)
+        if match:
+            last = max(last, int(match.group(2)))
+    return last
+
+
+def _arrow_type(column):
+    if isinstance(column.type, (Integer, BigInteger)):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(columns):
+    return pa.schema([(column.name, _arrow_type(column)) for column in columns])
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class CsvPart:
+    def __init__(self, path: str, columns):
+        self.file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column.name for column in columns])
+
+    def write(self, rows):
+        self.writer.writerows([_csv_value(value) for value in row] for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetPart:
+    def __init__(self, path: str, columns):
+        self.schema = arrow_schema(columns)
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def batch(self, rows):
+        values = list(zip(*rows))
+        return pa.record_batch(
+            [pa.array(column, type=field.type) for column, field in zip(values, self.schema)],
+            schema=self.schema
+        )
+
+    def write(self, rows):
+        self.writer.write_batch(self.batch(rows))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowPart(ParquetPart):
+    def __init__(self, path: str, columns):
+        self.schema = arrow_schema(columns)
+        self.sink = pa.OSFile(path, 'wb')
+        self.writer = pa.ipc.new_file(self.sink, self.schema,
+                                      options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+PART_WRITERS = {'parquet': ParquetPart, 'arrow': ArrowPart, 'csv': CsvPart}
+
+
+class TableExporter:
+    def __init__(self, out_dir: str = EXPORT_DIR, fmt: str = None,
+                 batch: int = EXPORT_BATCH, rows_per_file: int = ROWS_PER_FILE):
+        self.out_dir = out_dir
+        self.fmt = fmt or default_format()
+        if self.fmt != 'csv' and pa is None:
+            raise RuntimeError(f"Для формата {self.fmt} нужен pyarrow: pip install pyarrow")
+        self.batch = batch
+        self.rows_per_file = rows_per_file
+
+    def _finish(self, directory: str, part, temp_path: str, first_id: int, last_id: int) -> str:
+        part.close()
+        path = os.path.join(directory, f'part-{first_id:010d}-{last_id:010d}.{EXTENSIONS[self.fmt]}')
+        os.replace(temp_path, path)
+        return path
+
+    async def export_table(self, session, name: str) -> tuple:
+        """Дописывает строки таблицы name с id больше уже выгруженных; возвращает (строк, файлы)"""
+        model = EXPORT_TABLES[name]
+        columns = list(model.__table__.columns)
+        directory = os.path.join(self.out_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        last_id = last_exported_id(directory)
+        id_index = [column.name for column in columns].index('id')
+
+        stream = await session.stream(
+            select(*columns)
+            .where(model.id > last_id)
+            .order_by(model.id)
+            .execution_options(yield_per=self.batch)
+        )
+        part, temp_path, first_id, part_rows = None, None, None, 0
+        total, files = 0, []
+        try:
+            async for rows in stream.partitions(self.batch):
+                rows = [tuple(row) for row in rows]
+                offset = 0
+                while offset < len(rows):
+                    if part is None:
+                        first_id = rows[offset][id_index]
+                        temp_path = os.path.join(directory, f'.tmp-{first_id:010d}')
+                        part = PART_WRITERS[self.fmt](temp_path, columns)
+                        part_rows = 0
+                    chunk = rows[offset:offset + self.rows_per_file - part_rows]
+                    part.write(chunk)
+                    part_rows += len(chunk)
+                    total += len(chunk)
+                    offset += len(chunk)
+                    last_id = chunk[-1][id_index]
+                    if part_rows >= self.rows_per_file:
+                        files.append(self._finish(directory, part, temp_path, first_id, last_id))
+                        part = None
+            if part is not None:
+                files.append(self._finish(directory, part, temp_path, first_id, last_id))
+                part = None
+        finally:
+            if part is not None:
+                part.close()
+                os.remove(temp_path)
+        return total, files
+
+    async def export(self, names=None) -> dict:
+        results = {}
+        for name in names or EXPORT_TABLES:
+            async with read_session() as session:
+                results[name] = await self.export_table(session, name)
+            logger.info("Выгрузка %s: %d строк, файлов %d", name, results[name][0], len(results[name][1]))
+        return results
+
+
+async def main():
+    args = sys.argv[1:]
+    fmt, out_dir, names = None, EXPORT_DIR, []
+    while args:
+        arg = args.pop(0)
+        if arg == '--format':
+            fmt = args.pop(0)
+        elif arg == '--out':
+            out_dir = args.pop(0)
+        elif arg in EXPORT_TABLES:
+            names.append(arg)
+        else:
+            print(f"❌ Неизвестный аргумент: {arg}")
+            return 1
+
+    exporter = TableExporter(out_dir, fmt)
+    print(f"📦 Выгрузка в {out_dir} ({exporter.fmt})")
+    results = await exporter.export(names)
+    for name, (rows, files) in results.items():
+        print(f"   {name}: {rows} новых строк, файлов: {len(files)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,27 @@
+import sys
+from sqlalchemy import text
+from db.database import engine
+from db.models import Base, Broadcast, BroadcastRecipient
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Добавляет users.bot_blocked_at и таблицы рассылок (bot/broadcast.py)
+    """
+    if dry_run:
+        print("ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked_at TIMESTAMP")
+        print("CREATE TABLE broadcasts, broadcast_recipients")
+        return
+
+    async with engine.begin() as conn:
+        # nullable без default - меняются только метаданные, заполнять нечего
+        await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked_at TIMESTAMP"))
+        await conn.run_sync(
+            lambda sync_conn: Base.metadata.create_all(
+                sync_conn, tables=[Broadcast.__table__, BroadcastRecipient.__table__]
+            )
+        )
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,21 @@
+import sys
+from db.database import engine
+from db.models import Base, DailyStats, DailyRevenue
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Создает таблицы дневных сводок daily_stats и daily_revenue (db/service/stats_service.py)
+    """
+    if dry_run:
+        print("CREATE TABLE IF NOT EXISTS daily_stats, daily_revenue")
+        return
+
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            lambda sync_conn: Base.metadata.create_all(sync_conn, tables=[DailyStats.__table__, DailyRevenue.__table__])
+        )
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
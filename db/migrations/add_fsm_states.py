@@ -0,0 +1,21 @@
+import sys
+from db.database import engine
+from db.models import Base, FsmState
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Создает таблицу fsm_states для хранилища FSM в БД (bot/fsm_storage.py)
+    """
+    if dry_run:
+        print("CREATE TABLE IF NOT EXISTS fsm_states")
+        return
+
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            lambda sync_conn: Base.metadata.create_all(sync_conn, tables=[FsmState.__table__])
+        )
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
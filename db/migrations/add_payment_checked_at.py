@@ -0,0 +1,22 @@
+import sys
+from sqlalchemy import text
+from db.database import engine
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Добавляет payments.checked_at: время последнего запроса фоновой проверки
+    платежей (bot/payment_poller.py) к WATA
+    """
+    statement = "ALTER TABLE payments ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP"
+    if dry_run:
+        print(statement)
+        return
+
+    async with engine.begin() as conn:
+        # nullable без default - меняются только метаданные, заполнять нечего
+        await conn.execute(text(statement))
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,22 @@
+import sys
+from sqlalchemy import text
+from db.database import engine
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Добавляет payments.url: ссылку WATA, чтобы показать неоплаченный платеж
+    повторно из любого процесса и после перезапуска (bot/payment_links.py)
+    """
+    statement = "ALTER TABLE payments ADD COLUMN IF NOT EXISTS url VARCHAR"
+    if dry_run:
+        print(statement)
+        return
+
+    async with engine.begin() as conn:
+        # nullable без default - меняются только метаданные; у старых платежей ссылки нет
+        await conn.execute(text(statement))
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
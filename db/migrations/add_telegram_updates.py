@@ -0,0 +1,21 @@
+import sys
+from db.database import engine
+from db.models import Base, TelegramUpdate
+
+
+async def run_migration(dry_run: bool = False):
+    """
+    Создает таблицу telegram_updates: принятые webhook update_id для отсева повторов (bot/telegram_webhook.py)
+    """
+    if dry_run:
+        print("CREATE TABLE IF NOT EXISTS telegram_updates")
+        return
+
+    async with engine.begin() as conn:
+        await conn.run_sync(
+            lambda sync_conn: Base.metadata.create_all(sync_conn, tables=[TelegramUpdate.__table__])
+        )
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
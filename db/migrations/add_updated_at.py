@@ -0,0 +1,45 @@
+import sys
+from sqlalchemy import text
+from db.database import engine
+from db.migrations.backfill import Backfill, run_backfills
+
+# Колонка updated_at нужна инкрементальной синхронизации с Google Sheets (sheets/sync_to_sheets.py)
+TABLES = ['users', 'payments', 'servers']
+
+updated_at_backfills = [
+    Backfill(
+        name=f'add_updated_at.{table}',
+        table=table,
+        set_sql="updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)",
+        where_sql="updated_at IS NULL",
+        requires_columns=['updated_at', 'created_at'],
+        # updated_at добавляется ниже со значением NULL
+        adds_columns=['updated_at']
+    )
+    for table in TABLES
+]
+
+async def run_migration(dry_run: bool = False):
+    """
+    Добавляет колонку updated_at и индекс по ней в users, payments и servers
+    """
+    if not dry_run:
+        async with engine.begin() as conn:
+            for table in TABLES:
+                # nullable без default - меняются только метаданные
+                await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+
+    # Заполняем существующие строки пакетами
+    await run_backfills(updated_at_backfills, dry_run=dry_run)
+
+    if not dry_run:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for table in TABLES:
+                await conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_updated_at ON {table} (updated_at)"
+                ))
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
@@ -1,25 +1,36 @@
+import sys
 from sqlalchemy import text
 from db.database import engine
+from db.migrations.backfill import Backfill, run_backfills
 
-async def run_migration():
+# Заполнение subscription_end выполняется пакетами, чтобы не блокировать users целиком
+subscription_end_backfill = Backfill(
+    name='add_vpn_fields.subscription_end',
+    table='users',
+    set_sql="subscription_end = subscription_start + INTERVAL '30 days'",
+    where_sql="subscription_start IS NOT NULL AND subscription_end IS NULL",
+    requires_columns=['subscription_start', 'subscription_end'],
+    # subscription_end добавляется ниже со значением NULL
+    adds_columns=['subscription_end'],
+    base_where_sql="subscription_start IS NOT NULL"
+)
+
+async def run_migration(dry_run: bool = False):
     """
     Добавляет новые поля для VPN в таблицу users
     """
-    async with engine.begin() as conn:
-        # Добавляем новые колонки
-        await conn.execute(text("""
-            ALTER TABLE users 
-            ADD COLUMN IF NOT EXISTS subscription_end TIMESTAMP,
-            ADD COLUMN IF NOT EXISTS vpn_link TEXT
-        """))
-        
-        # Обновляем существующие записи
-        await conn.execute(text("""
-            UPDATE users 
-            SET subscription_end = subscription_start + INTERVAL '30 days'
-            WHERE subscription_start IS NOT NULL AND subscription_end IS NULL
-        """))
+    if not dry_run:
+        async with engine.begin() as conn:
+            # Добавляем новые колонки (nullable без default - меняются только метаданные)
+            await conn.execute(text("""
+                ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS subscription_end TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS vpn_link TEXT
+            """))
+
+    # Обновляем существующие записи
+    await run_backfills([subscription_end_backfill], dry_run=dry_run)
 
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(run_migration()) 
\ No newline at end of file
+    asyncio.run(run_migration(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,274 @@
+"""
+Онлайн-заполнение данных (backfill) пакетами по ключу.
+Каждый пакет выполняется в отдельной короткой транзакции, поэтому таблица
+не блокируется на все время миграции. Прогресс сохраняется в таблице
+migration_checkpoints, и прерванная миграция продолжается с места остановки.
+Повторный запуск после завершения проходит строки, добавленные с тех пор
+(с ключом больше сохраненного); reset() проходит таблицу заново.
+
+Пробный прогон (dry_run) ничего не меняет в базе, в том числе не создает
+migration_checkpoints. Колонки, которые добавляет ALTER самой миграции
+(adds_columns), в пробном прогоне еще не существуют - тогда строки считаются
+по base_where_sql, а время пакета оценивается по чтению его строк.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+
+from db.database import async_session
+from db.migrations.check_production_state import collect_production_state, get_table_columns
+
+
+CHECKPOINTS_DDL = """
+    CREATE TABLE IF NOT EXISTS migration_checkpoints (
+        name VARCHAR PRIMARY KEY,
+        last_key BIGINT NOT NULL DEFAULT 0,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        finished BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+class Backfill:
+    """
+    Описание одного пакетного заполнения:
+    UPDATE {table} SET {set_sql} WHERE {where_sql} по диапазонам {key}
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        set_sql: str,
+        where_sql: str = "TRUE",
+        key: str = "id",
+        batch_size: int = 1000,
+        pause: float = 0.1,
+        requires_columns: Iterable[str] = (),
+        params: Optional[dict] = None,
+        adds_columns: Iterable[str] = (),
+        base_where_sql: str = "TRUE",
+        session_factory=async_session
+    ):
+        self.name = name
+        self.table = table
+        self.set_sql = set_sql
+        self.where_sql = where_sql
+        self.key = key
+        self.batch_size = batch_size
+        self.pause = pause  # Пауза между пакетами, чтобы не мешать рабочей нагрузке
+        self.requires_columns = list(requires_columns)
+        self.params = params or {}
+        # Колонки из requires_columns, которые добавляет ALTER этой же миграции,
+        # и условие where_sql, каким оно будет сразу после ALTER, по старым колонкам
+        self.adds_columns = list(adds_columns)
+        self.base_where_sql = base_where_sql
+        self.session_factory = session_factory
+
+    # ======================== ЧЕКПОИНТЫ ========================
+
+    async def _load_checkpoint(self, session, create: bool = True) -> dict:
+        if create:
+            await session.execute(text(CHECKPOINTS_DDL))
+        result = await session.execute(
+            text("SELECT last_key, rows_done, finished FROM migration_checkpoints WHERE name = :name"),
+            {'name': self.name}
+        )
+        row = result.fetchone()
+        await session.commit()
+        if not row:
+            return {'last_key': 0, 'rows_done': 0, 'finished': False}
+        return {'last_key': row[0], 'rows_done': row[1], 'finished': row[2]}
+
+    async def _save_checkpoint(self, session, last_key: int, rows_done: int, finished: bool = False):
+        await session.execute(text("""
+            INSERT INTO migration_checkpoints (name, last_key, rows_done, finished, updated_at)
+            VALUES (:name, :last_key, :rows_done, :finished, :updated_at)
+            ON CONFLICT (name) DO UPDATE SET
+                last_key = EXCLUDED.last_key,
+                rows_done = EXCLUDED.rows_done,
+                finished = EXCLUDED.finished,
+                updated_at = EXCLUDED.updated_at
+        """), {
+            'name': self.name,
+            'last_key': last_key,
+            'rows_done': rows_done,
+            'finished': finished,
+            'updated_at': datetime.utcnow()
+        })
+
+    async def reset(self):
+        """Сбрасывает чекпоинт, чтобы пройти таблицу заново"""
+        async with self.session_factory() as session:
+            await session.execute(text(CHECKPOINTS_DDL))
+            await session.execute(text("DELETE FROM migration_checkpoints WHERE name = :name"), {'name': self.name})
+            await session.commit()
+
+    # ======================== ПРОВЕРКИ ========================
+
+    async def preflight(self, session, dry_run: bool = False) -> dict:
+        """
+        Проверяет, что таблица и нужные колонки существуют (через check_production_state).
+        В пробном прогоне колонки из adds_columns могут отсутствовать: их вернет pending_columns
+        """
+        state = await collect_production_state(session)
+        if self.table not in state['tables']:
+            raise RuntimeError(f"Таблица {self.table} не существует")
+
+        if self.table == 'users':
+            columns = state['user_column_names']
+        else:
+            columns = [row[0] for row in await get_table_columns(session, self.table)]
+
+        missing = [column for column in [self.key] + self.requires_columns if column not in columns]
+        pending = [column for column in missing if dry_run and column in self.adds_columns]
+        missing = [column for column in missing if column not in pending]
+        if missing:
+            raise RuntimeError(f"В таблице {self.table} нет колонок: {', '.join(missing)}")
+        return {'tables': state['tables'], 'pending_columns': pending}
+
+    # ======================== ВЫПОЛНЕНИЕ ========================
+
+    async def _next_upper_key(self, session, last_key: int) -> Optional[int]:
+        """Верхняя граница следующего пакета по ключу"""
+        result = await session.execute(text(f"""
+            SELECT MAX({self.key}) FROM (
+                SELECT {self.key} FROM {self.table}
+                WHERE {self.key} > :last_key
+                ORDER BY {self.key}
+                LIMIT :batch_size
+            ) AS batch
+        """), {'last_key': last_key, 'batch_size': self.batch_size})
+        return result.scalar()
+
+    async def _apply_batch(self, session, last_key: int, upper_key: int) -> int:
+        result = await session.execute(text(f"""
+            UPDATE {self.table}
+            SET {self.set_sql}
+            WHERE {self.key} > :last_key AND {self.key} <= :upper_key
+            AND ({self.where_sql})
+        """), {**self.params, 'last_key': last_key, 'upper_key': upper_key})
+        return result.rowcount
+
+    async def _read_batch(self, session, last_key: int, upper_key: int, where_sql: str) -> int:
+        result = await session.execute(text(f"""
+            SELECT COUNT(*) FROM {self.table}
+            WHERE {self.key} > :last_key AND {self.key} <= :upper_key
+            AND ({where_sql})
+        """), {**self.params, 'last_key': last_key, 'upper_key': upper_key})
+        return result.scalar()
+
+    async def _count_remaining(self, session, last_key: int, where_sql: Optional[str] = None) -> int:
+        result = await session.execute(text(f"""
+            SELECT COUNT(*) FROM {self.table}
+            WHERE {self.key} > :last_key AND ({where_sql or self.where_sql})
+        """), {**self.params, 'last_key': last_key})
+        return result.scalar()
+
+    async def _count_keys(self, session, last_key: int) -> int:
+        result = await session.execute(
+            text(f"SELECT COUNT(*) FROM {self.table} WHERE {self.key} > :last_key"),
+            {'last_key': last_key}
+        )
+        return result.scalar()
+
+    async def estimate(self) -> dict:
+        """
+        Пробный прогон: считает оставшиеся строки и пакеты, выполняет один
+        пакет с откатом транзакции и по его времени оценивает длительность.
+        Если колонок из adds_columns еще нет, UPDATE выполнить нельзя: строки
+        считаются по base_where_sql, а пакет только читается (оценка снизу)
+        """
+        async with self.session_factory() as session:
+            checks = await self.preflight(session, dry_run=True)
+            pending = checks['pending_columns']
+            # Таблицу чекпоинтов пробный прогон не создает
+            if 'migration_checkpoints' in checks['tables']:
+                checkpoint = await self._load_checkpoint(session, create=False)
+            else:
+                checkpoint = {'last_key': 0, 'rows_done': 0, 'finished': False}
+            last_key = checkpoint['last_key']
+
+            where_sql = self.base_where_sql if pending else self.where_sql
+            rows_to_update = await self._count_remaining(session, last_key, where_sql)
+            keys_left = await self._count_keys(session, last_key)
+            batches = (keys_left + self.batch_size - 1) // self.batch_size
+
+            batch_time = 0.0
+            upper_key = await self._next_upper_key(session, last_key)
+            if upper_key is not None:
+                started = time.perf_counter()
+                if pending:
+                    await self._read_batch(session, last_key, upper_key, where_sql)
+                else:
+                    await self._apply_batch(session, last_key, upper_key)
+                batch_time = time.perf_counter() - started
+            await session.rollback()
+
+        return {
+            'name': self.name,
+            'resume_from': last_key,
+            'rows_to_update': rows_to_update,
+            'batches': batches,
+            'batch_time': batch_time,
+            'estimated_seconds': batches * (batch_time + self.pause),
+            'pending_columns': pending
+        }
+
+    async def run(self) -> int:
+        """
+        Выполняет заполнение пакетами, продолжая с последнего чекпоинта.
+        Возвращает число строк, обновленных за все запуски
+        """
+        async with self.session_factory() as session:
+            await self.preflight(session)
+            checkpoint = await self._load_checkpoint(session)
+
+            last_key = checkpoint['last_key']
+            rows_done = checkpoint['rows_done']
+            # И после завершения: строки, добавленные с тех пор, имеют ключ больше last_key
+            if last_key:
+                print(f"   ↪️ {self.name}: продолжаю с {self.key} > {last_key}")
+
+            while True:
+                upper_key = await self._next_upper_key(session, last_key)
+                if upper_key is None:
+                    break
+
+                updated = await self._apply_batch(session, last_key, upper_key)
+                rows_done += updated
+                last_key = upper_key
+                # Пакет и чекпоинт фиксируются в одной транзакции
+                await self._save_checkpoint(session, last_key, rows_done)
+                await session.commit()
+
+                print(f"   ⏳ {self.name}: {self.key} <= {last_key}, обновлено {rows_done}")
+                if self.pause:
+                    await asyncio.sleep(self.pause)
+
+            await self._save_checkpoint(session, last_key, rows_done, finished=True)
+            await session.commit()
+
+        print(f"   ✅ {self.name}: обновлено {rows_done} строк")
+        return rows_done
+
+
+async def run_backfills(backfills: Iterable[Backfill], dry_run: bool = False):
+    """Выполняет несколько заполнений по очереди или оценивает их длительность"""
+    for backfill in backfills:
+        if dry_run:
+            estimate = await backfill.estimate()
+            print(f"   🧪 {estimate['name']}: строк к обновлению {estimate['rows_to_update']}, "
+                  f"пакетов {estimate['batches']}, "
+                  f"оценка ~{estimate['estimated_seconds']:.1f} сек "
+                  f"(пакет {estimate['batch_time'] * 1000:.0f} мс)")
+            if estimate['pending_columns']:
+                print(f"      колонок {', '.join(estimate['pending_columns'])} еще нет: "
+                      f"строки посчитаны до ALTER, время пакета - по чтению")
+        else:
+            await backfill.run()
@@ -6,6 +6,64 @@
 from sqlalchemy import text
 from db.database import async_session
 
+async def get_tables(session) -> list:
+    """Возвращает список таблиц схемы public"""
+    result = await session.execute(text("""
+        SELECT table_name FROM information_schema.tables 
+        WHERE table_schema = 'public' 
+        ORDER BY table_name
+    """))
+    return [row[0] for row in result.fetchall()]
+
+
+async def get_table_columns(session, table: str) -> list:
+    """Возвращает колонки таблицы: (column_name, data_type, is_nullable, column_default)"""
+    result = await session.execute(text("""
+        SELECT column_name, data_type, is_nullable, column_default
+        FROM information_schema.columns 
+        WHERE table_name = :table AND table_schema = 'public'
+        ORDER BY ordinal_position
+    """), {'table': table})
+    return result.fetchall()
+
+
+async def collect_production_state(session) -> dict:
+    """
+    Собирает состояние схемы без вывода на экран.
+    Используется анализом ниже и предварительными проверками миграций.
+    """
+    tables = await get_tables(session)
+    user_columns = await get_table_columns(session, 'users')
+    user_column_names = [row[0] for row in user_columns]
+
+    missing_fields = [field for field in ('server_id', 'trial_used') if field not in user_column_names]
+
+    result = await session.execute(text("""
+        SELECT 
+            tc.constraint_name,
+            kcu.column_name,
+            ccu.table_name AS foreign_table_name,
+            ccu.column_name AS foreign_column_name
+        FROM information_schema.table_constraints AS tc 
+        JOIN information_schema.key_column_usage AS kcu
+          ON tc.constraint_name = kcu.constraint_name
+          AND tc.table_schema = kcu.table_schema
+        JOIN information_schema.constraint_column_usage AS ccu
+          ON ccu.constraint_name = tc.constraint_name
+          AND ccu.table_schema = tc.table_schema
+        WHERE tc.constraint_type = 'FOREIGN KEY' 
+        AND tc.table_name = 'users'
+    """))
+
+    return {
+        'tables': tables,
+        'user_columns': user_columns,
+        'user_column_names': user_column_names,
+        'missing_fields': missing_fields,
+        'foreign_keys': result.fetchall(),
+    }
+
+
 async def check_production_state_postgresql():
     """Анализирует текущее состояние базы данных PostgreSQL"""
     async with async_session() as session:
@@ -13,71 +71,37 @@ async def check_production_state_postgresql():
             print("🔍 АНАЛИЗ ТЕКУЩЕГО СОСТОЯНИЯ БАЗЫ ДАННЫХ PostgreSQL")
             print("=" * 60)
             
+            state = await collect_production_state(session)
+            
             # ===== ПРОВЕРКА ТАБЛИЦ =====
             print("\n📋 Существующие таблицы:")
-            result = await session.execute(text("""
-                SELECT table_name FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                ORDER BY table_name
-            """))
-            
-            tables = [row[0] for row in result.fetchall()]
+            tables = state['tables']
             for table in tables:
                 print(f"   ✅ {table}")
             
             # ===== СТРУКТУРА ТАБЛИЦЫ USERS =====
             print(f"\n👤 Структура таблицы users:")
-            result = await session.execute(text("""
-                SELECT column_name, data_type, is_nullable, column_default
-                FROM information_schema.columns 
-                WHERE table_name = 'users' AND table_schema = 'public'
-                ORDER BY ordinal_position
-            """))
-            user_columns = []
-            
-            for row in result.fetchall():
+            user_columns = state['user_column_names']
+            
+            for row in state['user_columns']:
                 column_name, data_type, is_nullable, column_default = row
-                user_columns.append(column_name)
                 nullable = "NULL" if is_nullable == 'YES' else "NOT NULL"
                 default_val = f" DEFAULT {column_default}" if column_default else ""
                 print(f"   {column_name}: {data_type} {nullable}{default_val}")
             
             # ===== ПРОВЕРКА ОТСУТСТВУЮЩИХ ПОЛЕЙ =====
             print(f"\n🔍 Анализ отсутствующих полей:")
-            missing_fields = []
+            missing_fields = state['missing_fields']
             
-            if 'server_id' not in user_columns:
-                missing_fields.append('server_id')
-                print("   ❌ server_id - отсутствует")
-            else:
-                print("   ✅ server_id - присутствует")
-            
-            if 'trial_used' not in user_columns:
-                missing_fields.append('trial_used')
-                print("   ❌ trial_used - отсутствует")
-            else:
-                print("   ✅ trial_used - присутствует")
+            for field in ('server_id', 'trial_used'):
+                if field in missing_fields:
+                    print(f"   ❌ {field} - отсутствует")
+                else:
+                    print(f"   ✅ {field} - присутствует")
             
             # ===== ПРОВЕРКА ВНЕШНИХ КЛЮЧЕЙ =====
             print(f"\n🔗 Внешние ключи:")
-            result = await session.execute(text("""
-                SELECT 
-                    tc.constraint_name,
-                    kcu.column_name,
-                    ccu.table_name AS foreign_table_name,
-                    ccu.column_name AS foreign_column_name
-                FROM information_schema.table_constraints AS tc 
-                JOIN information_schema.key_column_usage AS kcu
-                  ON tc.constraint_name = kcu.constraint_name
-                  AND tc.table_schema = kcu.table_schema
-                JOIN information_schema.constraint_column_usage AS ccu
-                  ON ccu.constraint_name = tc.constraint_name
-                  AND ccu.table_schema = tc.table_schema
-                WHERE tc.constraint_type = 'FOREIGN KEY' 
-                AND tc.table_name = 'users'
-            """))
-            
-            foreign_keys = result.fetchall()
+            foreign_keys = state['foreign_keys']
             if foreign_keys:
                 for fk in foreign_keys:
                     constraint_name, column_name, foreign_table, foreign_column = fk
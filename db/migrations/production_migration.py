@@ -3,10 +3,39 @@
 Добавляет таблицу серверов, новые поля пользователей и заполняет данные
 """
 
+import sys
 from sqlalchemy import text
 from db.database import async_session
+from db.migrations.backfill import Backfill, run_backfills
 from datetime import datetime
 
+# Массовые UPDATE по users выполняются пакетами с чекпоинтами (см. db/migrations/backfill.py)
+trial_used_backfill = Backfill(
+    name='production_migration.trial_used',
+    table='users',
+    set_sql="trial_used = TRUE",
+    where_sql="trial_used = FALSE AND vpn_link IS NOT NULL",
+    requires_columns=['trial_used', 'vpn_link'],
+    # Этап 2 добавляет trial_used со значением FALSE
+    adds_columns=['trial_used'],
+    base_where_sql="vpn_link IS NOT NULL"
+)
+
+server_distribution_backfill = Backfill(
+    name='production_migration.server_id',
+    table='users',
+    set_sql="""server_id = CASE
+        WHEN id BETWEEN 156 AND 308 THEN 2
+        WHEN id BETWEEN 309 AND 542 THEN 3
+        ELSE 1
+    END""",
+    where_sql="vpn_link IS NOT NULL AND server_id IS NULL",
+    requires_columns=['server_id', 'vpn_link'],
+    # Этап 2 добавляет server_id со значением NULL
+    adds_columns=['server_id'],
+    base_where_sql="vpn_link IS NOT NULL"
+)
+
 async def production_migration_postgresql():
     """
     Комплексная миграция для продакшена (PostgreSQL):
@@ -120,83 +149,19 @@ async def production_migration_postgresql():
             # ===== ЭТАП 4: Обновление trial_used для всех пользователей =====
             print("\n🎯 Этап 4: Установка trial_used = True для всех пользователей...")
             
-            result = await session.execute(text("""
-                UPDATE users SET trial_used = TRUE WHERE trial_used = FALSE AND vpn_link IS NOT NULL
-            """))
-            
-            updated_trial_count = result.rowcount
+            updated_trial_count = await trial_used_backfill.run()
             print(f"   ✅ Обновлено пользователей: {updated_trial_count}")
             
-            await session.commit()
-            
             # ===== ЭТАП 5: Распределение пользователей по серверам =====
             print("\n🎪 Этап 5: Распределение пользователей по серверам...")
             
-            # Получаем количество пользователей, которым нужно назначить сервер
-            result = await session.execute(text("""
-                SELECT COUNT(*) FROM users WHERE vpn_link IS NOT NULL AND server_id IS NULL
-            """))
-            users_to_assign = result.scalar()
-            
-            if users_to_assign > 0:
-                print(f"   👥 Пользователей с VPN для распределения: {users_to_assign}")
-                
-                # Распределяем пользователей по логике:
-                # id 1-155 -> server_id = 1
-                # id 156-308 -> server_id = 2  
-                # id 309-542 -> server_id = 3
-                # id 543+ -> server_id = 1
-                
-                # Сервер 1: пользователи 1-155
-                result = await session.execute(text("""
-                    UPDATE users 
-                    SET server_id = 1 
-                    WHERE id >= 1 AND id <= 155 
-                    AND vpn_link IS NOT NULL 
-                    AND server_id IS NULL
-                """))
-                updated_1 = result.rowcount
-                
-                # Сервер 2: пользователи 156-308
-                result = await session.execute(text("""
-                    UPDATE users 
-                    SET server_id = 2 
-                    WHERE id >= 156 AND id <= 308 
-                    AND vpn_link IS NOT NULL 
-                    AND server_id IS NULL
-                """))
-                updated_2 = result.rowcount
-                
-                # Сервер 3: пользователи 309-542
-                result = await session.execute(text("""
-                    UPDATE users 
-                    SET server_id = 3 
-                    WHERE id >= 309 AND id <= 542 
-                    AND vpn_link IS NOT NULL 
-                    AND server_id IS NULL
-                """))
-                updated_3 = result.rowcount
-                
-                # Сервер 1: пользователи 543+
-                result = await session.execute(text("""
-                    UPDATE users 
-                    SET server_id = 1 
-                    WHERE id >= 543 
-                    AND vpn_link IS NOT NULL 
-                    AND server_id IS NULL
-                """))
-                updated_4 = result.rowcount
-                
-                print(f"   📊 Распределение по серверам:")
-                print(f"      🖥️ Сервер 1 (Netherland-1): {updated_1 + updated_4} пользователей")
-                print(f"      🖥️ Сервер 2 (Netherland-2): {updated_2} пользователей")
-                print(f"      🖥️ Сервер 3 (Paris-1): {updated_3} пользователей")
-                print(f"      📈 Всего назначено: {updated_1 + updated_2 + updated_3 + updated_4}")
-                
-            else:
-                print("   ℹ️ Нет пользователей для распределения")
-            
-            await session.commit()
+            # Распределяем пользователей по логике:
+            # id 1-155 -> server_id = 1
+            # id 156-308 -> server_id = 2  
+            # id 309-542 -> server_id = 3
+            # id 543+ -> server_id = 1
+            assigned = await server_distribution_backfill.run()
+            print(f"   📈 Всего назначено: {assigned}")
             
             # ===== ЭТАП 6: Добавление внешнего ключа =====
             print("\n🔗 Этап 6: Добавление внешнего ключа...")
@@ -287,4 +252,8 @@ async def production_migration_postgresql():
 
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(production_migration_postgresql()) 
\ No newline at end of file
+    if "--dry-run" in sys.argv:
+        # Оценка длительности пакетных этапов без изменения данных
+        asyncio.run(run_backfills([trial_used_backfill, server_distribution_backfill], dry_run=True))
+    else:
+        asyncio.run(production_migration_postgresql())
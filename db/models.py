@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, TIMESTAMP, BigInteger, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, ForeignKey, Boolean, TIMESTAMP, BigInteger, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -23,6 +23,12 @@ class User(Base):
     # Поле для отслеживания использования пробного периода
     trial_used = Column(Boolean, default=False, nullable=False)  # Использовал ли пробный период
     
+    # Когда пользователь заблокировал бота (рассылки его пропускают); сбрасывается при разблокировке
+    bot_blocked_at = Column(DateTime, nullable=True)
+    
+    # Время последнего изменения строки для инкрементальной синхронизации с Google Sheets
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
     # Связь с сервером
     server = relationship("Server", back_populates="users")
 
@@ -36,6 +42,7 @@ class Server(Base):
     is_default = Column(Boolean, default=False)  # Является ли сервером по умолчанию
     created_at = Column(DateTime, default=datetime.utcnow)
     description = Column(String, nullable=True)  # Описание сервера
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Связь с пользователями
     users = relationship("User", back_populates="server")
@@ -53,3 +60,91 @@ class Payment(Base):
     nickname = Column(String)
     message = Column(String)
     pay_system = Column(String)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    checked_at = Column(DateTime, nullable=True)  # Когда фоновая проверка последний раз спрашивала WATA
+    url = Column(String, nullable=True)  # Ссылка WATA на оплату, чтобы показать ее повторно
+
+
+class SyncWatermark(Base):
+    """Отметка инкрементальной синхронизации: до какого updated_at строки уже выгружены"""
+    __tablename__ = 'sync_watermarks'
+
+    name = Column(String, primary_key=True)
+    watermark = Column(DateTime, nullable=True)
+    last_full_sync = Column(DateTime, nullable=True)
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram (см. bot/fsm_storage.py); ключ - bot:chat:user:thread:destiny"""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+
+class TelegramUpdate(Base):
+    """update_id, уже принятые webhook: Telegram повторяет доставку, и повтор может прийти в другой воркер"""
+    __tablename__ = 'telegram_updates'
+
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    received_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class Broadcast(Base):
+    """Рассылка администратора (bot/broadcast.py); owner и heartbeat_at - аренда процесса, который ее отправляет"""
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(String, nullable=True)
+    photo_file_id = Column(String, nullable=True)
+    segment = Column(JSON, nullable=True)  # Фильтры аудитории (db/service/segment_service.py)
+    status = Column(String, default='running', nullable=False, index=True)  # running, paused, cancelled, done
+    admin_chat_id = Column(BigInteger, nullable=True)  # Сообщение с прогрессом у администратора
+    admin_message_id = Column(BigInteger, nullable=True)
+    total = Column(Integer, default=0, nullable=False)
+    sent = Column(Integer, default=0, nullable=False)
+    blocked = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class BroadcastRecipient(Base):
+    """Получатель рассылки; status: pending, sent, blocked, failed"""
+    __tablename__ = 'broadcast_recipients'
+
+    broadcast_id = Column(Integer, ForeignKey('broadcasts.id', ondelete='CASCADE'), primary_key=True)
+    telegram_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    status = Column(String, default='pending', nullable=False)
+    error = Column(String, nullable=True)
+
+
+class DailyStats(Base):
+    """Дневная сводка по пользователям и продлениям (заполняет db/service/stats_service.py)"""
+    __tablename__ = 'daily_stats'
+
+    day = Column(Date, primary_key=True)
+    new_users = Column(Integer, default=0, nullable=False)
+    trials = Column(Integer, default=0, nullable=False)  # Новые пользователи, взявшие пробный период
+    renewals_1 = Column(Integer, default=0, nullable=False)  # Оплаты по тарифам 1/3/6 месяцев
+    renewals_3 = Column(Integer, default=0, nullable=False)
+    renewals_6 = Column(Integer, default=0, nullable=False)
+    churned = Column(Integer, default=0, nullable=False)  # Подписка закончилась в этот день и не продлена
+    total_users = Column(Integer, default=0, nullable=False)  # Срез на момент расчета
+    active_users = Column(Integer, default=0, nullable=False)
+    total_payments = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DailyRevenue(Base):
+    """Дневная выручка по платежной системе"""
+    __tablename__ = 'daily_revenue'
+
+    day = Column(Date, primary_key=True)
+    pay_system = Column(String, primary_key=True)
+    payments = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
@@ -0,0 +1,155 @@
+"""
+Профилировщик SQL-запросов.
+Считает количество запросов, возвращенные строки и время выполнения
+в разрезе текущего обработчика aiogram или задачи планировщика,
+а также отмечает повторяющиеся одинаковые запросы (признак N+1).
+"""
+
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Текущий замер (обработчик или задача), к которому относятся запросы
+_current_run: ContextVar[Optional["ProfileRun"]] = ContextVar("query_profiler_run", default=None)
+
+
+class ProfileRun:
+    """Статистика запросов за один вызов обработчика или задачи"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.statements = Counter()
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Возвращает запросы, выполненные не меньше threshold раз"""
+        return {sql: count for sql, count in self.statements.items() if count >= threshold}
+
+
+class ScopeStats:
+    """Накопленная статистика по обработчику или задаче"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.queries = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_queries = 0
+        self.n_plus_one = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'queries': self.queries,
+            'rows': self.rows,
+            'total_time': round(self.total_time, 4),
+            'avg_queries': round(self.queries / self.calls, 2) if self.calls else 0,
+            'max_queries': self.max_queries,
+            'n_plus_one': self.n_plus_one,
+        }
+
+
+class QueryProfiler:
+    """
+    Подключается к движку SQLAlchemy через события before/after_cursor_execute
+    и относит каждый запрос к текущему замеру из contextvars.
+    """
+
+    def __init__(self, repeat_threshold: int = 3):
+        self.repeat_threshold = repeat_threshold
+        self.stats: Dict[str, ScopeStats] = {}
+        self._engines = []
+
+    @staticmethod
+    def _sync_engine(engine):
+        # AsyncEngine хранит синхронный движок в sync_engine
+        return getattr(engine, 'sync_engine', engine)
+
+    def attach(self, engine) -> bool:
+        """Подключает профилировщик к движку. Возвращает False, если уже подключен"""
+        sync_engine = self._sync_engine(engine)
+        if sync_engine in self._engines:
+            return False
+        event.listen(sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(sync_engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._engines.append(sync_engine)
+        return True
+
+    def detach(self, engine):
+        """Отключает профилировщик от движка"""
+        sync_engine = self._sync_engine(engine)
+        if sync_engine not in self._engines:
+            return
+        event.remove(sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(sync_engine, 'after_cursor_execute', self._after_cursor_execute)
+        self._engines.remove(sync_engine)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _current_run.get() is not None:
+            conn.info.setdefault('query_profiler_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        run = _current_run.get()
+        if run is None:
+            return
+        started = conn.info.get('query_profiler_start')
+        elapsed = time.perf_counter() - started.pop() if started else 0.0
+
+        run.queries += 1
+        run.total_time += elapsed
+        # Драйверы сообщают rowcount по-разному: asyncpg для SELECT отдает число строк, sqlite -1
+        run.rows += max(getattr(cursor, 'rowcount', -1) or 0, 0)
+        run.statements[statement] += 1
+
+    @contextmanager
+    def scope(self, name: str):
+        """Замеряет все запросы, выполненные внутри блока, под именем name"""
+        run = ProfileRun(name)
+        token = _current_run.set(run)
+        try:
+            yield run
+        finally:
+            _current_run.reset(token)
+            self._record(run)
+
+    def _record(self, run: ProfileRun):
+        if not run.queries:
+            return
+        stats = self.stats.get(run.name)
+        if stats is None:
+            stats = self.stats[run.name] = ScopeStats(run.name)
+        stats.calls += 1
+        stats.queries += run.queries
+        stats.rows += run.rows
+        stats.total_time += run.total_time
+        stats.max_queries = max(stats.max_queries, run.queries)
+
+        repeated = run.repeated(self.repeat_threshold)
+        if repeated:
+            stats.n_plus_one += 1
+            for sql, count in repeated.items():
+                logger.warning("Возможный N+1 в %s: запрос выполнен %d раз: %s",
+                               run.name, count, " ".join(sql.split())[:200])
+        logger.debug("%s: %d запросов, %d строк, %.1f мс",
+                     run.name, run.queries, run.rows, run.total_time * 1000)
+
+    def report(self) -> List[dict]:
+        """Сводка по всем замерам, самые тяжелые по времени сверху"""
+        return [s.as_dict() for s in sorted(self.stats.values(), key=lambda s: s.total_time, reverse=True)]
+
+    def reset(self):
+        self.stats.clear()
+
+
+query_profiler = QueryProfiler()
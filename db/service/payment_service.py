@@ -1,4 +1,4 @@
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from db.models import User, Payment
@@ -58,7 +58,8 @@ async def update_payment_status(
     amount: float = None,
     payment_id: str = None,
     completed_at: datetime = None,
-    pay_system: str = None
+    pay_system: str = None,
+    url: str = None
 ) -> Payment:
     """Обновляет статус платежа и связанные данные"""
     stmt = select(Payment).where(Payment.id == id)
@@ -77,6 +78,46 @@ async def update_payment_status(
         payment.completed_at = completed_at
     if pay_system:
         payment.pay_system = pay_system
+    if url:
+        payment.url = url
 
     await session.commit()
     return payment
+
+
+async def claim_payment(
+    session: AsyncSession,
+    id: int,
+    status: str,
+    amount: float = None,
+    completed_at: datetime = None
+) -> bool:
+    """
+    Захватывает платеж: переводит его в статус status, только если он еще не в нем.
+    Строка блокируется через FOR UPDATE SKIP LOCKED, поэтому параллельный вызов
+    не ждет чужую транзакцию, а сразу получает False.
+    Возвращает True, если статус изменил именно этот вызов. Фиксирует транзакцию вызывающий код
+    """
+    locked = await session.execute(
+        select(Payment.id)
+        .where(Payment.id == id, Payment.status != status)
+        .with_for_update(skip_locked=True)
+    )
+    if locked.scalar_one_or_none() is None:
+        return False
+
+    values = {'status': status}
+    if amount is not None:
+        values['amount'] = amount
+    if completed_at:
+        values['completed_at'] = completed_at
+
+    # Условие на статус защищает и там, где FOR UPDATE не поддерживается (SQLite)
+    stmt = (
+        update(Payment)
+        .where(Payment.id == id, Payment.status != status)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return result.rowcount == 1
@@ -0,0 +1,91 @@
+"""
+Сегменты аудитории для рассылок.
+Segment - набор фильтров по пользователям; None в поле означает «не важно».
+Все фильтры собираются в условия одного запроса по users: по ним считается
+размер сегмента перед отправкой, и из них же рассылка одним INSERT ... SELECT
+заполняет список получателей (bot/broadcast.py).
+"""
+
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, func, exists, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import User, Payment
+from db.service.stats_service import PAID_STATUS
+
+
+@dataclass
+class Segment:
+    active: Optional[bool] = None  # Подписка активна сейчас
+    expiring_within_days: Optional[int] = None  # Активная подписка заканчивается в ближайшие N дней
+    trial_used: Optional[bool] = None
+    server_id: Optional[int] = None
+    paid: Optional[bool] = None  # False - ни одного оплаченного платежа
+    blocked: Optional[bool] = False  # По умолчанию заблокировавшие бота исключаются
+
+    def to_dict(self) -> dict:
+        """Для данных FSM и колонки broadcasts.segment"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "Segment":
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in (data or {}).items() if key in names})
+
+    def describe(self) -> str:
+        parts = []
+        if self.active is not None:
+            parts.append("подписка активна" if self.active else "подписка не активна")
+        if self.expiring_within_days is not None:
+            parts.append(f"подписка истекает в течение {self.expiring_within_days} дн.")
+        if self.trial_used is not None:
+            parts.append("пробный период использован" if self.trial_used else "пробный период не использован")
+        if self.server_id is not None:
+            parts.append(f"сервер #{self.server_id}")
+        if self.paid is not None:
+            parts.append("есть оплаты" if self.paid else "ни разу не платили")
+        if self.blocked is None:
+            parts.append("включая заблокировавших бота")
+        elif self.blocked:
+            parts.append("заблокировали бота")
+        return ", ".join(parts) or "все пользователи"
+
+
+def _active_condition(now: datetime):
+    return and_(User.is_active == True, User.subscription_end > now)
+
+
+def segment_conditions(segment: Segment, now: Optional[datetime] = None) -> list:
+    """Условия WHERE по users для сегмента"""
+    now = now or datetime.utcnow()
+    conditions = []
+
+    if segment.active is not None:
+        active = _active_condition(now)
+        conditions.append(active if segment.active else or_(
+            User.is_active.isnot(True), User.subscription_end.is_(None), User.subscription_end <= now
+        ))
+    if segment.expiring_within_days is not None:
+        conditions.append(_active_condition(now))
+        conditions.append(User.subscription_end <= now + timedelta(days=segment.expiring_within_days))
+    if segment.trial_used is not None:
+        conditions.append(User.trial_used == segment.trial_used)
+    if segment.server_id is not None:
+        conditions.append(User.server_id == segment.server_id)
+    if segment.paid is not None:
+        has_paid = exists().where(Payment.user_id == User.id, Payment.status == PAID_STATUS)
+        conditions.append(has_paid if segment.paid else ~has_paid)
+    if segment.blocked is not None:
+        conditions.append(User.bot_blocked_at.isnot(None) if segment.blocked else User.bot_blocked_at.is_(None))
+    return conditions
+
+
+async def count_segment(session: AsyncSession, segment: Segment) -> int:
+    """Размер сегмента одним COUNT"""
+    result = await session.execute(
+        select(func.count()).select_from(User).where(*segment_conditions(segment))
+    )
+    return result.scalar_one()
@@ -0,0 +1,209 @@
+"""
+Дневные сводки по выручке, пользователям и продлениям.
+Сводка за день считается запросами по диапазону дат, поэтому задача планировщика
+пересчитывает только дни после последней сводки, а экраны статистики читают готовые строки
+вместо полного просмотра users и payments.
+Итоги (всего пользователей, активных, платежей) выводятся из сводки предыдущего дня
+и изменений за день; полный подсчет по таблицам делает редкая сверка (reconcile),
+она же исправляет накопившееся расхождение (удаленные пользователи, ручные продления).
+Таблицы сводок создает миграция db/migrations/add_daily_stats.py.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.config import VPN_PRICE_3, VPN_PRICE_6
+from db.models import User, Payment, DailyStats, DailyRevenue
+
+# Статус оплаченной ссылки WATA (см. bot/payment_processing.py)
+PAID_STATUS = 'Closed'
+# Ссылки WATA создаются без pay_system
+DEFAULT_PAY_SYSTEM = 'wata'
+# Продление истекшей подписки ставит ее конец на момент оплаты плюс период
+RENEWAL_TOLERANCE = timedelta(minutes=5)
+
+
+def plan_months():
+    """Длительность тарифа по сумме оплаты"""
+    return case(
+        (Payment.amount >= VPN_PRICE_6, 6),
+        (Payment.amount >= VPN_PRICE_3, 3),
+        else_=1
+    )
+
+
+async def count_totals(session: AsyncSession, end: datetime) -> tuple:
+    """Полный подсчет итогов на момент end: (всего пользователей, активных, платежей)"""
+    total_users = await session.scalar(select(func.count(User.id)).where(User.created_at < end))
+    active_users = await session.scalar(select(func.count(User.id)).where(User.subscription_end >= end))
+    total_payments = await session.scalar(select(func.count(Payment.id)).where(Payment.created_at < end))
+    return total_users, active_users, total_payments
+
+
+async def count_reactivated(session: AsyncSession, start: datetime, end: datetime) -> int:
+    """
+    Зарегистрированные раньше дня пользователи, у которых подписка к оплате за день
+    уже истекла. Истекшая подписка продлевается от момента оплаты, поэтому ее конец
+    равен первой оплате дня плюс все оплаченные за день месяцы
+    """
+    result = await session.execute(
+        select(Payment.user_id, User.subscription_end, Payment.completed_at, plan_months())
+        .join(User, User.id == Payment.user_id)
+        .where(
+            Payment.status == PAID_STATUS, Payment.completed_at >= start, Payment.completed_at < end,
+            User.created_at < start, User.subscription_end >= end
+        )
+        .order_by(Payment.completed_at)
+    )
+    renewals = {}
+    for user_id, subscription_end, completed_at, months in result.all():
+        _, first_paid, paid_months = renewals.get(user_id, (subscription_end, completed_at, 0))
+        renewals[user_id] = (subscription_end, first_paid, paid_months + months)
+    return sum(
+        1 for subscription_end, first_paid, months in renewals.values()
+        if abs(subscription_end - first_paid - timedelta(days=months * 30)) <= RENEWAL_TOLERANCE
+    )
+
+
+async def rollup_day(session: AsyncSession, day: date, now: Optional[datetime] = None,
+                     reconcile: bool = False) -> DailyStats:
+    """
+    Пересчитывает сводку за один день (для текущего дня - по состоянию на now).
+    Итоги берутся из сводки предыдущего дня плюс изменения за день; полный подсчет -
+    при reconcile или если полной сводки за предыдущий день нет
+    """
+    now = now or datetime.utcnow()
+    start = datetime.combine(day, time.min)
+    end = min(start + timedelta(days=1), now)
+
+    result = await session.execute(
+        select(func.count(User.id), func.count(case((User.trial_used == True, 1))))
+        .where(User.created_at >= start, User.created_at < end)
+    )
+    new_users, trials = result.one()
+
+    result = await session.execute(
+        select(plan_months(), func.count(Payment.id))
+        .where(Payment.status == PAID_STATUS, Payment.completed_at >= start, Payment.completed_at < end)
+        .group_by(plan_months())
+    )
+    renewals = dict(result.all())
+
+    # Продленная подписка уже не заканчивается в этот день, поэтому оставшиеся - отток
+    churned = await session.scalar(
+        select(func.count(User.id)).where(User.subscription_end >= start, User.subscription_end < end)
+    )
+
+    previous = await session.get(DailyStats, day - timedelta(days=1))
+    if reconcile or previous is None or previous.updated_at < start:
+        total_users, active_users, total_payments = await count_totals(session, end)
+    else:
+        new_active = await session.scalar(
+            select(func.count(User.id))
+            .where(User.created_at >= start, User.created_at < end, User.subscription_end >= end)
+        )
+        new_payments = await session.scalar(
+            select(func.count(Payment.id)).where(Payment.created_at >= start, Payment.created_at < end)
+        )
+        total_users = previous.total_users + new_users
+        active_users = (previous.active_users - churned + new_active
+                        + await count_reactivated(session, start, end))
+        total_payments = previous.total_payments + new_payments
+
+    pay_system = func.coalesce(Payment.pay_system, DEFAULT_PAY_SYSTEM)
+    result = await session.execute(
+        select(pay_system, func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0.0))
+        .where(Payment.status == PAID_STATUS, Payment.completed_at >= start, Payment.completed_at < end)
+        .group_by(pay_system)
+    )
+    revenue_rows = result.all()
+
+    await session.execute(delete(DailyRevenue).where(DailyRevenue.day == day))
+    await session.execute(delete(DailyStats).where(DailyStats.day == day))
+    stats = DailyStats(
+        day=day,
+        new_users=new_users,
+        trials=trials,
+        renewals_1=renewals.get(1, 0),
+        renewals_3=renewals.get(3, 0),
+        renewals_6=renewals.get(6, 0),
+        churned=churned,
+        total_users=total_users,
+        active_users=active_users,
+        total_payments=total_payments,
+        updated_at=now
+    )
+    session.add(stats)
+    session.add_all(
+        DailyRevenue(day=day, pay_system=system, payments=count, revenue=revenue)
+        for system, count, revenue in revenue_rows
+    )
+    return stats
+
+
+async def rollup_recent(session: AsyncSession, now: Optional[datetime] = None,
+                        reconcile: bool = False) -> list[date]:
+    """
+    Досчитывает сводки от последнего рассчитанного дня до сегодняшнего.
+    Последний день пересчитывается заново: он мог быть рассчитан не полностью.
+    При первом запуске заполняет историю с даты первого пользователя.
+    reconcile пересчитывает итоги первого из этих дней полным подсчетом,
+    следующие дни выводятся уже из него
+    """
+    now = now or datetime.utcnow()
+
+    last_day = await session.scalar(select(func.max(DailyStats.day)))
+    if last_day is None:
+        first_user = await session.scalar(select(func.min(User.created_at)))
+        last_day = first_user.date() if first_user else now.date()
+
+    days = []
+    day = last_day
+    while day <= now.date():
+        await rollup_day(session, day, now, reconcile=reconcile and not days)
+        await session.commit()
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+async def get_latest_stats(session: AsyncSession) -> Optional[DailyStats]:
+    result = await session.execute(select(DailyStats).order_by(DailyStats.day.desc()).limit(1))
+    return result.scalar_one_or_none()
+
+
+async def get_period_stats(session: AsyncSession, days: int = 7, today: Optional[date] = None) -> dict:
+    """Сумма дневных сводок за последние days дней"""
+    today = today or datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+
+    result = await session.execute(
+        select(
+            func.coalesce(func.sum(DailyStats.new_users), 0),
+            func.coalesce(func.sum(DailyStats.trials), 0),
+            func.coalesce(func.sum(DailyStats.renewals_1), 0),
+            func.coalesce(func.sum(DailyStats.renewals_3), 0),
+            func.coalesce(func.sum(DailyStats.renewals_6), 0),
+            func.coalesce(func.sum(DailyStats.churned), 0),
+        ).where(DailyStats.day >= since)
+    )
+    new_users, trials, renewals_1, renewals_3, renewals_6, churned = result.one()
+
+    result = await session.execute(
+        select(DailyRevenue.pay_system, func.sum(DailyRevenue.payments), func.sum(DailyRevenue.revenue))
+        .where(DailyRevenue.day >= since)
+        .group_by(DailyRevenue.pay_system)
+    )
+    revenue = {system: (count, total) for system, count, total in result.all()}
+
+    return {
+        'since': since,
+        'new_users': new_users,
+        'trials': trials,
+        'renewals': {1: renewals_1, 3: renewals_3, 6: renewals_6},
+        'churned': churned,
+        'revenue': revenue,
+    }
@@ -1,4 +1,4 @@
-from sqlalchemy import select
+from sqlalchemy import select, update
 from db.models import User
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -57,7 +57,8 @@ async def update_user_balance(session: AsyncSession, username: str, amount: floa
     return True
 
 
-async def renew_subscription(session: AsyncSession, user_id: int, days: int, price: int = VPN_PRICE) -> bool:
+async def renew_subscription(session: AsyncSession, user_id: int, days: int, price: int = VPN_PRICE,
+                             commit: bool = True) -> bool:
     result = await session.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
 
@@ -78,7 +79,8 @@ async def renew_subscription(session: AsyncSession, user_id: int, days: int, pri
     user.subscription_end = base_time + timedelta(days=days)
     user.is_active = True
 
-    await session.commit()
+    if commit:
+        await session.commit()
     return True
 
 
@@ -87,3 +89,17 @@ async def get_all_users(session: AsyncSession):
     users = result.scalars().all()
 
     return users
+
+
+async def set_bot_blocked(session: AsyncSession, telegram_ids, blocked: bool = True) -> int:
+    """Отмечает одним запросом, что пользователи заблокировали бота (или разблокировали)"""
+    telegram_ids = list(telegram_ids)
+    if not telegram_ids:
+        return 0
+    result = await session.execute(
+        update(User)
+        .where(User.telegram_id.in_(telegram_ids))
+        .values(bot_blocked_at=datetime.utcnow() if blocked else None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -1,27 +1,36 @@
-from aiogram import Bot, Dispatcher
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-from config.config import BOT_TOKEN
-from bot.handlers import register_handlers
-from bot.middleware import SubscriptionMiddleware
+from config.config import BOT_MODE, METRICS_PORT
+from bot.dispatcher import bot, dp
 from bot.scheduler import start_scheduler
 from bot.commands import set_bot_commands
+from bot.donate_api import close_client
+from sheets.sheets_writer import sheets_writer
+from bot.metrics import start_metrics_server, attach_databases
+from bot.broadcast import broadcast_engine
 import asyncio
 
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(storage=MemoryStorage())
-
-# Добавляем middleware
-dp.message.middleware(SubscriptionMiddleware())
-
-# Регистрируем обработчики
-register_handlers(dp)
-
 
 async def start_bot():
     await set_bot_commands(bot)
     start_scheduler()
-    await dp.start_polling(bot)
+    if METRICS_PORT:
+        attach_databases()
+        await start_metrics_server(METRICS_PORT)
+    try:
+        if BOT_MODE == 'webhook':
+            # Обновления принимает api.py, здесь работает только планировщик
+            from bot.telegram_webhook import set_webhook
+            await set_webhook()
+            await asyncio.Event().wait()
+        else:
+            # Webhook и getUpdates несовместимы: после работы в режиме webhook его нужно снять
+            await bot.delete_webhook()
+            # chat_member нужно запросить явно: по умолчанию Telegram его не присылает
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await broadcast_engine.close()
+        await close_client()
+        await sheets_writer.close()
+        await dp.storage.close()
 
 
 if __name__ == '__main__':
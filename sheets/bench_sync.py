@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Замер синхронизации с Google Sheets на локальной замене API (sheets.fake_sheets).
+Создает пользователей в БД из DATABASE_URL, выполняет полную перезапись листа,
+выгрузку изменений и сверку, и печатает время и число вызовов API на каждом шаге.
+
+Запуск: python sheets/bench_sync.py [--users 100000] [--latency 0.2] [--quota 300]
+"""
+
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert, select, update
+
+from db.database import engine, async_session
+from db.models import Base, User
+from sheets import sheets_service
+from sheets.fake_sheets import FakeClient
+from sheets.sheet_diff import diff_table
+from sheets.sheets_writer import sheets_writer
+from sheets.sync_to_sheets import SheetsSync
+
+BENCH_TELEGRAM_ID = 9_000_000_000
+INSERT_BATCH = 5000
+
+
+async def create_users(count: int) -> list:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    # Строки созданы раньше полной перезаписи, чтобы дельта подхватила только измененные
+    created = datetime.utcnow() - timedelta(hours=1)
+    async with async_session() as session:
+        for start in range(0, count, INSERT_BATCH):
+            await session.execute(insert(User), [
+                {'telegram_id': BENCH_TELEGRAM_ID + i, 'username': f"bench_{i}", 'balance': 0.0,
+                 'created_at': created, 'updated_at': created, 'is_active': True, 'trial_used': False}
+                for i in range(start, min(start + INSERT_BATCH, count))
+            ])
+        await session.commit()
+        result = await session.execute(select(User.id).where(User.telegram_id >= BENCH_TELEGRAM_ID))
+        return list(result.scalars())
+
+
+async def drop_users():
+    async with async_session() as session:
+        await session.execute(delete(User).where(User.telegram_id >= BENCH_TELEGRAM_ID))
+        await session.commit()
+
+
+async def measure(title: str, client: FakeClient, coro) -> dict:
+    calls = client.total_calls
+    started = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - started
+    print(f"   {title}: {elapsed:.2f} с, вызовов API: {client.total_calls - calls}, результат: {result}")
+    return {'seconds': elapsed, 'calls': client.total_calls - calls}
+
+
+async def run_benchmark(users: int, latency: float = 0.0, quota=None) -> dict:
+    client = FakeClient(latency=latency, quota=quota)
+    sheets_service.set_client(client)
+    sync = SheetsSync()
+    model, headers, make_row = sync.tables[sheets_service.USERS]
+    results = {}
+    try:
+        ids = await create_users(users)
+        print(f"👥 Пользователей: {len(ids)}")
+
+        results['rebuild'] = await measure("Полная перезапись", client, sync.rebuild_table(sheets_service.USERS))
+
+        # Меняем 1% строк и выгружаем только изменения
+        changed = ids[::100]
+        async with async_session() as session:
+            await session.execute(
+                update(User).where(User.id.in_(changed)).values(balance=1.0, updated_at=datetime.utcnow())
+            )
+            await session.commit()
+        results['delta'] = await measure("Выгрузка изменений", client, sync.delta_table(sheets_service.USERS))
+
+        sheet = await sheets_service.open_sheet(sheets_service.USERS)
+
+        async def check():
+            async with async_session() as session:
+                diff = await diff_table(session, model, make_row, sheet, headers)
+            return f"расходится блоков {len(diff.mismatched_blocks)}"
+
+        results['check'] = await measure("Сверка", client, check())
+        print(f"📊 Вызовы по методам: {dict(client.calls)}")
+    finally:
+        await drop_users()
+        await sheets_writer.close()
+    return results
+
+
+async def main():
+    args = sys.argv[1:]
+    options = {'--users': 100_000, '--latency': 0.0, '--quota': None}
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            print(f"❌ Неизвестный аргумент: {arg}")
+            return 1
+        options[arg] = float(args.pop(0)) if arg == '--latency' else int(args.pop(0))
+
+    print("⏱ Замер синхронизации с Google Sheets (локальная замена API)")
+    await run_benchmark(options['--users'], options['--latency'], options['--quota'])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
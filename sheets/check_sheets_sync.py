@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Скрипт для проверки синхронизации данных между базой данных и Google Sheets.
-Сравнивает количество записей и выявляет расхождения.
+Сравнивает таблицы по контрольным суммам блоков строк и выводит точные расхождения.
 """
 
 import asyncio
@@ -12,157 +12,82 @@ from datetime import datetime
 # Добавляем корневую директорию в path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from db.database import async_session
+from db.database import read_session
 from db.models import User, Payment, Server
 from sqlalchemy import select
-from sheets.sheets_service import (
-    sheet_users, sheet_payments, sheet_servers,
-    client, spreadsheets_id
-)
+from sheets.sheets_service import get_client, open_sheet, spreadsheets_id, USERS, PAYMENTS, SERVERS
+from sheets.sheet_diff import diff_table
+from sheets.sync_to_sheets import SheetsSync
 
 
 class SyncChecker:
     def __init__(self):
         self.issues = []
+        self.sync = SheetsSync()
 
     def add_issue(self, issue):
         """Добавляет проблему в список"""
         self.issues.append(issue)
         print(f"⚠️  {issue}")
 
-    async def check_users_sync(self):
-        """Проверяет синхронизацию пользователей"""
-        print("\n👥 Проверка синхронизации пользователей...")
-        
-        # Получаем данные из БД
-        async with async_session() as session:
-            result = await session.execute(select(User).order_by(User.id))
-            db_users = result.scalars().all()
-        
-        # Получаем данные из Sheets
+    async def check_table_sync(self, name: str, title: str):
+        """
+        Сравнивает таблицу БД с листом по контрольным суммам блоков
+        и выводит точные id и поля расходящихся строк
+        """
+        model, headers, make_row = self.sync.tables[name]
         try:
-            sheets_records = sheet_users.get_all_records()
+            sheet = await open_sheet(name)
+            async with read_session() as session:
+                diff = await diff_table(session, model, make_row, sheet, headers)
         except Exception as e:
-            self.add_issue(f"Ошибка получения данных из Google Sheets Users: {e}")
+            self.add_issue(f"Ошибка сравнения {name} с Google Sheets: {e}")
             return
-        
-        # Сравниваем количество
-        db_count = len(db_users)
-        sheets_count = len(sheets_records)
-        
-        print(f"   📊 БД: {db_count} пользователей")
-        print(f"   📊 Sheets: {sheets_count} записей")
-        
-        if db_count != sheets_count:
-            self.add_issue(f"Количество пользователей не совпадает: БД={db_count}, Sheets={sheets_count}")
+
+        print(f"   📊 БД: {diff.db_rows} {title}")
+        print(f"   📊 Sheets: {diff.sheet_rows} записей")
+        print(f"   🧮 Блоков: {diff.blocks}, расходится: {len(diff.mismatched_blocks)}, "
+              f"чтений Sheets: {diff.sheet_reads}")
+
+        if diff.header and diff.header != headers:
+            self.add_issue(f"Заголовки {name} не совпадают. Ожидалось: {headers}, получено: {diff.header}")
         else:
-            print("   ✅ Количество записей совпадает")
-        
-        # Проверяем заголовки
-        if sheets_records:
-            expected_headers = ['id', 'telegram_id', 'username', 'balance', 'created_at',
-                              'subscription_start', 'subscription_end', 'is_active', 
-                              'vpn_link', 'server_id', 'trial_used']
-            actual_headers = list(sheets_records[0].keys())
-            
-            if actual_headers != expected_headers:
-                self.add_issue(f"Заголовки Users не совпадают. Ожидалось: {expected_headers}, получено: {actual_headers}")
-            else:
-                print("   ✅ Заголовки корректны")
-        
-        # Проверяем несколько случайных записей
-        if db_users and sheets_records and len(db_users) == len(sheets_records):
-            for i in [0, len(db_users)//2, -1]:  # первая, средняя, последняя
-                if i < len(db_users):
-                    db_user = db_users[i]
-                    sheets_user = sheets_records[i]
-                    
-                    if str(db_user.id) != str(sheets_user['id']):
-                        self.add_issue(f"ID пользователя не совпадает в позиции {i}: БД={db_user.id}, Sheets={sheets_user['id']}")
+            print("   ✅ Заголовки корректны")
+
+        if diff.ok:
+            print("   ✅ Данные совпадают")
+            return
+        if diff.missing_in_sheet:
+            self.add_issue(f"{name}: нет в Sheets id {', '.join(diff.missing_in_sheet)}")
+        if diff.extra_in_sheet:
+            self.add_issue(f"{name}: лишние в Sheets id {', '.join(diff.extra_in_sheet)}")
+        if diff.duplicates:
+            self.add_issue(f"{name}: повторяющиеся в Sheets id {', '.join(diff.duplicates)}")
+        for key, field, db_value, sheet_value in diff.changed:
+            self.add_issue(f"{name} id={key}: поле {field} БД={db_value!r}, Sheets={sheet_value!r}")
+        if diff.truncated:
+            self.add_issue(f"{name}: расхождений больше, показаны первые")
+
+    async def check_users_sync(self):
+        """Проверяет синхронизацию пользователей"""
+        print("\n👥 Проверка синхронизации пользователей...")
+        await self.check_table_sync(USERS, "пользователей")
 
     async def check_payments_sync(self):
         """Проверяет синхронизацию платежей"""
         print("\n💳 Проверка синхронизации платежей...")
-        
-        # Получаем данные из БД
-        async with async_session() as session:
-            result = await session.execute(select(Payment).order_by(Payment.id))
-            db_payments = result.scalars().all()
-        
-        # Получаем данные из Sheets
-        try:
-            sheets_records = sheet_payments.get_all_records()
-        except Exception as e:
-            self.add_issue(f"Ошибка получения данных из Google Sheets Payments: {e}")
-            return
-        
-        # Сравниваем количество
-        db_count = len(db_payments)
-        sheets_count = len(sheets_records)
-        
-        print(f"   📊 БД: {db_count} платежей")
-        print(f"   📊 Sheets: {sheets_count} записей")
-        
-        if db_count != sheets_count:
-            self.add_issue(f"Количество платежей не совпадает: БД={db_count}, Sheets={sheets_count}")
-        else:
-            print("   ✅ Количество записей совпадает")
-        
-        # Проверяем заголовки
-        if sheets_records:
-            expected_headers = ['id', 'user_id', 'amount', 'payment_id', 'status',
-                              'created_at', 'completed_at', 'nickname', 'message', 'pay_system']
-            actual_headers = list(sheets_records[0].keys())
-            
-            if actual_headers != expected_headers:
-                self.add_issue(f"Заголовки Payments не совпадают. Ожидалось: {expected_headers}, получено: {actual_headers}")
-            else:
-                print("   ✅ Заголовки корректны")
+        await self.check_table_sync(PAYMENTS, "платежей")
 
     async def check_servers_sync(self):
         """Проверяет синхронизацию серверов"""
         print("\n🖥️  Проверка синхронизации серверов...")
-        
-        # Получаем данные из БД
-        async with async_session() as session:
-            result = await session.execute(select(Server).order_by(Server.id))
-            db_servers = result.scalars().all()
-        
-        # Получаем данные из Sheets
-        try:
-            sheets_records = sheet_servers.get_all_records()
-        except Exception as e:
-            self.add_issue(f"Ошибка получения данных из Google Sheets Servers: {e}")
-            return
-        
-        # Сравниваем количество
-        db_count = len(db_servers)
-        sheets_count = len(sheets_records)
-        
-        print(f"   📊 БД: {db_count} серверов")
-        print(f"   📊 Sheets: {sheets_count} записей")
-        
-        if db_count != sheets_count:
-            self.add_issue(f"Количество серверов не совпадает: БД={db_count}, Sheets={sheets_count}")
-        else:
-            print("   ✅ Количество записей совпадает")
-        
-        # Проверяем заголовки
-        if sheets_records:
-            expected_headers = ['id', 'name', 'url', 'is_active', 'is_default',
-                              'created_at', 'description']
-            actual_headers = list(sheets_records[0].keys())
-            
-            if actual_headers != expected_headers:
-                self.add_issue(f"Заголовки Servers не совпадают. Ожидалось: {expected_headers}, получено: {actual_headers}")
-            else:
-                print("   ✅ Заголовки корректны")
+        await self.check_table_sync(SERVERS, "серверов")
 
     async def check_database_integrity(self):
         """Проверяет целостность данных в БД"""
         print("\n🔍 Проверка целостности базы данных...")
         
-        async with async_session() as session:
+        async with read_session() as session:
             # Пользователи с несуществующими серверами
             result = await session.execute(
                 select(User).where(
@@ -228,7 +153,7 @@ async def main():
     # Проверяем доступность Google Sheets
     try:
         print("🔗 Проверяю подключение к Google Sheets...")
-        spreadsheet = client.open_by_key(spreadsheets_id)
+        spreadsheet = get_client().open_by_key(spreadsheets_id)
         print(f"✅ Подключение установлено: {spreadsheet.title}")
     except Exception as e:
         print(f"❌ Ошибка подключения к Google Sheets: {e}")
@@ -0,0 +1,268 @@
+"""
+Локальная замена Google Sheets API для тестов и замеров синхронизации.
+Реализует вызовы gspread, которыми пользуется бот, хранит листы в памяти,
+считает вызовы по методам и умеет имитировать задержку запроса и квоту
+(не больше quota запросов за quota_window секунд, дальше APIError 429 как у Google).
+Как и у Google, запись за пределы сетки листа (row_count x col_count) и запрос
+больше max_payload байт отклоняются с APIError 400: сетку нужно сначала расширить
+(add_rows, resize), большие записи - делить на части. append_rows расширяет сетку сам.
+
+Включается переменной SHEETS_BACKEND=fake или sheets_service.set_client(FakeClient(...)).
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, numericise_all
+
+DEFAULT_TITLES = ('Users', 'Payments', 'Servers')
+# Размер нового листа Google Sheets
+DEFAULT_ROWS = 1000
+DEFAULT_COLS = 26
+# Рекомендуемый Google предел размера одного запроса
+MAX_PAYLOAD = 2 * 1024 * 1024
+
+
+class _QuotaResponse:
+    """Ответ Google при превышении квоты, в виде, который понимает APIError"""
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {'error': {'code': 429, 'message': self.text, 'status': 'RESOURCE_EXHAUSTED'}}
+
+
+class _BadRequestResponse:
+    """Ответ Google на запрос, который нельзя выполнить (400)"""
+    status_code = 400
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def json(self):
+        return {'error': {'code': 400, 'message': self.text, 'status': 'INVALID_ARGUMENT'}}
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return str(value)
+
+
+def _trim(row: list) -> list:
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+class FakeClient:
+    def __init__(self, latency: float = 0.0, quota: Optional[int] = None, quota_window: float = 60.0,
+                 titles=DEFAULT_TITLES, max_payload: int = MAX_PAYLOAD):
+        self.latency = latency
+        self.quota = quota
+        self.quota_window = quota_window
+        self.max_payload = max_payload
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.spreadsheet = FakeSpreadsheet(self, titles)
+
+    def request(self, method: str):
+        """Учитывает вызов API: задержка, квота и счетчик"""
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > self.quota_window:
+                self.recent.popleft()
+            if self.quota is not None and len(self.recent) >= self.quota:
+                self.calls['quota_errors'] += 1
+                raise APIError(_QuotaResponse())
+            self.recent.append(now)
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(count for method, count in self.calls.items() if method != 'quota_errors')
+
+    def open_by_key(self, key):
+        self.request('open_by_key')
+        return self.spreadsheet
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, titles):
+        self.client = client
+        self.title = 'Fake spreadsheet'
+        self.sheets = {title: FakeWorksheet(client, title, id) for id, title in enumerate(titles)}
+
+    def worksheet(self, title):
+        self.client.request('worksheet')
+        if title not in self.sheets:
+            raise WorksheetNotFound(title)
+        return self.sheets[title]
+
+
+class FakeWorksheet:
+    def __init__(self, client: FakeClient, title: str, id: int):
+        self.client = client
+        self.title = title
+        self.id = id
+        self.rows = []
+        self.row_count = DEFAULT_ROWS
+        self.col_count = DEFAULT_COLS
+
+    # ---- хранение ----
+
+    def _check_payload(self, values):
+        """Запрос больше max_payload байт Google не принимает (значения считаем как в JSON)"""
+        payload = sum(len(_cell(value).encode()) + 3 for row in values for value in row)
+        if payload > self.client.max_payload:
+            raise APIError(_BadRequestResponse(
+                f"Request payload size exceeds the limit: {self.client.max_payload} bytes"
+            ))
+
+    def _check_grid(self, start_row: int, start_col: int, values):
+        """Запись за пределы сетки листа Google отклоняет, сетку расширяют add_rows или resize"""
+        end_row = start_row + len(values)
+        end_col = start_col + max((len(row) for row in values), default=0)
+        if end_row > self.row_count or end_col > self.col_count:
+            raise APIError(_BadRequestResponse(
+                f"Range ({self.title}!R{end_row}C{end_col}) exceeds grid limits. "
+                f"Max rows: {self.row_count}, max columns: {self.col_count}"
+            ))
+
+    def _write(self, start_row: int, start_col: int, values):
+        while len(self.rows) < start_row + len(values):
+            self.rows.append([])
+        for r, values_row in enumerate(values):
+            row = self.rows[start_row + r]
+            end_col = start_col + len(values_row)
+            if len(row) < end_col:
+                row.extend([""] * (end_col - len(row)))
+            row[start_col:end_col] = [_cell(value) for value in values_row]
+
+    def _grid(self, range_name: str) -> tuple:
+        grid = a1_range_to_grid_range(range_name.split('!')[-1])
+        return (grid.get('startRowIndex', 0), grid.get('endRowIndex', len(self.rows)),
+                grid.get('startColumnIndex', 0), grid.get('endColumnIndex'))
+
+    def _read(self, range_name: str) -> list:
+        start_row, end_row, start_col, end_col = self._grid(range_name)
+        values = [_trim(row[start_col:end_col]) for row in self.rows[start_row:end_row]]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _last_row(self) -> int:
+        last = len(self.rows)
+        while last and not any(self.rows[last - 1]):
+            last -= 1
+        return last
+
+    def _appended(self, start: int, count: int, width: int) -> dict:
+        last_col = chr(ord('A') + max(width, 1) - 1)
+        return {'updates': {'updatedRange': f"{self.title}!A{start + 1}:{last_col}{start + count}",
+                            'updatedRows': count}}
+
+    # ---- вызовы gspread ----
+
+    def get_all_records(self, *args, **kwargs):
+        self.client.request('get_all_records')
+        values = self._read('A1:ZZ')
+        if not values:
+            return []
+        header = values[0]
+        return [
+            dict(zip(header, numericise_all(row + [""] * (len(header) - len(row)))))
+            for row in values[1:]
+        ]
+
+    def get_all_values(self, *args, **kwargs):
+        self.client.request('get_all_values')
+        return self._read('A1:ZZ')
+
+    def row_values(self, row: int, *args, **kwargs):
+        self.client.request('row_values')
+        return _trim(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col: int, *args, **kwargs):
+        self.client.request('col_values')
+        values = [row[col - 1] if col <= len(row) else "" for row in self.rows]
+        return _trim(values)
+
+    def get(self, range_name: str = 'A1:ZZ', *args, **kwargs):
+        self.client.request('get')
+        return self._read(range_name)
+
+    def batch_get(self, ranges, *args, **kwargs):
+        self.client.request('batch_get')
+        return [self._read(range_name) for range_name in ranges]
+
+    def update(self, values, range_name: str = 'A1', *args, **kwargs):
+        self.client.request('update')
+        start_row, _, start_col, _ = self._grid(range_name)
+        self._check_payload(values)
+        self._check_grid(start_row, start_col, values)
+        self._write(start_row, start_col, values)
+        return {'updatedRange': f"{self.title}!{range_name}", 'updatedRows': len(values)}
+
+    def batch_update(self, data, *args, **kwargs):
+        self.client.request('batch_update')
+        grids = [self._grid(item['range']) for item in data]
+        self._check_payload([value_row for item in data for value_row in item['values']])
+        for (start_row, _, start_col, _), item in zip(grids, data):
+            self._check_grid(start_row, start_col, item['values'])
+        for (start_row, _, start_col, _), item in zip(grids, data):
+            self._write(start_row, start_col, item['values'])
+        return {'totalUpdatedRows': sum(len(item['values']) for item in data)}
+
+    def append_row(self, values, *args, **kwargs):
+        return self.append_rows([values], _method='append_row')
+
+    def append_rows(self, values, *args, _method: str = 'append_rows', **kwargs):
+        self.client.request(_method)
+        start = self._last_row()
+        self._check_payload(values)
+        # Добавление строк расширяет сетку само
+        self.row_count = max(self.row_count, start + len(values))
+        self._check_grid(start, 0, values)
+        self._write(start, 0, values)
+        return self._appended(start, len(values), max((len(row) for row in values), default=0))
+
+    def delete_rows(self, start_index: int, end_index: Optional[int] = None):
+        self.client.request('delete_rows')
+        deleted = len(range(start_index - 1, min(end_index or start_index, self.row_count)))
+        del self.rows[start_index - 1:end_index or start_index]
+        self.row_count -= deleted
+
+    def add_rows(self, rows: int):
+        self.client.request('add_rows')
+        self.row_count += rows
+
+    def resize(self, rows: Optional[int] = None, cols: Optional[int] = None):
+        self.client.request('resize')
+        if rows is not None:
+            self.row_count = rows
+            del self.rows[rows:]
+        if cols is not None:
+            self.col_count = cols
+            self.rows = [row[:cols] for row in self.rows]
+
+    def batch_clear(self, ranges):
+        self.client.request('batch_clear')
+        for range_name in ranges:
+            start_row, end_row, start_col, end_col = self._grid(range_name)
+            for row in self.rows[start_row:end_row]:
+                for col in range(start_col, min(end_col or len(row), len(row))):
+                    row[col] = ""
+
+    def clear(self):
+        self.client.request('clear')
+        self.rows = []
@@ -0,0 +1,90 @@
+"""
+Кэш номеров строк листа Google Sheets.
+Вместо скачивания всего листа (get_all_records) на каждое обновление
+индекс один раз читает заголовок и ключевую колонку и дальше отвечает из памяти.
+Индекс перестраивается при промахе, при отсутствии нужной колонки в заголовке
+и раз в ROW_INDEX_TTL секунд на случай ручных правок таблицы.
+
+Методы вызываются только из пула sheets_writer, поэтому индекс защищен threading.Lock.
+"""
+
+import re
+import threading
+import time
+from typing import Optional
+
+from gspread.utils import rowcol_to_a1
+
+ROW_INDEX_TTL = 600
+
+_RANGE_ROW = re.compile(r'![A-Z]+(\d+)')
+
+
+class RowIndex:
+    def __init__(self, sheet, ttl: float = ROW_INDEX_TTL):
+        self.sheet = sheet
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.header = None
+        self.columns = {}  # поле -> номер колонки
+        self.rows = {}  # ключевое поле -> {значение: номер строки}
+        self.built_at = 0.0
+
+    def _rebuild(self):
+        self.header = self.sheet.row_values(1)
+        self.columns = {name: idx for idx, name in enumerate(self.header, start=1)}
+        self.rows = {}
+        self.built_at = time.monotonic()
+
+    def _stale(self) -> bool:
+        return self.header is None or time.monotonic() - self.built_at > self.ttl
+
+    def _key_rows(self, key_field: str) -> dict:
+        if key_field not in self.rows:
+            values = self.sheet.col_values(self.columns[key_field])
+            self.rows[key_field] = {str(value): idx for idx, value in enumerate(values, start=1) if idx > 1}
+        return self.rows[key_field]
+
+    def find(self, key_field: str, key) -> Optional[int]:
+        """Номер строки со значением key в колонке key_field; None, если строки нет"""
+        with self.lock:
+            rebuilt = False
+            if self._stale() or key_field not in self.columns:
+                self._rebuild()
+                rebuilt = True
+            if key_field not in self.columns:
+                return None
+            row = self._key_rows(key_field).get(str(key))
+            if row is None and not rebuilt:
+                # Промах: строку могли добавить в обход индекса
+                self._rebuild()
+                if key_field in self.columns:
+                    row = self._key_rows(key_field).get(str(key))
+            return row
+
+    def cell(self, field: str, row: int) -> Optional[str]:
+        """A1-адрес ячейки поля field в строке row по текущему заголовку"""
+        column = self.columns.get(field)
+        return rowcol_to_a1(row, column) if column else None
+
+    def appended(self, values: list, response: Optional[dict]):
+        """Запоминает строку, дописанную append_row, по ответу API"""
+        with self.lock:
+            match = _RANGE_ROW.search(((response or {}).get('updates') or {}).get('updatedRange', ''))
+            if not match or self.header is None:
+                self._invalidate()
+                return
+            row = int(match.group(1))
+            for key_field, rows in self.rows.items():
+                column = self.columns[key_field]
+                if column <= len(values):
+                    rows[str(values[column - 1])] = row
+
+    def _invalidate(self):
+        self.header = None
+        self.rows = {}
+
+    def invalidate(self):
+        """Сбрасывает индекс после удаления или полной перезаписи строк"""
+        with self.lock:
+            self._invalidate()
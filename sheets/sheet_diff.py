@@ -0,0 +1,233 @@
+"""
+Потоковое сравнение таблицы БД с листом Google Sheets.
+Строки обеих сторон нормализуются и хешируются; хеши складываются в контрольные
+суммы блоков по диапазонам id (BLOCK_SIZE ключей в блоке). Сумма не зависит от
+порядка строк, поэтому лист не нужно сортировать. Построчно сравниваются только
+блоки с разными суммами: строки БД читаются запросом по диапазону id, строки листа -
+одним batch_get по запомненным номерам строк.
+
+В памяти держатся суммы блоков и номера строк листа, а не сами строки.
+Лист читается кусками по CHUNK_SIZE строк, БД - потоком.
+"""
+
+import hashlib
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable
+
+from sqlalchemy import select
+
+from sheets.sheets_writer import sheets_writer
+
+BLOCK_SIZE = 500
+CHUNK_SIZE = 2000
+MAX_DETAILS = 200
+_MASK = (1 << 64) - 1
+# Блок для строк листа с нечисловым id
+BAD_KEY_BLOCK = -1
+
+
+def _column_letter(index: int) -> str:
+    return chr(ord('A') + index - 1)
+
+
+def normalize(value) -> str:
+    """
+    Значение ячейки в сравнимом виде: Sheets возвращает отформатированные строки,
+    поэтому 100.0 и '100', True и 'TRUE' считаются равными
+    """
+    if value is None:
+        return ""
+    text = str(value).strip()
+    lowered = text.lower()
+    if lowered in ('true', 'false'):
+        return lowered
+    try:
+        number = float(text.replace(',', '.')) if text else None
+    except ValueError:
+        return text
+    if number is None or number != number:
+        return text
+    return str(int(number)) if number.is_integer() and abs(number) < 1e15 else repr(number)
+
+
+def normalize_row(row, width: int) -> list:
+    cells = [normalize(value) for value in row[:width]]
+    return cells + [""] * (width - len(cells))
+
+
+def row_hash(cells: list) -> int:
+    return int.from_bytes(hashlib.blake2b('\x1f'.join(cells).encode(), digest_size=8).digest(), 'big')
+
+
+def block_of(key: str, block_size: int) -> int:
+    try:
+        return int(key) // block_size
+    except ValueError:
+        return BAD_KEY_BLOCK
+
+
+@dataclass
+class BlockSums:
+    sums: dict = field(default_factory=lambda: defaultdict(int))
+    counts: dict = field(default_factory=lambda: defaultdict(int))
+
+    def add(self, block: int, cells: list):
+        self.sums[block] = (self.sums[block] + row_hash(cells)) & _MASK
+        self.counts[block] += 1
+
+    @property
+    def rows(self) -> int:
+        return sum(self.counts.values())
+
+
+@dataclass
+class SheetDiff:
+    db_rows: int = 0
+    sheet_rows: int = 0
+    header: list = field(default_factory=list)
+    blocks: int = 0
+    mismatched_blocks: list = field(default_factory=list)
+    missing_in_sheet: list = field(default_factory=list)  # id есть в БД, нет в листе
+    extra_in_sheet: list = field(default_factory=list)    # id есть в листе, нет в БД
+    duplicates: list = field(default_factory=list)        # id встречается в листе несколько раз
+    changed: list = field(default_factory=list)           # (id, поле, значение БД, значение листа)
+    sheet_reads: int = 0
+    truncated: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatched_blocks
+
+
+class SheetDiffer:
+    def __init__(self, sheet, headers: list, block_size: int = BLOCK_SIZE,
+                 chunk_size: int = CHUNK_SIZE, max_details: int = MAX_DETAILS):
+        self.sheet = sheet
+        self.headers = headers
+        self.width = len(headers)
+        self.last_column = _column_letter(self.width)
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.max_details = max_details
+
+    async def _read(self, func, *args):
+        return await sheets_writer.run(func, *args, key=self.sheet.id)
+
+    async def _db_sums(self, session, model, make_row) -> BlockSums:
+        sums = BlockSums()
+        stream = await session.stream_scalars(
+            select(model).order_by(model.id).execution_options(yield_per=self.block_size)
+        )
+        async for item in stream:
+            sums.add(item.id // self.block_size, normalize_row(make_row(item), self.width))
+        return sums
+
+    async def _sheet_sums(self, diff: SheetDiff) -> tuple:
+        """Читает лист кусками; возвращает суммы блоков и номера строк листа по блокам"""
+        sums = BlockSums()
+        rows_by_block = defaultdict(lambda: array('I'))
+        start = 1
+        while True:
+            end = start + self.chunk_size - 1
+            values = await self._read(self.sheet.get, f'A{start}:{self.last_column}{end}')
+            diff.sheet_reads += 1
+            values = list(values or [])
+            if start == 1:
+                diff.header = list(values[0]) if values else []
+                data, first_row = values[1:], 2
+            else:
+                data, first_row = values, start
+            for offset, row in enumerate(data):
+                cells = normalize_row(row, self.width)
+                if not any(cells):
+                    continue
+                block = block_of(cells[0], self.block_size)
+                sums.add(block, cells)
+                rows_by_block[block].append(first_row + offset)
+            if len(values) < self.chunk_size:
+                return sums, rows_by_block
+            start = end + 1
+
+    async def _sheet_rows(self, row_numbers, diff: SheetDiff) -> list:
+        """Строки листа по номерам одним batch_get; соседние номера читаются одним диапазоном"""
+        spans = []
+        for number in sorted(row_numbers):
+            if spans and spans[-1][1] == number - 1:
+                spans[-1][1] = number
+            else:
+                spans.append([number, number])
+        ranges = [f'A{first}:{self.last_column}{last}' for first, last in spans]
+        result = await self._read(self.sheet.batch_get, ranges)
+        diff.sheet_reads += 1
+        rows = []
+        for (first, last), values in zip(spans, result):
+            values = list(values or [])
+            values += [[]] * (last - first + 1 - len(values))
+            rows.extend(normalize_row(row, self.width) for row in values)
+        return [cells for cells in rows if any(cells)]
+
+    def _note(self, items: list, value, diff: SheetDiff):
+        if len(items) < self.max_details:
+            items.append(value)
+        else:
+            diff.truncated = True
+
+    def _compare_block(self, db_rows: dict, sheet_rows: list, diff: SheetDiff):
+        seen = {}
+        for cells in sheet_rows:
+            key = cells[0]
+            if key in seen:
+                self._note(diff.duplicates, key, diff)
+                continue
+            seen[key] = cells
+        for key, db_cells in db_rows.items():
+            sheet_cells = seen.pop(key, None)
+            if sheet_cells is None:
+                self._note(diff.missing_in_sheet, key, diff)
+                continue
+            for name, db_value, sheet_value in zip(self.headers, db_cells, sheet_cells):
+                if db_value != sheet_value:
+                    self._note(diff.changed, (key, name, db_value, sheet_value), diff)
+        for key in seen:
+            self._note(diff.extra_in_sheet, key, diff)
+
+    async def diff(self, session, model, make_row: Callable) -> SheetDiff:
+        diff = SheetDiff()
+        db_sums = await self._db_sums(session, model, make_row)
+        sheet_sums, rows_by_block = await self._sheet_sums(diff)
+        diff.db_rows = db_sums.rows
+        diff.sheet_rows = sheet_sums.rows
+
+        blocks = sorted(set(db_sums.counts) | set(sheet_sums.counts))
+        diff.blocks = len(blocks)
+        diff.mismatched_blocks = [
+            block for block in blocks
+            if db_sums.sums.get(block) != sheet_sums.sums.get(block)
+            or db_sums.counts.get(block) != sheet_sums.counts.get(block)
+        ]
+
+        for block in diff.mismatched_blocks:
+            db_rows = {}
+            if block != BAD_KEY_BLOCK:
+                result = await session.execute(
+                    select(model)
+                    .where(model.id >= block * self.block_size, model.id < (block + 1) * self.block_size)
+                    .order_by(model.id)
+                )
+                for item in result.scalars():
+                    cells = normalize_row(make_row(item), self.width)
+                    db_rows[cells[0]] = cells
+            numbers = rows_by_block.get(block)
+            sheet_rows = await self._sheet_rows(numbers, diff) if numbers else []
+            self._compare_block(db_rows, sheet_rows, diff)
+        return diff
+
+
+async def diff_table(session, model, make_row: Callable, sheet, headers: list,
+                     block_size: int = BLOCK_SIZE, chunk_size: int = CHUNK_SIZE,
+                     max_details: int = MAX_DETAILS) -> SheetDiff:
+    """Сравнивает таблицу model с листом sheet, строки БД приводятся к виду листа функцией make_row"""
+    differ = SheetDiffer(sheet, headers, block_size, chunk_size, max_details)
+    return await differ.diff(session, model, make_row)
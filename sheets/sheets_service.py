@@ -1,10 +1,11 @@
-import httplib2
-import gspread
 import os
-import json
-from apiclient import discovery
+import threading
+import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from config.config import SHEETS_BACKEND
 from db.models import User, Payment, Server
+from sheets.sheets_writer import sheets_writer, UpdateCoalescer
+from sheets.row_index import RowIndex
 
 current_dir = os.path.dirname(__file__)
 CREDENTIALS_FILE = os.path.join(current_dir, 'creds.json')
@@ -12,23 +13,130 @@ CREDENTIALS_FILE = os.path.join(current_dir, 'creds.json')
 # CREDENTIALS_FILE = 'cred.json'
 spreadsheets_id = '1ID5MNUNwL0e6O9880ap5-5i0w1qIxQvW1jndBz9D9Lg'
 
-credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE,
-                                                               ['https://www.googleapis.com/auth/spreadsheets',
-                                                                'https://www.googleapis.com/auth/drive'])
+USERS = 'Users'
+PAYMENTS = 'Payments'
+SERVERS = 'Servers'
+
+# Авторизация в Google откладывается до первого обращения к таблицам,
+# поэтому модуль импортируется без creds.json (тесты, замеры, SHEETS_BACKEND=fake)
+_client = None
+_sheets = {}
+# Номера строк по ключевым колонкам, чтобы не скачивать лист на каждое обновление
+_row_indexes = {}
+_lock = threading.Lock()
+
+
+def _authorize():
+    if SHEETS_BACKEND == 'fake':
+        from sheets.fake_sheets import FakeClient
+        return FakeClient()
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE,
+                                                                   ['https://www.googleapis.com/auth/spreadsheets',
+                                                                    'https://www.googleapis.com/auth/drive'])
+    return gspread.authorize(credentials)
+
+
+def set_client(client):
+    """Подменяет клиент gspread (например, на sheets.fake_sheets.FakeClient) и сбрасывает кэш листов"""
+    global _client
+    with _lock:
+        _client = client
+        _sheets.clear()
+        _row_indexes.clear()
+
+
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = _authorize()
+        return _client
+
+
+def get_sheet(title: str):
+    """Лист таблицы по названию; при первом обращении авторизуется и открывает таблицу"""
+    client = get_client()
+    with _lock:
+        if title not in _sheets:
+            _sheets[title] = client.open_by_key(spreadsheets_id).worksheet(title)
+        return _sheets[title]
+
+
+async def open_sheet(title: str):
+    """get_sheet для event loop: первое открытие листа выполняется в пуле sheets_writer"""
+    sheet = _sheets.get(title)
+    if sheet is None:
+        sheet = await sheets_writer.run(get_sheet, title)
+    return sheet
+
+
+def row_index(sheet) -> RowIndex:
+    with _lock:
+        if sheet.id not in _row_indexes:
+            _row_indexes[sheet.id] = RowIndex(sheet)
+        return _row_indexes[sheet.id]
+
+
+# ======================== SHEETS I/O ========================
+# Синхронные функции ниже выполняются только в пуле sheets_writer,
+# асинхронные API лишь готовят значения из моделей и ставят их в очередь.
+
+def _append_row(sheet, row):
+    try:
+        response = sheet.append_row(row)
+        row_index(sheet).appended(row, response)
+    except Exception as e:
+        print(f"Не удалось записать в Гугл таблицу {sheet.title}: {e}")
+
+
+def _update_rows(sheet, rows):
+    """Записывает накопленные обновления {(key_field, key): {поле: значение}} одним batch_update"""
+    index = row_index(sheet)
+    try:
+        updates = []
+        for (key_field, key), values in rows.items():
+            row = index.find(key_field, key)
+            if row is None:
+                continue
+            updates.extend(
+                {'range': index.cell(field, row), 'values': [[value]]}
+                for field, value in values.items()
+                if index.cell(field, row)
+            )
+        if updates:
+            sheet.batch_update(updates)
+    except Exception as e:
+        print(f"Не удалось обновить Гугл таблицу {sheet.title}: {e}")
+
+
+update_coalescer = UpdateCoalescer(sheets_writer, _update_rows)
 
-httpAuth = credentials.authorize(httplib2.Http())
-service = discovery.build('sheets', 'v4', http=httpAuth)
-client = gspread.authorize(credentials)
 
-sheet_users = client.open_by_key(spreadsheets_id).worksheet('Users')
-sheet_payments = client.open_by_key(spreadsheets_id).worksheet('Payments')
-sheet_servers = client.open_by_key(spreadsheets_id).worksheet('Servers')
+def _delete_row(sheet, key_field, key):
+    index = row_index(sheet)
+    try:
+        row = index.find(key_field, key)
+        if row is not None:
+            sheet.delete_rows(row)
+            # Строки ниже удаленной сдвинулись
+            index.invalidate()
+    except Exception as e:
+        print(f"Ошибка при удалении строки {key} из {sheet.title}: {e}")
+
+
+async def _get_records(sheet):
+    try:
+        return await sheets_writer.run(sheet.get_all_records)
+    except Exception as e:
+        print(f"Ошибка при получении данных из {sheet.title}: {e}")
+        return []
 
 
 # ======================== USER FUNCTIONS ========================
 
 async def add_user_to_sheets(user: User):
     """Добавляет пользователя в Google Sheets с обновленными полями"""
+    sheet = await open_sheet(USERS)
     row = [
         str(user.id),
         str(user.telegram_id),
@@ -42,53 +150,47 @@ async def add_user_to_sheets(user: User):
         str(user.server_id) if user.server_id else "",
         str(user.trial_used)
     ]
-    try:
-        sheet_users.append_row(row)
-    except Exception as e:
-        print("Не удалось записать в Гугл таблицу")
+    sheets_writer.enqueue(_append_row, sheet, row, key=sheet.id)
 
 
 async def update_user_by_telegram_id(telegram_id, user: User):
     """Обновляет пользователя в Google Sheets по telegram_id"""
-    records = sheet_users.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['telegram_id']) == str(telegram_id):
-            try:
-                sheet_users.update([[str(user.balance)]], f'D{idx}')
-                sheet_users.update([[str(user.subscription_start)]], f'F{idx}')
-                sheet_users.update([[str(user.subscription_end)]], f'G{idx}')
-                sheet_users.update([[str(user.is_active)]], f'H{idx}')
-                sheet_users.update([[str(user.vpn_link or "")]], f'I{idx}')
-                sheet_users.update([[str(user.server_id) if user.server_id else ""]], f'J{idx}')
-                sheet_users.update([[str(user.trial_used)]], f'K{idx}')
-            except Exception as e:
-                print("Не удалось обновить в Гугл таблицу")
+    sheet = await open_sheet(USERS)
+    values = {
+        'balance': str(user.balance),
+        'subscription_start': str(user.subscription_start),
+        'subscription_end': str(user.subscription_end),
+        'is_active': str(user.is_active),
+        'vpn_link': str(user.vpn_link or ""),
+        'server_id': str(user.server_id) if user.server_id else "",
+        'trial_used': str(user.trial_used),
+    }
+    update_coalescer.add(sheet, 'telegram_id', telegram_id, values)
 
 
 async def update_user_by_id(user_id, user: User):
     """Обновляет пользователя в Google Sheets по ID"""
-    records = sheet_users.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['id']) == str(user_id):
-            try:
-                sheet_users.update([[str(user.telegram_id)]], f'B{idx}')
-                sheet_users.update([[str(user.username)]], f'C{idx}')
-                sheet_users.update([[str(user.balance)]], f'D{idx}')
-                sheet_users.update([[str(user.created_at)]], f'E{idx}')
-                sheet_users.update([[str(user.subscription_start)]], f'F{idx}')
-                sheet_users.update([[str(user.subscription_end)]], f'G{idx}')
-                sheet_users.update([[str(user.is_active)]], f'H{idx}')
-                sheet_users.update([[str(user.vpn_link or "")]], f'I{idx}')
-                sheet_users.update([[str(user.server_id) if user.server_id else ""]], f'J{idx}')
-                sheet_users.update([[str(user.trial_used)]], f'K{idx}')
-            except Exception as e:
-                print("Не удалось обновить в Гугл таблицу")
+    sheet = await open_sheet(USERS)
+    values = {
+        'telegram_id': str(user.telegram_id),
+        'username': str(user.username),
+        'balance': str(user.balance),
+        'created_at': str(user.created_at),
+        'subscription_start': str(user.subscription_start),
+        'subscription_end': str(user.subscription_end),
+        'is_active': str(user.is_active),
+        'vpn_link': str(user.vpn_link or ""),
+        'server_id': str(user.server_id) if user.server_id else "",
+        'trial_used': str(user.trial_used),
+    }
+    update_coalescer.add(sheet, 'id', user_id, values)
 
 
 # ======================== SERVER FUNCTIONS ========================
 
 async def add_server_to_sheets(server: Server):
     """Добавляет сервер в Google Sheets"""
+    sheet = await open_sheet(SERVERS)
     row = [
         str(server.id),
         str(server.name),
@@ -98,66 +200,60 @@ async def add_server_to_sheets(server: Server):
         str(server.created_at),
         server.description or ""
     ]
-    try:
-        sheet_servers.append_row(row)
-    except:
-        print("Не удалось добавить в гугл таблицу")
+    sheets_writer.enqueue(_append_row, sheet, row, key=sheet.id)
 
 
 async def update_server_by_id(server_id, server: Server):
     """Обновляет сервер в Google Sheets по ID"""
-    records = sheet_servers.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['id']) == str(server_id):
-            try:
-                sheet_servers.update([[str(server.name)]], f'B{idx}')
-                sheet_servers.update([[str(server.url)]], f'C{idx}')
-                sheet_servers.update([[str(server.is_active)]], f'D{idx}')
-                sheet_servers.update([[str(server.is_default)]], f'E{idx}')
-                sheet_servers.update([[str(server.created_at)]], f'F{idx}')
-                sheet_servers.update([[str(server.description or "")]], f'G{idx}')
-            except:
-                print("Не удалось обновить гугл таблицу")
+    sheet = await open_sheet(SERVERS)
+    values = {
+        'name': str(server.name),
+        'url': str(server.url),
+        'is_active': str(server.is_active),
+        'is_default': str(server.is_default),
+        'created_at': str(server.created_at),
+        'description': str(server.description or ""),
+    }
+    update_coalescer.add(sheet, 'id', server_id, values)
 
 
 async def delete_server_by_id(server_id):
     """Удаляет сервер из Google Sheets по ID"""
-    try:
-        records = sheet_servers.get_all_records()
-        for idx, record in enumerate(records, start=2):
-            if str(record['id']) == str(server_id):
-                sheet_servers.delete_rows(idx)
-                break
-    except Exception as e:
-        print(f"Ошибка при удалении сервера {server_id}: {e}")
+    sheet = await open_sheet(SERVERS)
+    sheets_writer.enqueue(_delete_row, sheet, 'id', server_id, key=sheet.id)
 
 
 async def get_servers_from_sheets():
     """Получает все серверы из Google Sheets"""
-    try:
-        return sheet_servers.get_all_records()
-    except Exception as e:
-        print(f"Ошибка при получении серверов: {e}")
-        return []
+    sheet = await open_sheet(SERVERS)
+    return await _get_records(sheet)
 
 
 async def find_server_by_name(server_name):
     """Находит сервер в Google Sheets по имени"""
-    try:
-        records = sheet_servers.get_all_records()
-        for record in records:
-            if record['name'] == server_name:
-                return record
-        return None
-    except Exception as e:
-        print(f"Ошибка при поиске сервера {server_name}: {e}")
-        return None
+    sheet = await open_sheet(SERVERS)
+    for record in await _get_records(sheet):
+        if record['name'] == server_name:
+            return record
+    return None
 
 
 # ======================== PAYMENT FUNCTIONS ========================
 
+def _payment_values(payment: Payment):
+    return {
+        'status': str(payment.status),
+        'amount': str(payment.amount),
+        'payment_id': str(payment.payment_id),
+        'completed_at': str(payment.completed_at),
+        'message': str(payment.message),
+        'pay_system': str(payment.pay_system),
+    }
+
+
 async def add_payment_to_sheets(payment: Payment):
     """Добавляет платеж в Google Sheets"""
+    sheet = await open_sheet(PAYMENTS)
     row = [
         str(payment.id),
         str(payment.user_id),
@@ -170,70 +266,39 @@ async def add_payment_to_sheets(payment: Payment):
         str(payment.message),
         str(payment.pay_system)
     ]
-    try:
-        sheet_payments.append_row(row)
-    except:
-        print("Не удалось добавить в гугл таблицу")
+    sheets_writer.enqueue(_append_row, sheet, row, key=sheet.id)
 
 
 async def update_payment_by_nickname(nickname, payment: Payment):
     """Обновляет платеж в Google Sheets по nickname"""
-    records = sheet_payments.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['nickname']) == str(nickname):
-            try:
-                sheet_payments.update([[str(payment.status)]], f'E{idx}')
-                sheet_payments.update([[str(payment.amount)]], f'C{idx}')
-                sheet_payments.update([[str(payment.payment_id)]], f'D{idx}')
-                sheet_payments.update([[str(payment.completed_at)]], f'G{idx}')
-                sheet_payments.update([[str(payment.message)]], f'I{idx}')
-                sheet_payments.update([[str(payment.pay_system)]], f'J{idx}')
-            except:
-                print("Не удалось обновить гугл таблицу")
+    sheet = await open_sheet(PAYMENTS)
+    update_coalescer.add(sheet, 'nickname', nickname, _payment_values(payment))
 
 
 async def update_payment_by_id(id, payment: Payment):
     """Обновляет платеж в Google Sheets по ID"""
-    records = sheet_payments.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['id']) == str(id):
-            try:
-                sheet_payments.update([[str(payment.status)]], f'E{idx}')
-                sheet_payments.update([[str(payment.amount)]], f'C{idx}')
-                sheet_payments.update([[str(payment.payment_id)]], f'D{idx}')
-                sheet_payments.update([[str(payment.completed_at)]], f'G{idx}')
-                sheet_payments.update([[str(payment.message)]], f'I{idx}')
-                sheet_payments.update([[str(payment.pay_system)]], f'J{idx}')
-            except:
-                print("Не удалось обновить гугл таблицу")
+    sheet = await open_sheet(PAYMENTS)
+    update_coalescer.add(sheet, 'id', id, _payment_values(payment))
 
 
 # ======================== UTILITY FUNCTIONS ========================
 
 async def get_users_from_sheets():
     """Получает всех пользователей из Google Sheets"""
-    try:
-        return sheet_users.get_all_records()
-    except Exception as e:
-        print(f"Ошибка при получении пользователей: {e}")
-        return []
+    sheet = await open_sheet(USERS)
+    return await _get_records(sheet)
 
 
 async def get_payments_from_sheets():
     """Получает все платежи из Google Sheets"""
-    try:
-        return sheet_payments.get_all_records()
-    except Exception as e:
-        print(f"Ошибка при получении платежей: {e}")
-        return []
+    sheet = await open_sheet(PAYMENTS)
+    return await _get_records(sheet)
 
 
 async def sync_server_status(server_id, is_active, is_default=None):
     """Синхронизирует статус сервера в Google Sheets"""
-    records = sheet_servers.get_all_records()
-    for idx, record in enumerate(records, start=2):
-        if str(record['id']) == str(server_id):
-            sheet_servers.update([[str(is_active)]], f'D{idx}')
-            if is_default is not None:
-                sheet_servers.update([[str(is_default)]], f'E{idx}')
-            break
+    sheet = await open_sheet(SERVERS)
+    values = {'is_active': str(is_active)}
+    if is_default is not None:
+        values['is_default'] = str(is_default)
+    update_coalescer.add(sheet, 'id', server_id, values)
@@ -0,0 +1,143 @@
+"""
+Очередь операций с Google Sheets.
+gspread синхронный, поэтому все обращения к таблицам выполняются в отдельном
+пуле потоков, а event loop бота только ставит задачи в ограниченную очередь.
+
+- enqueue(): «выстрелил и забыл» для обработчиков; при переполнении очереди
+  операция отбрасывается с записью в лог, обработчик не ждет
+- run(): для фоновых задач (SheetsSync); ждет места в очереди и возвращает результат
+
+Операции с одинаковым key выполняются строго по порядку постановки.
+UpdateCoalescer копит обновления строк за короткое окно и отправляет их
+одной операцией на лист: для каждой строки побеждает последняя запись поля.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config.config import SHEETS_QUEUE_SIZE, SHEETS_WORKERS, SHEETS_BATCH_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsWriter:
+    def __init__(self, max_queue: int = SHEETS_QUEUE_SIZE, workers: int = SHEETS_WORKERS):
+        self.max_queue = max_queue
+        self.workers = workers
+        self.queue: Optional[asyncio.Queue] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.tasks = []
+        self.key_locks = {}
+        self.key_refs = Counter()
+        self.dropped = 0
+        self.coalescers = []
+
+    def _ensure_started(self):
+        """Запускает пул и обработчики очереди в текущем event loop при первом обращении"""
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sheets')
+        self.tasks = [asyncio.create_task(self._drain()) for _ in range(self.workers)]
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, key, future = await self.queue.get()
+            lock = None
+            if key is not None:
+                lock = self.key_locks.setdefault(key, asyncio.Lock())
+                self.key_refs[key] += 1
+            try:
+                if lock:
+                    async with lock:
+                        result = await loop.run_in_executor(self.executor, func, *args)
+                else:
+                    result = await loop.run_in_executor(self.executor, func, *args)
+                if future and not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if future and not future.done():
+                    future.set_exception(e)
+                else:
+                    logger.error("Ошибка операции Google Sheets %s: %r", getattr(func, '__name__', func), e)
+            finally:
+                if key is not None:
+                    self.key_refs[key] -= 1
+                    if not self.key_refs[key]:
+                        del self.key_refs[key]
+                        del self.key_locks[key]
+                self.queue.task_done()
+
+    def enqueue(self, func: Callable, *args, key: Any = None) -> bool:
+        """Ставит операцию в очередь без ожидания; False, если очередь переполнена"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((func, args, key, None))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Очередь Google Sheets переполнена (%d), операция %s отброшена",
+                           self.max_queue, getattr(func, '__name__', func))
+            return False
+
+    async def run(self, func: Callable, *args, key: Any = None):
+        """Выполняет операцию в пуле и возвращает результат; ждет места в очереди"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, key, future))
+        return await future
+
+    async def join(self):
+        """Ждет выполнения всех поставленных операций"""
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def close(self):
+        for coalescer in self.coalescers:
+            coalescer.flush()
+        await self.join()
+        for task in self.tasks:
+            task.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.queue = None
+        self.executor = None
+        self.tasks = []
+        self.key_locks = {}
+        self.key_refs = Counter()
+
+
+class UpdateCoalescer:
+    """
+    Копит обновления строк и раз в window секунд ставит в очередь одну операцию на лист:
+    flush_func(sheet, {(key_field, key): {поле: значение}})
+    """
+
+    def __init__(self, writer: SheetsWriter, flush_func: Callable, window: float = SHEETS_BATCH_WINDOW):
+        self.writer = writer
+        self.flush_func = flush_func
+        self.window = window
+        self.pending = {}  # id листа -> (лист, {(key_field, key): значения})
+        self.timer: Optional[asyncio.TimerHandle] = None
+        writer.coalescers.append(self)
+
+    def add(self, sheet, key_field: str, key, values: dict):
+        _, rows = self.pending.setdefault(sheet.id, (sheet, {}))
+        rows.setdefault((key_field, str(key)), {}).update(values)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, {}
+        for sheet, rows in pending.values():
+            self.writer.enqueue(self.flush_func, sheet, rows, key=sheet.id)
+
+
+sheets_writer = SheetsWriter()
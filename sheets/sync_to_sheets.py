@@ -1,24 +1,77 @@
 #!/usr/bin/env python3
 """
-Скрипт для полной синхронизации данных из базы данных в Google Sheets.
-Очищает все существующие данные и записывает их заново с учетом новых полей.
+Синхронизация данных из базы данных в Google Sheets.
+Полная синхронизация перезаписывает листы целиком, инкрементальная (--delta)
+выгружает только строки, у которых updated_at новее сохраненной отметки
+(таблица sync_watermarks, создает db/migrations/add_sync_watermarks.py).
 """
 
 import asyncio
 import sys
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 
 # Добавляем корневую директорию в path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from db.database import async_session
-from db.models import User, Payment, Server
+from db.database import async_session, read_session
+from db.models import User, Payment, Server, SyncWatermark
 from sqlalchemy import select
 from sheets.sheets_service import (
-    sheet_users, sheet_payments, sheet_servers,
-    client, spreadsheets_id
+    USERS, PAYMENTS, SERVERS,
+    get_client, open_sheet, spreadsheets_id, row_index
 )
+from sheets.sheets_writer import sheets_writer
+
+
+# Строки, измененные незадолго до отметки, выгружаются повторно: транзакция
+# с более ранним updated_at могла закоммититься позже (или еще не дойти до реплики)
+WATERMARK_OVERLAP = timedelta(minutes=1)
+# Полная перезапись идет пачками по 100 строк для избежания лимитов API
+REBUILD_BATCH_SIZE = 100
+
+
+def _column_letter(index: int) -> str:
+    return chr(ord('A') + index - 1)
+
+
+def _rebuild_sheet(sheet, headers, rows):
+    """
+    Перезаписывает лист поверх старых данных и стирает лишние строки снизу.
+    Лист не очищается целиком, поэтому во время синхронизации он не бывает пустым.
+    update не расширяет сетку листа, поэтому недостающие строки добавляются заранее,
+    а запись идет пачками: одна большая запись упирается в лимит размера запроса
+    """
+    old_count = len(sheet.col_values(1))
+    values = [headers] + rows
+    new_count = len(values)
+    if sheet.row_count < new_count:
+        sheet.add_rows(new_count - sheet.row_count)
+    for start in range(0, new_count, REBUILD_BATCH_SIZE):
+        sheet.update(values[start:start + REBUILD_BATCH_SIZE], f'A{start + 1}')
+    if old_count > new_count:
+        sheet.batch_clear([f'A{new_count + 1}:{_column_letter(len(headers))}{old_count}'])
+    row_index(sheet).invalidate()
+
+
+def _upsert_rows(sheet, headers, rows) -> tuple:
+    """Обновляет строки с известным id (первая колонка) и дописывает новые; возвращает (обновлено, добавлено)"""
+    index = {value: idx for idx, value in enumerate(sheet.col_values(1), start=1)}
+    last_column = _column_letter(len(headers))
+    updates, new_rows = [], []
+    for row in rows:
+        idx = index.get(str(row[0]))
+        if idx:
+            updates.append({'range': f'A{idx}:{last_column}{idx}', 'values': [row]})
+        else:
+            new_rows.append(row)
+    if updates:
+        sheet.batch_update(updates)
+    if new_rows:
+        sheet.append_rows(new_rows)
+        row_index(sheet).invalidate()
+    return len(updates), len(new_rows)
 
 
 class SheetsSync:
@@ -39,176 +92,149 @@ class SheetsSync:
             'created_at', 'description'
         ]
 
-    def clear_sheet(self, sheet, sheet_name):
-        """Очищает лист полностью"""
-        try:
-            sheet.clear()
-        except Exception as e:
-            print(f"❌ Ошибка при очистке листа '{sheet_name}': {e}")
-            raise
+        # имя листа -> (модель, заголовки, строка листа из модели)
+        self.tables = {
+            USERS: (User, self.headers_users, self.user_row),
+            PAYMENTS: (Payment, self.headers_payments, self.payment_row),
+            SERVERS: (Server, self.headers_servers, self.server_row),
+        }
 
-    def setup_headers(self, sheet, headers, sheet_name):
-        """Устанавливает заголовки для листа"""
-        try:
-            sheet.append_row(headers)
-            # Делаем заголовки жирными
-        except Exception as e:
-            raise
+    @staticmethod
+    def user_row(user: User) -> list:
+        return [
+            str(user.id),
+            str(user.telegram_id),
+            str(user.username) if user.username else "",
+            str(user.balance),
+            str(user.created_at),
+            str(user.subscription_start.strftime('%d.%m.%Y')) if user.subscription_start else "",
+            str(user.subscription_end.strftime('%d.%m.%Y')) if user.subscription_end else "",
+            str(user.is_active),
+            user.vpn_link if user.vpn_link else "",
+            str(user.server_id) if user.server_id else "",
+            str(user.trial_used)
+        ]
 
-    async def sync_users(self):
-        """Синхронизирует всех пользователей"""
+    @staticmethod
+    def payment_row(payment: Payment) -> list:
+        return [
+            str(payment.id),
+            str(payment.user_id),
+            payment.amount if payment.amount else "",
+            str(payment.payment_id) if payment.payment_id else "",
+            str(payment.status),
+            str(payment.created_at.strftime('%d.%m.%Y')),
+            str(payment.completed_at.strftime('%d.%m.%Y')) if payment.completed_at else "",
+            str(payment.nickname) if payment.nickname else "",
+            str(payment.message) if payment.message else "",
+            str(payment.pay_system) if payment.pay_system else ""
+        ]
 
-        async with async_session() as session:
-            # Получаем всех пользователей
-            result = await session.execute(select(User).order_by(User.id))
-            users = result.scalars().all()
-            
-            if not users:
-                return
-                
+    @staticmethod
+    def server_row(server: Server) -> list:
+        return [
+            str(server.id),
+            str(server.name),
+            str(server.url),
+            str(server.is_active),
+            str(server.is_default),
+            str(server.created_at.strftime('%d.%m.%Y')),
+            str(server.description) if server.description else ""
+        ]
 
-            # Очищаем и устанавливаем заголовки
-            self.clear_sheet(sheet_users, "Users")
-            self.setup_headers(sheet_users, self.headers_users, "Users")
-            
-            # Подготавливаем данные для массовой записи
-            rows_data = []
-            for user in users:
-                row = [
-                    str(user.id),
-                    str(user.telegram_id),
-                    str(user.username) if user.username else "",
-                    str(user.balance),
-                    str(user.created_at),
-                    str(user.subscription_start.strftime('%d.%m.%Y')) if user.subscription_start else "",
-                    str(user.subscription_end.strftime('%d.%m.%Y')) if user.subscription_end else "",
-                    str(user.is_active),
-                    user.vpn_link if user.vpn_link else "",
-                    str(user.server_id) if user.server_id else "",
-                    str(user.trial_used)
-                ]
-                rows_data.append(row)
-            
-            # Массовая запись всех пользователей
-            if rows_data:
+    async def _load_watermark(self, session, name: str) -> SyncWatermark:
+        watermark = await session.get(SyncWatermark, name)
+        if watermark is None:
+            watermark = SyncWatermark(name=name)
+            session.add(watermark)
+        return watermark
 
-                # Записываем пачками по 100 строк для избежания лимитов API
-                batch_size = 100
-                for i in range(0, len(rows_data), batch_size):
-                    batch = rows_data[i:i + batch_size]
-                    sheet_users.append_rows(batch)
+    async def rebuild_table(self, name: str):
+        """Полностью перезаписывает лист из БД"""
+        model, headers, make_row = self.tables[name]
+        sheet = await open_sheet(name)
+        started = datetime.utcnow()
 
+        async with read_session() as session:
+            result = await session.execute(select(model).order_by(model.id))
+            rows = [make_row(item) for item in result.scalars().all()]
 
-    async def sync_payments(self):
-        """Синхронизирует все платежи"""
+        await sheets_writer.run(_rebuild_sheet, sheet, headers, rows, key=sheet.id)
 
         async with async_session() as session:
-            # Получаем все платежи
-            result = await session.execute(select(Payment).order_by(Payment.id))
-            payments = result.scalars().all()
-            
-            if not payments:
-                return
-                
+            watermark = await self._load_watermark(session, name)
+            # Все, что изменится после начала выгрузки, подхватит следующая дельта
+            watermark.watermark = started
+            watermark.last_full_sync = started
+            await session.commit()
 
-            # Очищаем и устанавливаем заголовки
-            self.clear_sheet(sheet_payments, "Payments")
-            self.setup_headers(sheet_payments, self.headers_payments, "Payments")
-            
-            # Подготавливаем данные для массовой записи
-            rows_data = []
-            for payment in payments:
-                row = [
-                    str(payment.id),
-                    str(payment.user_id),
-                    payment.amount if payment.amount else "",
-                    str(payment.payment_id) if payment.payment_id else "",
-                    str(payment.status),
-                    str(payment.created_at.strftime('%d.%m.%Y')),
-                    str(payment.completed_at.strftime('%d.%m.%Y')) if payment.completed_at else "",
-                    str(payment.nickname) if payment.nickname else "",
-                    str(payment.message) if payment.message else "",
-                    str(payment.pay_system) if payment.pay_system else ""
-                ]
-                rows_data.append(row)
-            
-            # Массовая запись всех платежей
-            if rows_data:
+    async def delta_table(self, name: str) -> tuple:
+        """Выгружает строки, измененные после отметки; без отметки - полная перезапись"""
+        model, headers, make_row = self.tables[name]
+        sheet = await open_sheet(name)
 
-                # Записываем пачками по 100 строк
-                batch_size = 100
-                for i in range(0, len(rows_data), batch_size):
-                    batch = rows_data[i:i + batch_size]
-                    sheet_payments.append_rows(batch)
+        async with async_session() as session:
+            watermark = await self._load_watermark(session, name)
+            since = watermark.watermark
+            await session.commit()
+        if since is None:
+            await self.rebuild_table(name)
+            return 0, 0
 
+        async with read_session() as session:
+            result = await session.execute(
+                select(model)
+                .where(model.updated_at > since - WATERMARK_OVERLAP)
+                .order_by(model.id)
+            )
+            items = result.scalars().all()
 
-    async def sync_servers(self):
-        """Синхронизирует все серверы"""
+        if not items:
+            return 0, 0
+        new_watermark = max(item.updated_at for item in items)
+        counts = await sheets_writer.run(_upsert_rows, sheet, headers, [make_row(item) for item in items], key=sheet.id)
 
         async with async_session() as session:
-            # Получаем все серверы
-            result = await session.execute(select(Server).order_by(Server.id))
-            servers = result.scalars().all()
-            
-            if not servers:
-                print("📭 Серверы не найдены")
-                return
-                
-
-            # Очищаем и устанавливаем заголовки
-            self.clear_sheet(sheet_servers, "Servers")
-            self.setup_headers(sheet_servers, self.headers_servers, "Servers")
-            
-            # Подготавливаем данные для массовой записи
-            rows_data = []
-            for server in servers:
-                row = [
-                    str(server.id),
-                    str(server.name),
-                    str(server.url),
-                    str(server.is_active),
-                    str(server.is_default),
-                    str(server.created_at.strftime('%d.%m.%Y')),
-                    str(server.description) if server.description else ""
-                ]
-                rows_data.append(row)
-            
-            # Массовая запись всех серверов
-            if rows_data:
-                sheet_servers.append_rows(rows_data)
+            watermark = await self._load_watermark(session, name)
+            watermark.watermark = max(new_watermark, since)
+            await session.commit()
+        return counts
 
-    async def get_database_stats(self):
-        """Получает статистику базы данных"""
+    async def delta_sync(self, full_rebuild_after: Optional[timedelta] = None) -> dict:
+        """
+        Инкрементальная синхронизация всех листов.
+        Если с последней полной перезаписи прошло больше full_rebuild_after, лист перезаписывается целиком
+        """
+        results = {}
+        for name in self.tables:
+            if full_rebuild_after:
+                async with async_session() as session:
+                    watermark = await self._load_watermark(session, name)
+                    last_full_sync = watermark.last_full_sync
+                    await session.commit()
+                if last_full_sync is None or datetime.utcnow() - last_full_sync > full_rebuild_after:
+                    await self.rebuild_table(name)
+                    results[name] = 'rebuilt'
+                    continue
+            results[name] = await self.delta_table(name)
+        return results
 
-        async with async_session() as session:
-            # Пользователи
-            users_result = await session.execute(select(User))
-            users_count = len(users_result.scalars().all())
-            
-            # Активные пользователи
-            active_users_result = await session.execute(select(User).where(User.is_active == True))
-            active_users_count = len(active_users_result.scalars().all())
-            
-            # Пользователи с VPN
-            vpn_users_result = await session.execute(select(User).where(User.vpn_link.isnot(None)))
-            vpn_users_count = len(vpn_users_result.scalars().all())
-            
-            # Платежи
-            payments_result = await session.execute(select(Payment))
-            payments_count = len(payments_result.scalars().all())
-            
-            # Серверы
-            servers_result = await session.execute(select(Server))
-            servers_count = len(servers_result.scalars().all())
+    async def sync_users(self):
+        """Синхронизирует всех пользователей"""
+        await self.rebuild_table(USERS)
+
+    async def sync_payments(self):
+        """Синхронизирует все платежи"""
+        await self.rebuild_table(PAYMENTS)
 
+    async def sync_servers(self):
+        """Синхронизирует все серверы"""
+        await self.rebuild_table(SERVERS)
 
     async def full_sync(self):
         """Выполняет полную синхронизацию"""
         
         try:
-            # Показываем статистику
-            await self.get_database_stats()
-            
             # Синхронизируем все данные
             await self.sync_users()
             await self.sync_payments()
@@ -228,18 +254,24 @@ async def main():
     print("📋 СКРИПТ СИНХРОНИЗАЦИИ БАЗЫ ДАННЫХ С GOOGLE SHEETS")
     print("=" * 60)
     
+    if "--delta" in sys.argv:
+        results = await SheetsSync().delta_sync()
+        print(f"✅ Инкрементальная синхронизация: {results}")
+        return
+
     # Проверяем доступность Google Sheets
     try:
         print("🔗 Проверяю подключение к Google Sheets...")
-        spreadsheet = client.open_by_key(spreadsheets_id)
+        client = await sheets_writer.run(get_client)
+        spreadsheet = await sheets_writer.run(client.open_by_key, spreadsheets_id)
         print(f"✅ Подключение установлено: {spreadsheet.title}")
     except Exception as e:
         print(f"❌ Ошибка подключения к Google Sheets: {e}")
         return
     
     # Запрашиваем подтверждение
-    print("\n⚠️  ВНИМАНИЕ: Этот скрипт полностью очистит все данные в Google Sheets")
-    print("   и запишет их заново из базы данных.")
+    print("\n⚠️  ВНИМАНИЕ: Этот скрипт полностью перезапишет данные в Google Sheets")
+    print("   из базы данных. Для выгрузки только изменений используйте --delta.")
     
     if len(sys.argv) > 1 and sys.argv[1] == "--force":
         confirm = "y"
@@ -0,0 +1,32 @@
+import pytest
+from contextlib import contextmanager
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Проверяет бюджет SQL-запросов для обработчика или сервиса:
+
+        with query_budget("check_payment", max_queries=5):
+            await check_payment(callback)
+    """
+    from db.database import engine
+    from db.query_profiler import query_profiler
+
+    attached = query_profiler.attach(engine)
+
+    @contextmanager
+    def budget(name: str, max_queries: int, max_repeats: int = None):
+        with query_profiler.scope(name) as run:
+            yield run
+        assert run.queries <= max_queries, (
+            f"{name}: выполнено {run.queries} запросов при бюджете {max_queries}"
+        )
+        if max_repeats is not None:
+            repeated = run.repeated(max_repeats + 1)
+            assert not repeated, f"{name}: повторяющиеся запросы (N+1): {repeated}"
+
+    yield budget
+
+    if attached:
+        query_profiler.detach(engine)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тест пакетного заполнения: пакеты по ключу, продолжение с чекпоинта,
+пробный прогон на базе без колонок, которые добавит миграция
+"""
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import db.migrations.backfill as backfill_module
+from db.migrations.backfill import Backfill
+
+
+async def sqlite_state(session) -> dict:
+    """Состояние схемы для preflight: information_schema в SQLite нет"""
+    def collect(sync_session):
+        inspector = inspect(sync_session.connection())
+        tables = inspector.get_table_names()
+        columns = [column['name'] for column in inspector.get_columns('users')] if 'users' in tables else []
+        return {'tables': tables, 'user_column_names': columns}
+    return await session.run_sync(collect)
+
+
+@pytest_asyncio.fixture
+async def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill_module, 'collect_production_state', sqlite_state)
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/backfill.db")
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, vpn_link TEXT)"))
+        await conn.execute(text(
+            "INSERT INTO users (id, vpn_link) VALUES " + ", ".join(f"({i}, 'vless://{i}')" for i in range(1, 26))
+        ))
+    yield sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+
+def make_backfill(sessions, **kwargs) -> Backfill:
+    return Backfill(
+        name='test.trial_used', table='users', set_sql="trial_used = TRUE",
+        where_sql="trial_used = FALSE AND vpn_link IS NOT NULL",
+        requires_columns=['trial_used', 'vpn_link'], adds_columns=['trial_used'],
+        base_where_sql="vpn_link IS NOT NULL", batch_size=10, pause=0, session_factory=sessions, **kwargs
+    )
+
+
+async def add_trial_used(sessions):
+    async with sessions() as session:
+        await session.execute(text("ALTER TABLE users ADD COLUMN trial_used BOOLEAN NOT NULL DEFAULT FALSE"))
+        await session.commit()
+
+
+async def scalar(sessions, sql: str):
+    async with sessions() as session:
+        return (await session.execute(text(sql))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_dry_run_before_alter_changes_nothing(sessions):
+    estimate = await make_backfill(sessions).estimate()
+
+    assert estimate['pending_columns'] == ['trial_used']
+    assert (estimate['rows_to_update'], estimate['batches']) == (25, 3)
+    # Ни колонки, ни таблицы чекпоинтов пробный прогон не создал
+    assert await scalar(sessions, "SELECT COUNT(*) FROM sqlite_master WHERE name = 'migration_checkpoints'") == 0
+    with pytest.raises(RuntimeError):
+        await make_backfill(sessions).run()
+
+
+@pytest.mark.asyncio
+async def test_batches_and_dry_run_after_alter(sessions):
+    await add_trial_used(sessions)
+    async with sessions() as session:
+        await session.execute(text("UPDATE users SET vpn_link = NULL WHERE id IN (3, 17)"))
+        await session.commit()
+
+    estimate = await make_backfill(sessions).estimate()
+    assert estimate['pending_columns'] == []
+    assert (estimate['rows_to_update'], estimate['batches']) == (23, 3)
+    # Пробный пакет откатывается
+    assert await scalar(sessions, "SELECT COUNT(*) FROM users WHERE trial_used = TRUE") == 0
+
+    assert await make_backfill(sessions).run() == 23
+    assert await scalar(sessions, "SELECT COUNT(*) FROM users WHERE trial_used = TRUE") == 23
+    assert await scalar(sessions, "SELECT last_key FROM migration_checkpoints") == 25
+
+
+@pytest.mark.asyncio
+async def test_resume_from_checkpoint_and_new_rows(sessions):
+    await add_trial_used(sessions)
+    backfill = make_backfill(sessions)
+
+    # Падение после первого пакета: его итог и чекпоинт уже зафиксированы
+    apply_batch = backfill._apply_batch
+    calls = []
+
+    async def failing_apply(session, last_key, upper_key):
+        if calls:
+            raise RuntimeError("connection lost")
+        calls.append(upper_key)
+        return await apply_batch(session, last_key, upper_key)
+
+    backfill._apply_batch = failing_apply
+    with pytest.raises(RuntimeError):
+        await backfill.run()
+    assert await scalar(sessions, "SELECT last_key FROM migration_checkpoints") == 10
+
+    # Повторный запуск продолжает с id > 10
+    resumed = make_backfill(sessions)
+    assert await resumed.run() == 25
+    assert await scalar(sessions, "SELECT COUNT(*) FROM users WHERE trial_used = FALSE") == 0
+
+    # После завершения повторный запуск обновляет только новые строки
+    async with sessions() as session:
+        await session.execute(text("INSERT INTO users (id, vpn_link) VALUES (26, 'vless://26'), (27, NULL)"))
+        await session.commit()
+    assert (await make_backfill(sessions).estimate())['rows_to_update'] == 1
+    assert await make_backfill(sessions).run() == 26
+    assert await scalar(sessions, "SELECT trial_used FROM users WHERE id = 26") == 1
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Тест рассылок: темп и RetryAfter, отметка заблокировавших бота,
+пауза из другого процесса, продолжение после падения и повторы после RetryAfter
+"""
+
+import asyncio
+from collections import Counter
+
+import pytest
+import pytest_asyncio
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from bot.broadcast import BroadcastEngine, SendPacer, DONE, PAUSED, RUNNING, PENDING, MAX_ATTEMPTS
+from db.models import Base, User
+
+USERS = list(range(1001, 1021))
+BLOCKED = {1003, 1011}
+
+
+class FakeBot:
+    def __init__(self, hang_on: int = None):
+        self.delivered = Counter()
+        self.edits = []
+        self.retried = False
+        self.hang_on = hang_on
+        self.hanging = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def send_message(self, chat_id, text):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in BLOCKED:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if chat_id == 1007 and not self.retried:
+            self.retried = True
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        if chat_id == self.hang_on:
+            self.hang_on = None
+            self.hanging.set()
+            await self.release.wait()
+        self.delivered[chat_id] += 1
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        self.edits.append(text)
+
+
+@pytest_asyncio.fixture
+async def sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/broadcast.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with factory() as session:
+        session.add_all(User(telegram_id=telegram_id, username=f"user{telegram_id}") for telegram_id in USERS)
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+def make_engine(sessions, **kwargs):
+    options = dict(session_factory=sessions, rate=1000, concurrency=4, batch_size=5, progress_interval=0)
+    options.update(kwargs)
+    return BroadcastEngine(**options)
+
+
+@pytest.mark.asyncio
+async def test_pacer_keeps_rate_and_pauses():
+    now = [0.0]
+
+    async def sleep(seconds):
+        now[0] += seconds
+
+    pacer = SendPacer(rate=10, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        await pacer.wait()
+    assert now[0] == pytest.approx(0.4)
+    pacer.pause(3)
+    await pacer.wait()
+    assert now[0] == pytest.approx(3.4)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_sends_once_and_marks_blocked(sessions):
+    engine = make_engine(sessions)
+    bot = FakeBot()
+    broadcast = await engine.create("Привет", admin_chat_id=1, admin_message_id=2)
+    assert broadcast.total == len(USERS)
+
+    await engine.run(broadcast.id, bot)
+
+    assert set(bot.delivered) == set(USERS) - BLOCKED
+    assert set(bot.delivered.values()) == {1}
+    broadcast = await engine.get(broadcast.id)
+    assert (broadcast.status, broadcast.sent, broadcast.blocked, broadcast.failed) == (DONE, 18, 2, 0)
+    assert broadcast.owner is None
+    assert bot.edits[-1].startswith("✅ Рассылка завершена")
+
+    async with sessions() as session:
+        result = await session.execute(select(User.telegram_id).where(User.bot_blocked_at.isnot(None)))
+        assert set(result.scalars()) == BLOCKED
+    # Заблокировавшие бота в следующую рассылку не попадают
+    assert (await engine.create("Еще раз")).total == len(USERS) - len(BLOCKED)
+
+
+@pytest.mark.asyncio
+async def test_pause_from_other_process_and_resume_after_crash(sessions):
+    sender = make_engine(sessions, concurrency=1)
+    other = make_engine(sessions, concurrency=1)
+    bot = FakeBot(hang_on=1008)
+    broadcast = await sender.create("Новости")
+
+    # Пауза из другого процесса: отправитель доделывает пакет и останавливается
+    task = asyncio.create_task(sender.run(broadcast.id, bot))
+    await bot.hanging.wait()
+    assert await other.set_status(broadcast.id, PAUSED)
+    bot.release.set()
+    await task
+    paused = await other.get(broadcast.id)
+    assert paused.status == PAUSED and paused.sent + paused.blocked == 10
+
+    # Продолжение, затем остановка процесса посреди пакета
+    assert await other.set_status(broadcast.id, RUNNING)
+    bot.hang_on, bot.hanging, bot.release = 1014, asyncio.Event(), asyncio.Event()
+    assert sender.start(broadcast.id, bot)
+    await bot.hanging.wait()
+    await sender.close()
+
+    # Следующий запуск подхватывает рассылку с неотправленных получателей
+    assert await other.resume(bot) == [broadcast.id]
+    await asyncio.wait(list(other.tasks.values()))
+
+    assert set(bot.delivered) == set(USERS) - BLOCKED
+    assert set(bot.delivered.values()) == {1}
+    finished = await other.get(broadcast.id)
+    assert (finished.status, finished.sent, finished.blocked) == (DONE, 18, 2)
+
+
+class FloodBot:
+    """Отвечает RetryAfter на первые floods отправок"""
+
+    def __init__(self, floods: int):
+        self.floods = floods
+        self.delivered = []
+
+    async def send_message(self, chat_id, text):
+        if self.floods:
+            self.floods -= 1
+            raise TelegramRetryAfter(method=SendMessage(chat_id=chat_id, text=text),
+                                     message="Too Many Requests", retry_after=0)
+        self.delivered.append(chat_id)
+
+
+@pytest.mark.asyncio
+async def test_retry_after_does_not_use_up_attempts(sessions):
+    engine = make_engine(sessions)
+    broadcast = await engine.create("Привет")
+
+    bot = FloodBot(floods=MAX_ATTEMPTS + 2)
+    assert await engine._send_one(bot, broadcast, USERS[0]) == ('sent', None)
+    assert bot.delivered == [USERS[0]]
+
+    # Если рассылку остановили во время RetryAfter, получатель остается в очереди
+    engine.stopping.add(broadcast.id)
+    assert await engine._send_one(FloodBot(floods=1), broadcast, USERS[1]) == (PENDING, None)
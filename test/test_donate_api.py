@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Тест клиента WATA: повтор при 5xx и общая пауза после 429
+"""
+
+import httpx
+import pytest
+
+import bot.donate_api as donate_api
+from bot.donate_api import DonateApi, RateLimiter
+
+
+def install_transport(monkeypatch, handler):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(donate_api, '_client', client)
+    monkeypatch.setattr(donate_api, 'wata_limiter', RateLimiter())
+    monkeypatch.setattr(donate_api, 'WATA_MAX_RETRIES', 2)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_retries_server_errors(monkeypatch):
+    """Две ошибки 502 подряд не мешают создать ссылку"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) < 3:
+            return httpx.Response(502)
+        return httpx.Response(200, json={'id': 'link-1', 'status': 'Opened'})
+
+    install_transport(monkeypatch, handler)
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(donate_api.asyncio, 'sleep', no_sleep)
+
+    api = DonateApi()
+    api.base_url = 'http://wata.test'
+    response = await api.create_donate_url(payment_id=1, amount=100)
+    assert response == {'id': 'link-1', 'status': 'Opened'}
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_is_shared(monkeypatch):
+    """После 429 с Retry-After следующие проверки не отправляются, пока пауза не истечет"""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(429, headers={'Retry-After': '60'})
+
+    install_transport(monkeypatch, handler)
+
+    api = DonateApi()
+    api.base_url = 'http://wata.test'
+    assert await api.find_donate_url('link-1') == {'status': 'Time'}
+    assert await api.find_donate_url('link-2') == {'status': 'Time'}
+    assert calls == ['/links/link-1']
+    assert donate_api.wata_limiter.remaining() > 50
+
+    # Создание ссылки не ждет минуту, а сразу сообщает об ошибке
+    assert await api.create_donate_url(payment_id=2) is None
+    assert len(calls) == 1
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тест выгрузки таблиц: повторный запуск дописывает только новые строки
+"""
+
+import csv
+import gzip
+import os
+
+import pytest
+from sqlalchemy import delete
+
+from db.database import engine, async_session
+from db.export import TableExporter, last_exported_id
+from db.models import Base, Server
+
+
+def read_parts(directory):
+    rows = []
+    for name in sorted(os.listdir(directory)):
+        with gzip.open(os.path.join(directory, name), 'rt', newline='') as file:
+            rows.extend(csv.DictReader(file))
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_csv_export_is_incremental(tmp_path):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    ids = []
+    try:
+        async with async_session() as session:
+            servers = [Server(name=f"test_export_{i}", url=f"http://export{i}") for i in range(3)]
+            session.add_all(servers)
+            await session.commit()
+            ids += [server.id for server in servers]
+
+        exporter = TableExporter(str(tmp_path), 'csv', batch=2, rows_per_file=2)
+        async with async_session() as session:
+            total, files = await exporter.export_table(session, 'servers')
+        directory = tmp_path / 'servers'
+        assert total >= 3
+        assert len(files) == (total + 1) // 2
+        assert last_exported_id(directory) == ids[-1]
+
+        async with async_session() as session:
+            server = Server(name="test_export_new", url="http://export-new")
+            session.add(server)
+            await session.commit()
+            ids.append(server.id)
+
+        async with async_session() as session:
+            total, files = await exporter.export_table(session, 'servers')
+        assert total == 1
+        rows = read_parts(directory)
+        assert [row['id'] for row in rows][-1] == str(ids[-1])
+        assert len({row['id'] for row in rows}) == len(rows)
+        assert not [name for name in os.listdir(directory) if name.startswith('.tmp')]
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Server).where(Server.id.in_(ids)))
+            await session.commit()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тест локальной замены Google Sheets: синхронизация и сверка без creds.json,
+подсчет вызовов API, имитация квоты и лимитов записи
+"""
+
+import math
+
+import pytest
+from gspread.exceptions import APIError
+
+from sheets import sheets_service
+from sheets.bench_sync import run_benchmark
+from sheets.fake_sheets import FakeClient, DEFAULT_ROWS
+from sheets.sync_to_sheets import REBUILD_BATCH_SIZE
+
+
+def test_fake_worksheet_calls_and_quota():
+    client = FakeClient(quota=4)
+    sheet = client.spreadsheet.worksheet('Users')
+    sheet.update([['id', 'name'], [1, 'a']], 'A1')
+    sheet.append_rows([[2, 'b'], [3, 'c']])
+    assert sheet.get_all_records() == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}]
+
+    with pytest.raises(APIError) as error:
+        sheet.batch_update([{'range': 'B2', 'values': [['z']]}])
+    assert error.value.code == 429
+    assert client.calls['quota_errors'] == 1
+    assert client.total_calls == 4  # worksheet, update, append_rows, get_all_records
+
+
+def test_fake_worksheet_write_limits():
+    client = FakeClient(max_payload=1000)
+    sheet = client.spreadsheet.worksheet('Users')
+
+    # update не расширяет сетку, в отличие от append_rows
+    with pytest.raises(APIError) as error:
+        sheet.update([[1]], f'A{DEFAULT_ROWS + 1}')
+    assert error.value.code == 400
+    sheet.add_rows(1)
+    sheet.update([[1]], f'A{DEFAULT_ROWS + 1}')
+    with pytest.raises(APIError):
+        sheet.update([[1] * 27], 'A1')
+
+    # Слишком большой запрос отклоняется целиком
+    with pytest.raises(APIError) as error:
+        sheet.update([['x' * 100]] * 20, 'A1')
+    assert error.value.code == 400
+    assert sheet.get('A1:A2') == []
+
+    sheet.append_rows([[i] for i in range(5)])
+    assert sheet.row_count == DEFAULT_ROWS + 6
+
+
+@pytest.mark.asyncio
+async def test_sync_benchmark_runs_offline():
+    users = DEFAULT_ROWS + 200
+    try:
+        results = await run_benchmark(users)
+    finally:
+        sheets_service.set_client(None)
+
+    # Полная перезапись - открытие листа, чтение ключей, расширение сетки и запись пачками
+    assert results['rebuild']['calls'] <= 5 + math.ceil((users + 1) / REBUILD_BATCH_SIZE)
+    # Изменения: чтение колонки id и один batch_update
+    assert results['delta']['calls'] <= 3
+    assert results['check']['calls'] >= 1
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Тест хранилища FSM в БД: состояние переживает перезапуск, чтения идут из кэша,
+записи не зависят от кэша другой реплики, устаревшие состояния сбрасываются
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import update
+
+from db.database import engine, async_session
+from db.models import Base, FsmState
+import bot.fsm_storage as fsm_storage
+from bot.fsm_storage import DatabaseStorage, storage_key
+
+
+class Form(StatesGroup):
+    name = State()
+
+
+class CountingSessions:
+    def __init__(self):
+        self.opened = 0
+
+    def __call__(self):
+        self.opened += 1
+        return async_session()
+
+
+KEY = StorageKey(bot_id=1, chat_id=990001, user_id=990001)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def tables():
+    # В рабочей базе таблицу создает db/migrations/add_fsm_states.py
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart_and_reads_are_cached():
+    sessions = CountingSessions()
+    storage = DatabaseStorage(session_factory=sessions, cache_ttl=60)
+    await storage.set_state(KEY, Form.name)
+    await storage.update_data(KEY, {'server_id': 5})
+
+    opened = sessions.opened
+    assert await storage.get_state(KEY) == Form.name.state
+    assert await storage.get_data(KEY) == {'server_id': 5}
+    assert sessions.opened == opened
+
+    # Новый экземпляр (перезапуск или другая реплика) читает из БД
+    restarted = DatabaseStorage()
+    assert await restarted.get_state(KEY) == Form.name.state
+    assert await restarted.get_data(KEY) == {'server_id': 5}
+
+    await restarted.set_state(KEY, None)
+    await restarted.set_data(KEY, {})
+    assert await DatabaseStorage().get_state(KEY) is None
+
+
+@pytest.mark.asyncio
+async def test_stale_state_expires():
+    key = StorageKey(bot_id=1, chat_id=990002, user_id=990002)
+    storage = DatabaseStorage(state_ttl=3600, cache_ttl=0)
+    await storage.set_state(key, Form.name)
+    await storage.set_data(key, {'page': 2})
+
+    async with async_session() as session:
+        await session.execute(
+            update(FsmState)
+            .where(FsmState.key == storage_key(key))
+            .values(updated_at=datetime.utcnow() - timedelta(hours=2))
+        )
+        await session.commit()
+
+    assert await storage.get_state(key) is None
+    # Запись поверх устаревшего состояния не возвращает старые данные
+    await storage.set_state(key, Form.name)
+    assert await storage.get_data(key) == {}
+
+    async with async_session() as session:
+        await session.execute(
+            update(FsmState)
+            .where(FsmState.key == storage_key(key))
+            .values(updated_at=datetime.utcnow() - timedelta(hours=2))
+        )
+        await session.commit()
+    assert await storage.cleanup() >= 1
+
+
+@pytest.mark.asyncio
+async def test_writes_do_not_use_stale_cache_of_other_replica():
+    key = StorageKey(bot_id=1, chat_id=990003, user_id=990003)
+    first = DatabaseStorage(cache_ttl=60)
+    second = DatabaseStorage(cache_ttl=60)
+    # Вторая реплика успела закэшировать пустое состояние
+    assert await second.get_data(key) == {}
+
+    await first.set_state(key, Form.name)
+    await first.update_data(key, {'server_id': 5})
+
+    # Запись второй реплики строится по строке из БД, а не по своему кэшу
+    assert await second.update_data(key, {'page': 2}) == {'server_id': 5, 'page': 2}
+    await second.set_state(key, None)
+    assert await DatabaseStorage().get_data(key) == {'server_id': 5, 'page': 2}
+
+    await first.set_data(key, {})
+    assert await DatabaseStorage().get_data(key) == {}
+
+
+def test_cache_disabled_for_several_processes(monkeypatch):
+    monkeypatch.setattr(fsm_storage, 'BOT_REPLICAS', 1)
+    monkeypatch.setattr(fsm_storage, 'UPDATE_WORKERS', 0)
+    monkeypatch.setattr(fsm_storage, 'BOT_MODE', 'polling')
+    assert fsm_storage.create_storage().cache_ttl == fsm_storage.FSM_CACHE_TTL
+    monkeypatch.setattr(fsm_storage, 'BOT_REPLICAS', 2)
+    assert fsm_storage.create_storage().cache_ttl == 0
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Тест метрик: формат Prometheus, метки обработчиков только из известных
+команд и callback_data, замер обработчиков,
+запросов к внешним сервисам и к БД
+"""
+
+import httpx
+import pytest
+from aiogram import types
+from sqlalchemy import text
+
+from bot.metrics import Registry, TimedTransport, callback_label, message_label, registry, \
+    handler_duration, handler_in_flight, handler_errors, external_duration, db_query_duration, attach_databases
+from bot.middleware import HandlerMetricsMiddleware
+from db.database import async_session
+
+
+def test_render_prometheus_text():
+    local = Registry()
+    requests = local.counter('requests_total', 'Запросы', ('path',))
+    latency = local.histogram('latency_seconds', 'Время', ('path',), buckets=(0.1, 1.0))
+    requests.inc('/a"b')
+    latency.observe(0.05, '/a')
+    latency.observe(0.5, '/a')
+
+    assert local.render().splitlines() == [
+        '# HELP requests_total Запросы',
+        '# TYPE requests_total counter',
+        'requests_total{path="/a\\"b"} 1',
+        '# HELP latency_seconds Время',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{path="/a",le="0.1"} 1',
+        'latency_seconds_bucket{path="/a",le="1.0"} 2',
+        'latency_seconds_bucket{path="/a",le="+Inf"} 2',
+        'latency_seconds_sum{path="/a"} 0.55',
+        'latency_seconds_count{path="/a"} 2',
+    ]
+
+
+def test_labels():
+    # Команды и callback_data регистрирует диспетчер по фильтрам обработчиков
+    import bot.dispatcher  # noqa: F401
+
+    assert callback_label('check_payment:9f1c') == 'check_payment'
+    assert callback_label('admin_user_15_2') == 'admin_user'
+    assert callback_label('pay_amount_100.0') == 'pay_amount'
+    assert callback_label('admin_list_users_page_3') == 'admin_list_users_page'
+    assert callback_label('edit_server_desc_7') == 'edit_server_desc'
+    assert callback_label('configs') == 'configs'
+    assert message_label('/start ref_123') == '/start'
+    assert message_label('/home@vpn_bot') == '/home'
+    assert message_label('привет') == 'message'
+    # Произвольные команды и подделанные callback_data не создают новых серий
+    assert {message_label(f'/a{i}') for i in range(100)} == {'other'}
+    assert {callback_label(f'forged_{i}') for i in range(100)} == {'other'}
+    assert callback_label('configs_x') == 'other'
+
+
+@pytest.mark.asyncio
+async def test_handler_middleware_records_time_and_errors():
+    middleware = HandlerMetricsMiddleware()
+    callback = types.CallbackQuery(
+        id='1', chat_instance='1', data='metrics_test_42',
+        from_user=types.User(id=1, is_bot=False, first_name='Test')
+    )
+    labels = ('callback_query', 'other')
+    before_duration = handler_duration.count(*labels)
+    before_errors = handler_errors.get(*labels, 'ValueError')
+
+    async def handler(event, data):
+        assert handler_in_flight.get(*labels) == 1
+        return 'done'
+
+    async def failing(event, data):
+        raise ValueError('boom')
+
+    assert await middleware(handler, callback, {}) == 'done'
+    with pytest.raises(ValueError):
+        await middleware(failing, callback, {})
+
+    assert handler_duration.count(*labels) == before_duration + 2
+    assert handler_in_flight.get(*labels) == 0
+    assert handler_errors.get(*labels, 'ValueError') == before_errors + 1
+
+
+@pytest.mark.asyncio
+async def test_external_and_db_timings():
+    transport = TimedTransport('wata', base_url='https://wata.test/api/h2h',
+                               transport=httpx.MockTransport(lambda request: httpx.Response(201)))
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.post('https://wata.test/api/h2h/links/abc', json={})
+    assert external_duration.count('wata', 'POST links', '201') == 1
+
+    # Точки входа подключают замеры движков сами; повторный вызов не удваивает их
+    attach_databases()
+    attach_databases()
+    before = db_query_duration.count('primary', 'SELECT')
+    async with async_session() as session:
+        await session.execute(text('SELECT 1'))
+    assert db_query_duration.count('primary', 'SELECT') == before + 1
+    assert 'db_query_duration_seconds_bucket{engine="primary",operation="SELECT"' in registry.render()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Тест зачисления платежа: параллельные проверки и возврат денег при ошибке панели
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, delete
+
+import bot.payment_processing as payment_processing
+from config.config import VPN_PRICE
+from db.database import engine, async_session
+from db.models import Base, User, Payment
+from db.service.user_service import renew_subscription
+
+
+@pytest_asyncio.fixture
+async def open_payment():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        user = User(telegram_id=770201, username="test_crediting_user", balance=0.0, is_active=False)
+        session.add(user)
+        await session.commit()
+        payment = Payment(user_id=user.id, status='Opened', payment_id='crediting-link')
+        session.add(payment)
+        await session.commit()
+
+    yield user, payment
+
+    async with async_session() as session:
+        await session.execute(delete(Payment).where(Payment.user_id == user.id))
+        await session.execute(delete(User).where(User.id == user.id))
+        await session.commit()
+
+
+async def load_user(user_id):
+    async with async_session() as session:
+        return (await session.execute(select(User).where(User.id == user_id))).scalar_one()
+
+
+@pytest.mark.asyncio
+async def test_parallel_checks_credit_once(open_payment):
+    """Две одновременные проверки одного платежа зачисляют его один раз"""
+    user, payment = open_payment
+
+    async def check():
+        async with async_session() as session:
+            return await payment_processing.complete_payment(session, payment, 10.0)
+
+    results = await asyncio.gather(check(), check())
+    assert sorted(r['status'] for r in results) == ['already_processed', 'insufficient']
+    assert (await load_user(user.id)).balance == 10.0
+
+
+@pytest.mark.asyncio
+async def test_panel_failure_refunds(open_payment, monkeypatch):
+    """Если панель не продлила конфиг, деньги и прежний срок подписки возвращаются"""
+    user, payment = open_payment
+    renew_calls = []
+
+    async def failing_renew(self, user, subscription_days=None, new_expire_ts=None):
+        renew_calls.append(user.id)
+        return False
+
+    monkeypatch.setattr(payment_processing.VPNManager, 'renew_subscription', failing_renew)
+    monkeypatch.setattr(payment_processing.VPNManager, '__init__', lambda self, session: None)
+
+    async with async_session() as session:
+        result = await payment_processing.complete_payment(session, payment, float(VPN_PRICE))
+    async with async_session() as session:
+        again = await payment_processing.complete_payment(session, payment, float(VPN_PRICE))
+
+    assert result['status'] == 'vpn_failed'
+    assert again['status'] == 'already_processed'
+    assert renew_calls == [user.id]
+
+    user = await load_user(user.id)
+    assert user.balance == float(VPN_PRICE)
+    assert user.subscription_end is None
+    assert user.is_active is False
+
+
+@pytest.mark.asyncio
+async def test_refund_keeps_parallel_extension(open_payment, monkeypatch):
+    """Возврат вычитает только свой период: продление другим платежом между шагами сохраняется"""
+    user, payment = open_payment
+
+    async def renew_elsewhere_then_fail(self, user, subscription_days=None, new_expire_ts=None):
+        async with async_session() as session:
+            await renew_subscription(session, user.id, 30, price=0)
+        return False
+
+    monkeypatch.setattr(payment_processing.VPNManager, 'renew_subscription', renew_elsewhere_then_fail)
+    monkeypatch.setattr(payment_processing.VPNManager, '__init__', lambda self, session: None)
+
+    async with async_session() as session:
+        result = await payment_processing.complete_payment(session, payment, float(VPN_PRICE))
+
+    assert result['status'] == 'vpn_failed'
+    user = await load_user(user.id)
+    assert user.balance == float(VPN_PRICE)
+    assert user.is_active is True
+    # Остались 30 дней параллельного продления
+    assert abs(user.subscription_end - (datetime.utcnow() + timedelta(days=30))) < timedelta(minutes=1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Тест заранее созданных платежных ссылок: переиспользование и истечение
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, update, delete
+
+import bot.payment_links as payment_links_module
+from bot.payment_links import PaymentLinkCache, PREPARED_LINK_TTL
+from bot.payment_poller import PaymentPoller
+from bot.payment_processing import OPENED_STATUS, PAID_STATUS, EXPIRED_STATUS, PREPARED_STATUS
+from config.config import VPN_PRICE, VPN_PRICE_3
+from db.database import engine, async_session
+from db.models import Base, User, Payment
+
+
+@pytest.mark.asyncio
+async def test_prefetched_link_is_reused(monkeypatch):
+    """Ссылка создается при открытии меню, выбор тарифа ее использует без запроса в WATA"""
+    created = []
+
+    async def fake_create(self, payment_id, amount):
+        created.append(payment_id)
+        return {'id': f'link-{payment_id}', 'url': f'https://pay.test/{payment_id}', 'status': OPENED_STATUS}
+
+    monkeypatch.setattr(payment_links_module.DonateApi, 'create_donate_url', fake_create)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    tg_user = SimpleNamespace(id=770301, username="test_links_user")
+    cache = PaymentLinkCache()
+    try:
+        cache.prefetch(tg_user, [VPN_PRICE])
+        await cache.pending[tg_user.id]
+        assert len(created) == 1
+
+        async with async_session() as session:
+            status = (await session.execute(select(Payment.status).where(Payment.id == created[0]))).scalar_one()
+            assert status == PREPARED_STATUS
+
+        link = await cache.ready(tg_user, VPN_PRICE)
+        # Ссылка хранится в payments: ее находит и другой процесс (или бот после перезапуска)
+        again = await PaymentLinkCache().take(tg_user, VPN_PRICE)
+        assert link.payment_id == again.payment_id == created[0]
+        assert again.url == f'https://pay.test/{created[0]}'
+        assert len(created) == 1
+
+        # После оплаты ссылка больше не выдается
+        async with async_session() as session:
+            await session.execute(update(Payment).where(Payment.id == link.payment_id).values(status=PAID_STATUS))
+            await session.commit()
+        fresh = await cache.take(tg_user, VPN_PRICE)
+        assert fresh.payment_id != link.payment_id
+        assert len(created) == 2
+    finally:
+        async with async_session() as session:
+            user_id = (await session.execute(select(User.id).where(User.telegram_id == tg_user.id))).scalar_one()
+            await session.execute(delete(Payment).where(Payment.user_id == user_id))
+            await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_take_does_not_wait_for_prefetch_of_other_amount(monkeypatch):
+    """Фоновое создание ссылки на другую сумму не задерживает создание выбранной"""
+    release = asyncio.Event()
+    created = []
+
+    async def fake_create(self, payment_id, amount):
+        if amount == VPN_PRICE:
+            await release.wait()
+        created.append(amount)
+        return {'id': f'link-{payment_id}', 'url': f'https://pay.test/{payment_id}', 'status': OPENED_STATUS}
+
+    monkeypatch.setattr(payment_links_module.DonateApi, 'create_donate_url', fake_create)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    tg_user = SimpleNamespace(id=770303, username="test_links_other_amount")
+    cache = PaymentLinkCache()
+    try:
+        cache.prefetch(tg_user, [VPN_PRICE, VPN_PRICE_3])
+        while cache.prefetching.get(tg_user.id) != VPN_PRICE:
+            await asyncio.sleep(0.01)
+
+        link = await asyncio.wait_for(cache.take(tg_user, VPN_PRICE_3), timeout=5)
+        assert link.amount == VPN_PRICE_3
+        assert created == [VPN_PRICE_3]
+        assert not cache.pending[tg_user.id].done()
+    finally:
+        release.set()
+        task = cache.pending.get(tg_user.id)
+        if task:
+            await task
+        async with async_session() as session:
+            user_id = (await session.execute(select(User.id).where(User.telegram_id == tg_user.id))).scalar_one()
+            await session.execute(delete(Payment).where(Payment.user_id == user_id))
+            await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_unused_prepared_link_expires():
+    """Невыбранная заранее созданная ссылка истекает без опроса WATA"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        user = User(telegram_id=770302, username="test_links_expire")
+        session.add(user)
+        await session.commit()
+        payment = Payment(user_id=user.id, status=PREPARED_STATUS, payment_id='links-prepared-old',
+                          created_at=datetime.utcnow() - PREPARED_LINK_TTL - timedelta(minutes=1))
+        session.add(payment)
+        await session.commit()
+
+    try:
+        poller = PaymentPoller(bot=None)
+        due = await poller.load_due_payments(datetime.utcnow())
+        assert all(payment_id != 'links-prepared-old' for _, payment_id in due)
+        async with async_session() as session:
+            status = (await session.execute(select(Payment.status).where(Payment.id == payment.id))).scalar_one()
+            assert status == EXPIRED_STATUS
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Payment).where(Payment.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
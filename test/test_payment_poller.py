@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Тест фоновой проверки платежей: истечение ссылок по ответу WATA,
+очередь опроса до LIMIT и пауза после 429
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, delete
+
+from bot.payment_poller import PaymentPoller, EXPIRED_STATUS, PREPARED_STATUS, MIN_BACKOFF
+from db.database import engine, async_session
+from db.models import Base, User, Payment
+
+EXPIRED_LINK = {'status': 'Opened', 'expirationDateTime': '2000-01-01T00:00:00.000Z'}
+
+
+class FakeDonateApi:
+    def __init__(self, response):
+        self.response = response
+        self.calls = []
+
+    async def find_donate_url(self, payment_id):
+        self.calls.append(payment_id)
+        return self.response
+
+
+async def create_payments(telegram_id: int, payments: list) -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as session:
+        user = User(telegram_id=telegram_id, username=f"test_poller_{telegram_id}", balance=0.0)
+        session.add(user)
+        await session.commit()
+        for payment in payments:
+            payment.user_id = user.id
+        session.add_all(payments)
+        await session.commit()
+        return user.id
+
+
+async def statuses(user_id: int) -> dict:
+    async with async_session() as session:
+        result = await session.execute(select(Payment.payment_id, Payment.status).where(Payment.user_id == user_id))
+        return dict(result.all())
+
+
+async def cleanup(user_id: int):
+    async with async_session() as session:
+        await session.execute(delete(Payment).where(Payment.user_id == user_id))
+        await session.execute(delete(User).where(User.id == user_id))
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_poller_asks_wata_before_expiring_and_backs_off():
+    """Старая ссылка не истекает без ответа WATA; после первого 429 опрос встает на паузу"""
+    now = datetime.utcnow()
+    user_id = await create_payments(770101, [
+        Payment(status='Opened', payment_id='poller-stale', created_at=now - timedelta(days=3)),
+        *[
+            Payment(status='Opened', payment_id=f'poller-fresh-{i}', created_at=now - timedelta(minutes=i))
+            for i in range(3)
+        ],
+        Payment(status=PREPARED_STATUS, payment_id='poller-prepared', created_at=now - timedelta(hours=2)),
+    ])
+    poller = PaymentPoller(bot=None, concurrency=1)
+    poller.donate_api = FakeDonateApi({'status': 'Time'})
+
+    try:
+        await poller.run()
+
+        # Один запрос получил 429, остальные в этом проходе не отправлялись
+        assert poller.donate_api.calls == ['poller-stale']
+        assert poller.backoff == MIN_BACKOFF
+
+        # Во время паузы WATA не опрашивается
+        await poller.run()
+        assert len(poller.donate_api.calls) == 1
+
+        result = await statuses(user_id)
+        assert result['poller-stale'] == 'Opened'
+        # Невыбранная заранее созданная ссылка истекает без запроса
+        assert result['poller-prepared'] == EXPIRED_STATUS
+
+        # WATA подтвердила истечение - только тогда Expired
+        poller.backoff_until = None
+        poller.donate_api = FakeDonateApi(EXPIRED_LINK)
+        await poller.run()
+        assert 'poller-stale' in poller.donate_api.calls
+        assert (await statuses(user_id))['poller-stale'] == EXPIRED_STATUS
+    finally:
+        await cleanup(user_id)
+
+
+@pytest.mark.asyncio
+async def test_due_payments_are_selected_before_limit():
+    """Недавно проверенные свежие платежи не вытесняют из выборки старый, которому пора"""
+    now = datetime.utcnow()
+    user_id = await create_payments(770102, [
+        Payment(status='Opened', payment_id='poller-due', created_at=now - timedelta(hours=1),
+                checked_at=now - timedelta(minutes=10)),
+        *[
+            Payment(status='Opened', payment_id=f'poller-checked-{i}', created_at=now - timedelta(minutes=i),
+                    checked_at=now - timedelta(seconds=10))
+            for i in range(3)
+        ],
+    ])
+    poller = PaymentPoller(bot=None, batch_limit=2)
+    poller.donate_api = FakeDonateApi({'status': 'Opened', 'expirationDateTime': '2999-01-01T00:00:00.000Z'})
+
+    try:
+        due = await poller.load_due_payments(now)
+        assert [payment_id for _, payment_id in due if payment_id.startswith('poller-')] == ['poller-due']
+
+        await poller.run()
+        assert 'poller-due' in poller.donate_api.calls
+        assert (await statuses(user_id))['poller-due'] == 'Opened'
+        # Время запроса сохранено: в следующем проходе платеж еще не в очереди
+        assert 'poller-due' not in [payment_id for _, payment_id in await poller.load_due_payments(datetime.utcnow())]
+    finally:
+        await cleanup(user_id)
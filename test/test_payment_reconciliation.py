@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Тест сверки платежей с WATA: классификация, пакетное исправление
+и постраничное чтение
+"""
+
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from sqlalchemy import select, delete
+
+import bot.payment_reconciliation as reconciliation
+from bot.donate_api import WataRateLimited
+from bot.payment_reconciliation import PaymentReconciler, EXPIRED, STUCK_PENDING, MISSED_PAID, AMOUNT_MISMATCH, \
+    NOT_FOUND, THROTTLED, ERROR
+from bot.payment_processing import OPENED_STATUS, PAID_STATUS, EXPIRED_STATUS
+from db.database import engine, async_session
+from db.models import Base, User, Payment
+
+
+def wata_link(status, amount=100.0, expires_in=timedelta(days=1)):
+    expiration = (datetime.utcnow() + expires_in).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return {'status': status, 'amount': amount, 'expirationDateTime': expiration}
+
+
+class FakeDonateApi:
+    def __init__(self, links):
+        self.links = links
+
+    async def get_link(self, wata_id):
+        link = self.links.get(wata_id)
+        if isinstance(link, Exception):
+            raise link
+        return link
+
+
+@pytest.mark.asyncio
+async def test_reconciliation_classifies_and_fixes(monkeypatch):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    now = datetime.utcnow()
+    async with async_session() as session:
+        user = User(telegram_id=770401, username="test_reconcile_user")
+        session.add(user)
+        await session.commit()
+        payments = {
+            'ok': Payment(user_id=user.id, status=PAID_STATUS, amount=100.0, payment_id='rec-ok'),
+            'expired': Payment(user_id=user.id, status=OPENED_STATUS, payment_id='rec-expired'),
+            'missed': Payment(user_id=user.id, status=OPENED_STATUS, payment_id='rec-missed'),
+            'amount': Payment(user_id=user.id, status=PAID_STATUS, amount=50.0, payment_id='rec-amount'),
+            'stuck': Payment(user_id=user.id, status='pending', created_at=now - timedelta(hours=2)),
+            'unknown': Payment(user_id=user.id, status=OPENED_STATUS, payment_id='rec-unknown'),
+            'throttled': Payment(user_id=user.id, status=OPENED_STATUS, payment_id='rec-throttled'),
+            'error': Payment(user_id=user.id, status=OPENED_STATUS, payment_id='rec-error'),
+        }
+        session.add_all(payments.values())
+        await session.commit()
+        ids = {name: payment.id for name, payment in payments.items()}
+
+    reconciler = PaymentReconciler()
+    reconciler.donate_api = FakeDonateApi({
+        'rec-ok': wata_link(PAID_STATUS),
+        'rec-expired': wata_link(OPENED_STATUS, expires_in=-timedelta(hours=1)),
+        'rec-missed': wata_link(PAID_STATUS),
+        'rec-amount': wata_link(PAID_STATUS),
+        'rec-throttled': WataRateLimited(30),
+        'rec-error': httpx.ConnectTimeout("timeout"),
+    })
+    monkeypatch.setattr(reconciliation, 'MAX_RATE_LIMIT_RETRIES', 1)
+
+    try:
+        report = await reconciler.run()
+        assert report.mismatches[EXPIRED] == [ids['expired']]
+        assert report.mismatches[MISSED_PAID] == [ids['missed']]
+        assert report.mismatches[AMOUNT_MISMATCH] == [ids['amount']]
+        assert ids['stuck'] in report.mismatches[STUCK_PENDING]
+        # Не проверенные из-за 429 и ошибок не выдаются за отсутствующие в WATA
+        assert report.mismatches[NOT_FOUND] == [ids['unknown']]
+        assert report.mismatches[THROTTLED] == [ids['throttled']]
+        assert report.mismatches[ERROR] == [ids['error']]
+        assert report.fixed >= 2
+        assert "Расхождение суммы" in report.format()
+
+        async with async_session() as session:
+            result = await session.execute(select(Payment.id, Payment.status).where(Payment.user_id == user.id))
+            statuses = dict(result.all())
+        assert statuses[ids['expired']] == EXPIRED_STATUS
+        assert statuses[ids['stuck']] == EXPIRED_STATUS
+        # Оплаченный в WATA платеж не закрывается автоматически
+        assert statuses[ids['missed']] == OPENED_STATUS
+        assert statuses[ids['throttled']] == OPENED_STATUS
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Payment).where(Payment.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_reconciliation_pages_without_open_transaction(monkeypatch):
+    """Платежи читаются страницами; во время запросов к WATA сессия БД не открыта"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        user = User(telegram_id=770402, username="test_reconcile_pages")
+        session.add(user)
+        await session.commit()
+        session.add_all(
+            Payment(user_id=user.id, status=PAID_STATUS, amount=100.0, payment_id=f'rec-page-{i}')
+            for i in range(5)
+        )
+        await session.commit()
+
+    open_sessions = []
+
+    class CountingSession:
+        def __init__(self):
+            self.session = async_session()
+
+        async def __aenter__(self):
+            open_sessions.append(self)
+            return await self.session.__aenter__()
+
+        async def __aexit__(self, *exc_info):
+            open_sessions.remove(self)
+            return await self.session.__aexit__(*exc_info)
+
+    class CheckingDonateApi:
+        checked = []
+
+        async def get_link(self, wata_id):
+            assert not open_sessions
+            self.checked.append(wata_id)
+            return wata_link(PAID_STATUS)
+
+    monkeypatch.setattr(reconciliation, 'async_session', CountingSession)
+    monkeypatch.setattr(reconciliation, 'BATCH_SIZE', 2)
+    reconciler = PaymentReconciler()
+    reconciler.donate_api = CheckingDonateApi()
+
+    try:
+        report = await reconciler.run()
+        assert {f'rec-page-{i}' for i in range(5)} <= set(reconciler.donate_api.checked)
+        assert report.checked == len(reconciler.donate_api.checked)
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Payment).where(Payment.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
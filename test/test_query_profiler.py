@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тесты профилировщика SQL-запросов и фикстуры query_budget
+"""
+
+import pytest
+from sqlalchemy import select
+
+from db.database import engine, async_session
+from db.models import Base, User
+from db.query_profiler import query_profiler
+
+
+async def create_users(count: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as session:
+        for i in range(count):
+            session.add(User(telegram_id=990000 + i, username=f"test_profiler_{i}"))
+        await session.commit()
+
+
+async def delete_users():
+    async with async_session() as session:
+        result = await session.execute(select(User).where(User.username.like('test_profiler_%')))
+        for user in result.scalars().all():
+            await session.delete(user)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_single_query_fits_budget(query_budget):
+    """Одна выборка списка укладывается в бюджет в один запрос"""
+    await create_users(5)
+    try:
+        with query_budget("list_users", max_queries=1, max_repeats=1) as run:
+            async with async_session() as session:
+                result = await session.execute(select(User).where(User.username.like('test_profiler_%')))
+                users = result.scalars().all()
+
+        assert len(users) == 5
+        assert run.queries == 1
+        print(f"✅ list_users: {run.queries} запрос, {run.total_time * 1000:.1f} мс")
+    finally:
+        await delete_users()
+
+
+@pytest.mark.asyncio
+async def test_n_plus_one_is_detected(query_budget):
+    """Запрос в цикле превышает бюджет и помечается как N+1"""
+    await create_users(5)
+    try:
+        with pytest.raises(AssertionError):
+            with query_budget("users_one_by_one", max_queries=10, max_repeats=1):
+                async with async_session() as session:
+                    for i in range(5):
+                        await session.execute(select(User).where(User.telegram_id == 990000 + i))
+
+        assert query_profiler.stats["users_one_by_one"].n_plus_one == 1
+        print("✅ N+1 обнаружен")
+    finally:
+        await delete_users()
+        query_profiler.reset()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тест маршрутизации чтения на реплику.
+Вторая SQLite база выступает в роли отстающей реплики.
+"""
+
+import os
+import tempfile
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, delete, insert, event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import db.database as database
+from db.models import Base, User
+
+
+@pytest_asyncio.fixture
+async def replica(monkeypatch):
+    """Подменяет реплику отдельным файлом SQLite"""
+    path = os.path.join(tempfile.mkdtemp(), 'replica.db')
+    replica_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with database.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    monkeypatch.setattr(database, 'replica_engine', replica_engine)
+    monkeypatch.setattr(database, 'async_read_session',
+                        sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(database, '_recent_writes', {})
+    yield replica_engine
+    await replica_engine.dispose()
+
+
+async def find_user(read_session, telegram_id):
+    async with read_session as session:
+        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+        return result.scalar_one_or_none()
+
+
+@pytest.mark.asyncio
+async def test_recent_writer_reads_from_primary(replica, monkeypatch):
+    """Пользователь, только что изменивший данные, читает с primary; остальные - с реплики"""
+    telegram_id = 880001
+    async with database.async_session() as session:
+        session.add(User(telegram_id=telegram_id, username="test_replica_user"))
+        await session.commit()
+
+    try:
+        # Запись видна на primary сразу после commit
+        assert database.is_recently_written(telegram_id)
+        assert await find_user(database.read_session(telegram_id), telegram_id) is not None
+
+        # Анонимное чтение идет на реплику, где строки еще нет
+        assert await find_user(database.read_session(), telegram_id) is None
+
+        # После окна задержки пользователь тоже читает с реплики
+        monkeypatch.setattr(database, 'DB_REPLICA_MAX_LAG', 0)
+        assert await find_user(database.read_session(telegram_id), telegram_id) is None
+        print("✅ Маршрутизация чтения работает")
+    finally:
+        async with database.async_session() as session:
+            await session.execute(delete(User).where(User.telegram_id == telegram_id))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_replica_read_does_not_query_primary(replica):
+    """Выбор базы не стоит запроса к primary: чтение пользователя идет только на реплику"""
+    telegram_id = 880002
+    async with replica.begin() as conn:
+        await conn.execute(insert(User).values(telegram_id=telegram_id, username="test_replica_read", balance=0))
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.engine.sync_engine, 'before_cursor_execute', count)
+    try:
+        assert (await find_user(database.read_session(telegram_id), telegram_id)).username == "test_replica_read"
+        assert statements == []
+    finally:
+        event.remove(database.engine.sync_engine, 'before_cursor_execute', count)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Тест кэша номеров строк листа: одно чтение на построение, перестройка при промахе
+"""
+
+from sheets.row_index import RowIndex
+
+
+class FakeSheet:
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = 0
+
+    def row_values(self, row):
+        self.reads += 1
+        return list(self.rows[row - 1])
+
+    def col_values(self, col):
+        self.reads += 1
+        return [row[col - 1] for row in self.rows]
+
+
+def test_lookup_is_cached_and_rebuilt_on_miss():
+    sheet = FakeSheet([
+        ['id', 'telegram_id', 'balance'],
+        ['1', '111', '0'],
+        ['2', '222', '10'],
+    ])
+    index = RowIndex(sheet)
+
+    assert index.find('telegram_id', 222) == 3
+    assert index.find('telegram_id', '111') == 2
+    assert sheet.reads == 2  # заголовок и ключевая колонка
+    assert index.cell('balance', 3) == 'C3'
+
+    # Строку дописали в обход индекса: промах перестраивает индекс
+    sheet.rows.append(['3', '333', '0'])
+    assert index.find('telegram_id', 333) == 4
+    assert index.find('telegram_id', 999) is None
+
+
+def test_append_updates_index_without_reads():
+    sheet = FakeSheet([['id', 'telegram_id'], ['1', '111']])
+    index = RowIndex(sheet)
+    assert index.find('id', 1) == 2
+    reads = sheet.reads
+
+    index.appended(['2', '222'], {'updates': {'updatedRange': "Users!A3:B3"}})
+    assert index.find('id', 2) == 3
+    assert sheet.reads == reads
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Тест сегментов аудитории: фильтры собираются в один запрос, размер считается COUNT,
+рассылка получает ровно пользователей сегмента
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from bot.broadcast import BroadcastEngine
+from db.models import Base, User, Payment, Server, BroadcastRecipient
+from db.service.segment_service import Segment, count_segment, segment_conditions
+from db.service.stats_service import PAID_STATUS
+
+
+@pytest_asyncio.fixture
+async def sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/segments.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    now = datetime.utcnow()
+    async with factory() as session:
+        session.add_all([Server(id=1, name="NL", url="http://nl"), Server(id=2, name="DE", url="http://de")])
+        session.add_all([
+            # Активна еще месяц, платил
+            User(id=1, telegram_id=101, is_active=True, subscription_end=now + timedelta(days=30),
+                 trial_used=True, server_id=1),
+            # Истекает через 2 дня, только пробный период
+            User(id=2, telegram_id=102, is_active=True, subscription_end=now + timedelta(days=2),
+                 trial_used=True, server_id=2),
+            # Флаг еще не снят планировщиком, но подписка уже закончилась
+            User(id=3, telegram_id=103, is_active=True, subscription_end=now - timedelta(days=1),
+                 trial_used=True, server_id=1),
+            # Новый пользователь без подписки
+            User(id=4, telegram_id=104, is_active=False, trial_used=False),
+            # Заблокировал бота
+            User(id=5, telegram_id=105, is_active=True, subscription_end=now + timedelta(days=5),
+                 trial_used=True, server_id=1, bot_blocked_at=now),
+        ])
+        session.add_all([
+            Payment(user_id=1, amount=100, payment_id="p1", status=PAID_STATUS),
+            Payment(user_id=4, amount=100, payment_id="p2", status="Opened"),
+        ])
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+async def members(sessions, segment: Segment) -> set:
+    async with sessions() as session:
+        result = await session.execute(select(User.telegram_id).where(*segment_conditions(segment)))
+        return set(result.scalars())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("segment, expected", [
+    (Segment(), {101, 102, 103, 104}),
+    (Segment(active=True), {101, 102}),
+    (Segment(active=False), {103, 104}),
+    (Segment(expiring_within_days=3), {102}),
+    (Segment(trial_used=False), {104}),
+    (Segment(server_id=1), {101, 103}),
+    (Segment(paid=False), {102, 103, 104}),
+    (Segment(blocked=True), {105}),
+    (Segment(blocked=None, server_id=1, active=True), {101, 105}),
+])
+async def test_segment_filters(sessions, segment, expected):
+    assert await members(sessions, segment) == expected
+    async with sessions() as session:
+        assert await count_segment(session, segment) == len(expected)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_gets_only_segment(sessions):
+    segment = Segment.from_dict(Segment(active=True, paid=False).to_dict())
+    broadcast = await BroadcastEngine(session_factory=sessions).create("Продлите подписку", segment=segment)
+
+    assert broadcast.total == 1
+    assert broadcast.segment == segment.to_dict()
+    async with sessions() as session:
+        result = await session.execute(
+            select(BroadcastRecipient.telegram_id).where(BroadcastRecipient.broadcast_id == broadcast.id)
+        )
+        assert list(result.scalars()) == [102]
+    assert segment.describe() == "подписка активна, ни разу не платили"
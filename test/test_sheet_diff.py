@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест сравнения таблицы с листом: совпадающие блоки не читаются построчно,
+расхождения находятся с точностью до id и поля
+"""
+
+import pytest
+from gspread.utils import a1_range_to_grid_range
+from sqlalchemy import select, delete
+
+from db.database import engine, async_session
+from db.models import Base, Server
+from sheets.sheet_diff import diff_table, normalize
+from sheets.sheets_writer import sheets_writer
+
+HEADERS = ['id', 'name', 'is_active']
+
+
+def server_row(server: Server) -> list:
+    return [str(server.id), str(server.name), str(server.is_active)]
+
+
+class FakeSheet:
+    id = 'fake'
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = 0
+
+    def _range(self, name):
+        grid = a1_range_to_grid_range(name)
+        rows = [list(row[grid['startColumnIndex']:grid['endColumnIndex']])
+                for row in self.rows[grid['startRowIndex']:grid['endRowIndex']]]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def get(self, name):
+        self.reads += 1
+        return self._range(name)
+
+    def batch_get(self, names):
+        self.reads += 1
+        return [self._range(name) for name in names]
+
+
+def test_normalize_matches_sheets_formatting():
+    assert normalize(100.0) == normalize('100')
+    assert normalize(True) == normalize('TRUE')
+    assert normalize(' abc ') == 'abc'
+    assert normalize(None) == ''
+
+
+@pytest.mark.asyncio
+async def test_diff_reports_exact_keys_and_fields():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        servers = [Server(name=f"test_diff_{i}", url=f"http://diff{i}", is_active=True) for i in range(6)]
+        session.add_all(servers)
+        await session.commit()
+        ids = [server.id for server in servers]
+
+        result = await session.execute(select(Server).order_by(Server.id))
+        rows = [HEADERS] + [server_row(server) for server in result.scalars()]
+
+    try:
+        # Лист в другом порядке и с форматированием Sheets совпадает с БД
+        sheet = FakeSheet([rows[0]] + [[cells[0], cells[1], cells[2].upper()] for cells in reversed(rows[1:])])
+        async with async_session() as session:
+            diff = await diff_table(session, Server, server_row, sheet, HEADERS, block_size=2, chunk_size=3)
+        assert diff.ok
+        assert diff.db_rows == diff.sheet_rows == len(rows) - 1
+        assert diff.header == HEADERS
+        assert diff.sheet_reads == sheet.reads  # только чтение кусками, без построчного
+
+        # Правка поля, пропавшая строка и лишняя строка
+        by_id = {cells[0]: cells for cells in sheet.rows[1:]}
+        by_id[str(ids[1])][1] = "renamed"
+        sheet.rows.remove(by_id[str(ids[4])])
+        sheet.rows.append(['999999', 'ghost', 'True'])
+        async with async_session() as session:
+            diff = await diff_table(session, Server, server_row, sheet, HEADERS, block_size=2, chunk_size=3)
+
+        assert not diff.ok
+        assert diff.changed == [(str(ids[1]), 'name', "test_diff_1", "renamed")]
+        assert diff.missing_in_sheet == [str(ids[4])]
+        assert diff.extra_in_sheet == ['999999']
+        assert len(diff.mismatched_blocks) <= 3
+    finally:
+        await sheets_writer.close()
+        async with async_session() as session:
+            await session.execute(delete(Server).where(Server.id.in_(ids)))
+            await session.commit()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Тест очереди Google Sheets: работа вне event loop, порядок по ключу и переполнение
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from sheets.sheets_writer import SheetsWriter, UpdateCoalescer
+
+
+@pytest.mark.asyncio
+async def test_writes_run_in_pool_in_key_order():
+    writer = SheetsWriter(max_queue=10, workers=2)
+    calls = []
+    main_thread = threading.get_ident()
+
+    def slow_write(value):
+        time.sleep(0.02)
+        calls.append((value, threading.get_ident() != main_thread))
+
+    try:
+        for value in range(3):
+            assert writer.enqueue(slow_write, value, key='row-1')
+        assert await writer.run(lambda: 'done') == 'done'
+        await writer.join()
+        assert calls == [(0, True), (1, True), (2, True)]
+        assert writer.key_locks == {}
+    finally:
+        await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_without_blocking():
+    writer = SheetsWriter(max_queue=1, workers=1)
+    release = threading.Event()
+
+    try:
+        writer.enqueue(release.wait, 1)
+        await asyncio.sleep(0.01)  # первая операция уже в пуле
+        assert writer.enqueue(lambda: None)
+        assert not writer.enqueue(lambda: None)
+        assert writer.dropped == 1
+    finally:
+        release.set()
+        await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_updates_are_coalesced_per_sheet():
+    """Обновления за окно уходят одной операцией на лист, последняя запись поля побеждает"""
+    writer = SheetsWriter(max_queue=10, workers=1)
+    flushed = []
+    sheet = type('Sheet', (), {'id': 1})()
+    coalescer = UpdateCoalescer(writer, lambda sheet, rows: flushed.append(rows), window=0.05)
+
+    try:
+        coalescer.add(sheet, 'id', 1, {'balance': '10', 'is_active': 'False'})
+        coalescer.add(sheet, 'id', 2, {'balance': '5'})
+        coalescer.add(sheet, 'id', 1, {'balance': '20'})
+        await asyncio.sleep(0.1)
+        await writer.join()
+        assert flushed == [{
+            ('id', '1'): {'balance': '20', 'is_active': 'False'},
+            ('id', '2'): {'balance': '5'},
+        }]
+    finally:
+        await writer.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Тест дневных сводок: пересчет дня, итоги из предыдущей сводки и сумма за период
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete
+
+from config.config import VPN_PRICE, VPN_PRICE_3
+from db.database import engine, async_session
+from db.models import Base, User, Payment, DailyStats, DailyRevenue
+from db.service.stats_service import rollup_day, get_period_stats, count_totals
+
+
+@pytest.mark.asyncio
+async def test_rollup_day_counts_only_that_day():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    # Далекий день, чтобы не пересекаться с данными других тестов
+    day = datetime(2001, 3, 10)
+    async with async_session() as session:
+        users = [
+            User(telegram_id=770501, username="test_stats_1", created_at=day + timedelta(hours=1), trial_used=True),
+            User(telegram_id=770502, username="test_stats_2", created_at=day + timedelta(hours=2),
+                 subscription_end=day + timedelta(hours=20)),
+            User(telegram_id=770503, username="test_stats_3", created_at=day - timedelta(days=1)),
+        ]
+        session.add_all(users)
+        await session.commit()
+        session.add_all([
+            Payment(user_id=users[0].id, status='Closed', amount=VPN_PRICE, created_at=day,
+                    completed_at=day + timedelta(hours=3)),
+            Payment(user_id=users[1].id, status='Closed', amount=VPN_PRICE_3, created_at=day,
+                    completed_at=day + timedelta(hours=4)),
+            Payment(user_id=users[1].id, status='Opened', amount=VPN_PRICE, created_at=day),
+        ])
+        await session.commit()
+        user_ids = [user.id for user in users]
+
+    try:
+        async with async_session() as session:
+            await rollup_day(session, day.date(), now=day + timedelta(days=2))
+            await session.commit()
+            # Повторный пересчет не дублирует строки
+            stats = await rollup_day(session, day.date(), now=day + timedelta(days=2))
+            await session.commit()
+            period = await get_period_stats(session, days=1, today=day.date())
+
+        assert (stats.new_users, stats.trials, stats.churned) == (2, 1, 1)
+        assert (stats.renewals_1, stats.renewals_3, stats.renewals_6) == (1, 1, 0)
+        assert period['revenue']['wata'] == (2, VPN_PRICE + VPN_PRICE_3)
+        assert period['new_users'] == 2
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(DailyRevenue).where(DailyRevenue.day == day.date()))
+            await session.execute(delete(DailyStats).where(DailyStats.day == day.date()))
+            await session.execute(delete(Payment).where(Payment.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.id.in_(user_ids)))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_rollup_day_derives_totals_from_previous_day():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    day = datetime(2002, 5, 10)
+    previous = day.date() - timedelta(days=1)
+    paid_at = day + timedelta(hours=5)
+    async with async_session() as session:
+        session.add(DailyStats(day=previous, total_users=100, active_users=40, total_payments=300,
+                               updated_at=day + timedelta(minutes=5)))
+        users = [
+            # Новый пользователь с пробной подпиской
+            User(telegram_id=770511, username="test_totals_1", created_at=day + timedelta(hours=1),
+                 subscription_end=day + timedelta(days=3)),
+            # Продлил истекшую подписку: срок считается от оплаты
+            User(telegram_id=770512, username="test_totals_2", created_at=day - timedelta(days=60),
+                 subscription_end=paid_at + timedelta(days=30, seconds=1)),
+            # Продлил активную подписку - число активных не меняется
+            User(telegram_id=770513, username="test_totals_3", created_at=day - timedelta(days=60),
+                 subscription_end=day + timedelta(days=50)),
+            # Подписка закончилась в этот день
+            User(telegram_id=770514, username="test_totals_4", created_at=day - timedelta(days=60),
+                 subscription_end=day + timedelta(hours=8)),
+        ]
+        session.add_all(users)
+        await session.commit()
+        session.add_all([
+            Payment(user_id=users[1].id, status='Closed', amount=VPN_PRICE, created_at=day, completed_at=paid_at),
+            Payment(user_id=users[2].id, status='Closed', amount=VPN_PRICE, created_at=day, completed_at=paid_at),
+        ])
+        await session.commit()
+        user_ids = [user.id for user in users]
+
+    try:
+        async with async_session() as session:
+            stats = await rollup_day(session, day.date(), now=day + timedelta(days=2))
+            await session.commit()
+            assert (stats.total_users, stats.active_users, stats.total_payments) == (101, 41, 302)
+
+            # Сверка считает итоги по таблицам заново
+            stats = await rollup_day(session, day.date(), now=day + timedelta(days=2), reconcile=True)
+            await session.commit()
+            end = day + timedelta(days=1)
+            assert (stats.total_users, stats.active_users, stats.total_payments) == await count_totals(session, end)
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(DailyStats).where(DailyStats.day.in_([previous, day.date()])))
+            await session.execute(delete(DailyRevenue).where(DailyRevenue.day == day.date()))
+            await session.execute(delete(Payment).where(Payment.user_id.in_(user_ids)))
+            await session.execute(delete(User).where(User.id.in_(user_ids)))
+            await session.commit()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Тест кэша подписки на канал: повторные проверки не ходят в Telegram,
+отказ кэшируется ненадолго, события канала обновляют кэш
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from aiogram.enums import ChatMemberStatus
+
+import bot.utils as utils
+from bot.handlers.start import channel_member_updated
+
+
+class FakeBot:
+    def __init__(self, status):
+        self.status = status
+        self.calls = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        return SimpleNamespace(status=self.status)
+
+
+@pytest.mark.asyncio
+async def test_membership_is_cached(monkeypatch):
+    monkeypatch.setattr(utils, '_membership', {})
+    bot = FakeBot(ChatMemberStatus.MEMBER)
+
+    assert await utils.check_subscription(880001, bot)
+    assert await utils.check_subscription(880001, bot)
+    assert bot.calls == 1
+
+    # Принудительная проверка идет в Telegram
+    bot.status = ChatMemberStatus.LEFT
+    assert not await utils.check_subscription(880001, bot, use_cache=False)
+    assert bot.calls == 2
+
+    # Отказ живет SUBSCRIPTION_NEGATIVE_TTL
+    monkeypatch.setattr(utils, 'SUBSCRIPTION_NEGATIVE_TTL', 0)
+    bot.status = ChatMemberStatus.MEMBER
+    assert await utils.check_subscription(880001, bot)
+    assert bot.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_chat_member_update_refreshes_cache(monkeypatch):
+    monkeypatch.setattr(utils, '_membership', {})
+    monkeypatch.setattr(utils, 'CHANNEL_ID', '-100500')
+    update = SimpleNamespace(
+        chat=SimpleNamespace(id=-100500, username=None),
+        new_chat_member=SimpleNamespace(user=SimpleNamespace(id=880002), status=ChatMemberStatus.MEMBER)
+    )
+    await channel_member_updated(update)
+
+    bot = FakeBot(ChatMemberStatus.LEFT)
+    assert await utils.check_subscription(880002, bot)
+    assert bot.calls == 0
+
+    # События других чатов не учитываются
+    update.chat.id = -1
+    update.new_chat_member.status = ChatMemberStatus.LEFT
+    await channel_member_updated(update)
+    assert utils.cached_membership(880002) is True
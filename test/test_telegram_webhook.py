@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Тест webhook Telegram: проверка секрета, отсев повторов update_id, передача диспетчеру
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import bot.telegram_webhook as telegram_webhook
+from bot.telegram_webhook import UpdateDeduplicator, telegram_router, SECRET_HEADER
+from config.config import TELEGRAM_WEBHOOK_PATH
+from db.database import engine
+from db.models import Base
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.updates = []
+
+    async def feed_update(self, bot, update):
+        self.updates.append(update.update_id)
+
+
+@pytest.mark.asyncio
+async def test_webhook_checks_secret_and_dedupes(monkeypatch):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    dispatcher = FakeDispatcher()
+    monkeypatch.setattr(telegram_webhook, 'TELEGRAM_WEBHOOK_SECRET', 'secret')
+    monkeypatch.setattr(telegram_webhook, 'dp', dispatcher)
+    # Отдельный дедупликатор: другой воркер не видит память этого
+    monkeypatch.setattr(telegram_webhook, 'deduplicator', UpdateDeduplicator())
+
+    app = FastAPI()
+    app.include_router(telegram_router)
+    update = {'update_id': 770001001}
+    await UpdateDeduplicator().release(update['update_id'])
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post(TELEGRAM_WEBHOOK_PATH, json=update, headers={SECRET_HEADER: 'wrong'})
+        assert response.status_code == 403
+
+        response = await client.post(TELEGRAM_WEBHOOK_PATH, json=update, headers={SECRET_HEADER: 'secret'})
+        assert response.json() == {'status': 'ok'}
+
+        response = await client.post(TELEGRAM_WEBHOOK_PATH, json=update, headers={SECRET_HEADER: 'secret'})
+        assert response.json() == {'status': 'duplicate'}
+
+        # Повтор в другом воркере отсекается по таблице
+        monkeypatch.setattr(telegram_webhook, 'deduplicator', UpdateDeduplicator())
+        response = await client.post(TELEGRAM_WEBHOOK_PATH, json=update, headers={SECRET_HEADER: 'secret'})
+        assert response.json() == {'status': 'duplicate'}
+
+    await asyncio.sleep(0)
+    assert dispatcher.updates == [770001001]
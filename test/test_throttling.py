@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тест антифлуда: корзина токенов по группам, объединение повторных нажатий,
+учет отсеченных запросов
+"""
+
+import asyncio
+
+import pytest
+from aiogram import types
+
+from bot.middleware import ThrottlingMiddleware
+from bot.throttling import Throttler, handler_group, parse_rates
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Handler:
+    def __init__(self, callback):
+        self.callback = callback
+
+
+async def check_payment(callback):
+    pass
+
+
+check_payment.__module__ = 'bot.handlers.payment'
+
+
+def test_token_bucket_refills_per_group():
+    clock = Clock()
+    throttler = Throttler(parse_rates('payments=0.5/2'), clock=clock)
+
+    assert [throttler.allow(1, 'payments') for _ in range(3)] == [True, True, False]
+    # Другая группа и другой пользователь тратят свои корзины
+    assert throttler.allow(1, 'default')
+    assert throttler.allow(2, 'payments')
+    assert throttler.retry_after(1, 'payments') == pytest.approx(2.0)
+
+    clock.now = 2.0
+    assert throttler.allow(1, 'payments')
+    assert not throttler.allow(1, 'payments')
+    assert throttler.report()['payments'] == {'passed': 4, 'dropped': 2, 'merged': 0, 'shed_share': 0.3333}
+
+
+def test_handler_group():
+    assert handler_group(check_payment) == 'payments'
+    assert handler_group(None) == 'default'
+
+
+@pytest.mark.asyncio
+async def test_repeated_taps_are_merged_and_limited(monkeypatch):
+    answers = []
+
+    async def answer(self, text=None, **kwargs):
+        answers.append(text)
+
+    monkeypatch.setattr(types.CallbackQuery, 'answer', answer)
+    throttler = Throttler(parse_rates('payments=0.01/2'), clock=Clock())
+    middleware = ThrottlingMiddleware(throttler)
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_handler(event, data):
+        calls.append(event.data)
+        await release.wait()
+
+    def tap():
+        return types.CallbackQuery(
+            id='1', chat_instance='1', data='check_payment:abc',
+            from_user=types.User(id=42, is_bot=False, first_name='Test')
+        )
+
+    data = {'handler': Handler(check_payment)}
+    first = asyncio.create_task(middleware(slow_handler, tap(), data))
+    await asyncio.sleep(0)
+    # Пока первое нажатие обрабатывается, повторы не доходят до обработчика
+    for _ in range(5):
+        await middleware(slow_handler, tap(), data)
+    release.set()
+    await first
+
+    await middleware(slow_handler, tap(), data)
+    await middleware(slow_handler, tap(), data)
+
+    assert len(calls) == 2
+    assert throttler.report()['payments'] == {'passed': 2, 'dropped': 1, 'merged': 5, 'shed_share': 0.75}
+    assert len(answers) == 6
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тест распределения обновлений по процессам: стабильный выбор воркера,
+порядок обновлений одного пользователя, перезапуск упавшего воркера
+"""
+
+import time
+from collections import defaultdict
+
+from bot.bench_sharding import run, make_update
+from bot.update_sharding import ShardedDispatcher, user_key, pick_slot
+
+
+def test_user_key_and_rendezvous():
+    assert user_key({'update_id': 1, 'message': {'from': {'id': 42}, 'chat': {'id': 7}}}) == 42
+    assert user_key({'update_id': 2, 'callback_query': {'from': {'id': 43}}}) == 43
+    assert user_key({'update_id': 3, 'channel_post': {'chat': {'id': -100}}}) == -100
+    assert user_key({'update_id': 4}) == 4
+
+    before = {key: pick_slot(key, {0, 1, 2}) for key in range(1000)}
+    after = {key: pick_slot(key, {0, 2}) for key in range(1000)}
+    # Выключение слота 1 переносит только его ключи
+    assert all(after[key] == slot for key, slot in before.items() if slot != 1)
+    assert len(set(before.values())) == 3
+
+
+def test_per_user_order_is_kept():
+    _, results = run(workers=2, updates=300, users=7, collect_results=True)
+    seen = defaultdict(list)
+    worker_of = {}
+    for worker, (user, seq) in results:
+        if user == 0:
+            continue
+        seen[user].append(seq)
+        assert worker_of.setdefault(user, worker) == worker
+    assert all(seqs == sorted(seqs) for seqs in seen.values())
+    assert sum(len(seqs) for seqs in seen.values()) == 300
+
+
+def test_dead_worker_is_restarted():
+    sharded = ShardedDispatcher(1, handler='bot.bench_sharding:simulated_handler')
+    sharded.start()
+    try:
+        sharded.processes[0].kill()
+        sharded.processes[0].join()
+        assert sharded.check_workers() == [0]
+        sharded.submit(make_update(1, 1, 1))
+        deadline = time.monotonic() + 30
+        while sharded.total_processed < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert sharded.total_processed == 1
+    finally:
+        sharded.stop()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Тест webhook'а WATA: проверка подписи и идемпотентное зачисление по orderId
+"""
+
+import base64
+import json
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from sqlalchemy import select, delete
+
+import bot.handlers.payment as payment_handlers
+from api import app
+from db.database import engine, async_session
+from db.models import Base, User, Payment
+
+
+def make_keys():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_key, public_pem
+
+
+def sign(private_key, body: bytes) -> str:
+    return base64.b64encode(private_key.sign(body, padding.PKCS1v15(), hashes.SHA512())).decode()
+
+
+@pytest.mark.asyncio
+async def test_wata_webhook_credits_once(monkeypatch):
+    """Подписанное уведомление зачисляет платеж один раз, неподписанное отклоняется"""
+    private_key, public_pem = make_keys()
+    monkeypatch.setattr(payment_handlers, '_wata_public_key', public_pem)
+    monkeypatch.setattr(payment_handlers, 'WATA_PUBLIC_KEY', public_pem)
+
+    notified = []
+
+    async def fake_notify(bot, result):
+        notified.append(result['status'])
+
+    monkeypatch.setattr(payment_handlers, 'notify_payment_result', fake_notify)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with async_session() as session:
+        user = User(telegram_id=770001, username="test_webhook_user", balance=0.0)
+        session.add(user)
+        await session.commit()
+        payment = Payment(user_id=user.id, status='Opened', payment_id='test-webhook-link')
+        session.add(payment)
+        await session.commit()
+        user_id, payment_id = user.id, payment.id
+
+    body = json.dumps({
+        'transactionStatus': 'Paid',
+        'orderId': str(payment_id),
+        'amount': 10.0
+    }).encode()
+
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            bad = await client.post("/webhook/wata", content=body, headers={'X-Signature': 'bad'})
+            assert bad.status_code == 400
+
+            headers = {'X-Signature': sign(private_key, body)}
+            first = await client.post("/webhook/wata", content=body, headers=headers)
+            second = await client.post("/webhook/wata", content=body, headers=headers)
+
+        assert first.json()['status'] == 'insufficient'
+        assert second.json()['status'] == 'already_processed'
+        assert notified == ['insufficient', 'already_processed']
+
+        async with async_session() as session:
+            user = (await session.execute(select(User).where(User.id == user_id))).scalar_one()
+            payment = (await session.execute(select(Payment).where(Payment.id == payment_id))).scalar_one()
+            assert user.balance == 10.0
+            assert payment.status == 'Closed'
+        print("✅ Webhook зачислил платеж ровно один раз")
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Payment).where(Payment.id == payment_id))
+            await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_public_key_refresh_is_throttled(monkeypatch):
+    """Поток неверных подписей не тратит лимит WATA, неудачный запрос не стирает ключ"""
+    _, public_pem = make_keys()
+    responses = [public_pem, None]
+    requests = []
+
+    class FakeDonateApi:
+        async def get_public_key(self):
+            requests.append(1)
+            return responses.pop(0) if responses else None
+
+    now = [1000.0]
+    monkeypatch.setattr(payment_handlers, 'WATA_PUBLIC_KEY', None)
+    monkeypatch.setattr(payment_handlers, '_wata_public_key', None)
+    monkeypatch.setattr(payment_handlers, '_wata_public_key_fetched_at', None)
+    monkeypatch.setattr(payment_handlers, 'DonateApi', FakeDonateApi)
+    monkeypatch.setattr(payment_handlers.time, 'monotonic', lambda: now[0])
+
+    body = json.dumps({'transactionStatus': 'Paid', 'orderId': '1', 'amount': 10.0}).encode()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for _ in range(20):
+            response = await client.post("/webhook/wata", content=body, headers={'X-Signature': 'bad'})
+            assert response.status_code == 400
+        assert len(requests) == 1
+
+        # Через интервал ключ запрашивается снова; WATA не ответила - ключ прежний
+        now[0] += payment_handlers.PUBLIC_KEY_REFRESH_INTERVAL
+        await client.post("/webhook/wata", content=body, headers={'X-Signature': 'bad'})
+    assert len(requests) == 2
+    assert payment_handlers._wata_public_key == public_pem